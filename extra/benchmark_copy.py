@@ -0,0 +1,71 @@
+#! /usr/bin/env python
+# Benchmark copying a NITF file, which is what we do when we read a file
+# and write it back out with only metadata changes. The time is mostly
+# copying the segment data, so we compare the methods used by
+# copy_file_data (see pynitf/nitf_copy_data.py).
+#
+# If no files are given on the command line, we generate a sample file with
+# a large image and use that.
+
+import pynitf
+import pynitf.nitf_copy_data
+import argparse
+import numpy as np
+import os
+import tempfile
+import time
+
+def create_sample_file(fname, size_mb):
+    '''Create a file with a single image of about size_mb MB.'''
+    ncol = 4096
+    nrow = size_mb * 1024 * 1024 // (ncol * 2)
+    def data(d, bstart, lstart, sstart):
+        d[:, :, :] = (lstart + sstart) % 65536
+    img = pynitf.NitfImageWriteDataOnDemand(nrow, ncol, np.uint16,
+              data_callback=data, nppbv=1024, nppbh=1024,
+              image_gen_mode=pynitf.NitfImageWriteDataOnDemand.IMAGE_GEN_MODE_BLOCK)
+    f = pynitf.NitfFile()
+    f.image_segment.append(pynitf.NitfImageSegment(img))
+    f.write(fname)
+
+def benchmark_copy(fname, repeat, tdir):
+    '''Time reading fname and writing it out again with each copy
+    method.'''
+    size = os.path.getsize(fname)
+    fout = os.path.join(tdir, "benchmark_copy_out.ntf")
+    for methods in (("copy_file_range",), ("sendfile",), ("buffered",)):
+        if(methods[0] != "buffered" and not hasattr(os, methods[0])):
+            print("%-16s not available" % methods[0])
+            continue
+        pynitf.nitf_copy_data.copy_methods = methods
+        tm = []
+        for i in range(repeat):
+            if(os.path.exists(fout)):
+                os.remove(fout)
+            tstart = time.perf_counter()
+            f = pynitf.NitfFile(fname)
+            f.write(fout)
+            tm.append(time.perf_counter() - tstart)
+        print("%-16s best %.3f s, mean %.3f s, %.0f MB/s" %
+              (methods[0], min(tm), sum(tm) / len(tm),
+               size / min(tm) / (1024 * 1024)))
+
+parser = argparse.ArgumentParser(description="Benchmark copying NITF files")
+parser.add_argument("nitf_file", nargs="*",
+                    help="Files to copy. If not supplied we generate a sample")
+parser.add_argument("--repeat", type=int, default=3,
+                    help="Number of times to copy each file")
+parser.add_argument("--size", type=int, default=512,
+                    help="Size in MB of the generated sample")
+args = parser.parse_args()
+
+with tempfile.TemporaryDirectory() as tdir:
+    if(len(args.nitf_file) > 0):
+        for fname in args.nitf_file:
+            print("Copy %s:" % os.path.basename(fname))
+            benchmark_copy(fname, args.repeat, tdir)
+    else:
+        fname = os.path.join(tdir, "benchmark_sample.ntf")
+        create_sample_file(fname, args.size)
+        print("Copy %d MB sample:" % args.size)
+        benchmark_copy(fname, args.repeat, tdir)
@@ -0,0 +1,127 @@
+#! /usr/bin/env python
+# Simple benchmark for reading NITF files. This isn't installed, it is just
+# something we run by hand when looking at performance.
+#
+# If no files are given on the command line, we generate a sample file with
+# large CSATTB and CSEPHB DESs (similar to what we see in the SNIP files) and
+# use that.
+
+import pynitf
+from pynitf.nitf_field import _compile_expr
+import argparse
+import os
+import tempfile
+import time
+import timeit
+
+def create_sample_file(fname, npoint):
+    '''Create a file with a CSATTB and CSEPHB DES with npoint points.'''
+    f = pynitf.NitfFile()
+    des = pynitf.DesCSATTB()
+    ds = des.user_subheader
+    ds.id = '4385ab47-f3ba-40b7-9520-13d6b7a7f311'
+    ds.numais = '010'
+    for i in range(int(ds.numais)):
+        ds.aisdlvl[i] = 5 + i
+    ds.reservedsubh_len = 0
+    des.qual_flag_att = 1
+    des.interp_type_att = 1
+    des.att_type = 1
+    des.eci_ecf_att = 0
+    des.dt_att = 900.5
+    des.date_att = 20170501
+    des.t0_att = 235959.100001000
+    des.num_att = npoint
+    for n in range(npoint):
+        des.q1[n] = 0.1 + n * 1e-6
+        des.q2[n] = 0.2 + n * 1e-6
+        des.q3[n] = 0.3 + n * 1e-6
+        des.q4[n] = 0.4 + n * 1e-6
+    des.reserved_len = 0
+    f.des_segment.append(pynitf.NitfDesSegment(des))
+    des = pynitf.DesCSEPHB()
+    ds = des.user_subheader
+    ds.id = '4385ab47-f3ba-40b7-9520-13d6b7a7f312'
+    ds.numais = '010'
+    for i in range(int(ds.numais)):
+        ds.aisdlvl[i] = 5 + i
+    ds.reservedsubh_len = 0
+    des.qual_flag_eph = 1
+    des.interp_type_eph = 1
+    des.ephem_flag = 1
+    des.eci_ecf_ephem = 0
+    des.dt_ephem = 900.5
+    des.date_ephem = 20170501
+    des.t0_ephem = 235959.100001000
+    des.num_ephem = npoint
+    for n in range(npoint):
+        des.ephem_x[n] = 1000.0 + n
+        des.ephem_y[n] = 2000.0 + n
+        des.ephem_z[n] = 3000.0 + n
+    des.reserved_len = 0
+    f.des_segment.append(pynitf.NitfDesSegment(des))
+    f.write(fname)
+
+def benchmark_expr():
+    '''Compare evaluating a description expression with eval to calling
+    the compiled version.'''
+    t = pynitf.NitfImageSubheader()
+    t.nbands = 3
+    expr = "f.nluts[i1] != 0"
+    number = 100000
+    t_eval = timeit.timeit(lambda : eval(expr, {}, {"f" : t, "i1" : 1}),
+                           number=number)
+    func = _compile_expr(expr)
+    t_comp = timeit.timeit(lambda : func(t, 1), number=number)
+    print("Expression '%s' x %d:" % (expr, number))
+    print("   eval:     %8.3f s" % t_eval)
+    print("   compiled: %8.3f s (%.1fx faster)" % (t_comp, t_eval / t_comp))
+
+def touch_fields(f):
+    '''Access every field in the file. This is what something like
+    nitf_diff or nitf_info ends up doing.'''
+    fslist = [f.file_header, *f.tre_list]
+    for seg in f.segments():
+        fslist.extend([seg.subheader, *seg.tre_list])
+        if(isinstance(seg.data, pynitf.FieldStruct)):
+            fslist.append(seg.data)
+    for fs in fslist:
+        if(isinstance(fs, pynitf.FieldStruct)):
+            for k, v in fs.items():
+                pass
+
+def benchmark_read(fname, repeat):
+    '''Time reading a file, and then reading and accessing all the
+    fields in the file.'''
+    tm = []
+    tm_access = []
+    for i in range(repeat):
+        tstart = time.perf_counter()
+        f = pynitf.NitfFile(fname)
+        tm.append(time.perf_counter() - tstart)
+        touch_fields(f)
+        tm_access.append(time.perf_counter() - tstart)
+    print("Read %s: best %.3f s, mean %.3f s over %d reads" %
+          (os.path.basename(fname), min(tm), sum(tm) / len(tm), repeat))
+    print("Read and access all fields %s: best %.3f s, mean %.3f s" %
+          (os.path.basename(fname), min(tm_access),
+           sum(tm_access) / len(tm_access)))
+
+parser = argparse.ArgumentParser(description="Benchmark reading NITF files")
+parser.add_argument("nitf_file", nargs="*",
+                    help="Files to read. If not supplied we generate a sample")
+parser.add_argument("--repeat", type=int, default=3,
+                    help="Number of times to read each file")
+parser.add_argument("--npoint", type=int, default=20000,
+                    help="Number of points in the generated sample DESs")
+args = parser.parse_args()
+
+benchmark_expr()
+if(len(args.nitf_file) > 0):
+    for fname in args.nitf_file:
+        benchmark_read(fname, args.repeat)
+else:
+    with tempfile.TemporaryDirectory() as tdir:
+        fname = os.path.join(tdir, "benchmark_sample.ntf")
+        create_sample_file(fname, args.npoint)
+        benchmark_read(fname, args.repeat)
@@ -0,0 +1,81 @@
+#! /usr/bin/env python
+# Simple benchmark for the startup time of pynitf, e.g., what a short
+# lived command line program or a read_many worker process pays. This
+# isn't installed, it is just something we run by hand when looking at
+# performance.
+#
+# We time "import pynitf" plus the first read of a NITF file in a new
+# python process, both without and with the layout cache (see
+# nitf_layout_cache.py). If no file is given on the command line, we
+# generate a sample file with a few image segments and TREs.
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+timing_code = '''
+import time
+tstart = time.perf_counter()
+import pynitf
+timport = time.perf_counter()
+f = pynitf.NitfFile(%r)
+for seg in f.segments():
+    for t in seg.tre_list:
+        str(t)
+tread = time.perf_counter()
+print(timport - tstart, tread - timport)
+'''
+
+def create_sample_file(fname):
+    import pynitf
+    from pynitf_test_support import create_image_seg, create_tre
+    f = pynitf.NitfFile()
+    for i in range(3):
+        create_image_seg(f, iid1="img%d" % i)
+        create_tre(f.image_segment[-1])
+    f.write(fname)
+
+def run_process(fname, env):
+    r = subprocess.run([sys.executable, "-c", timing_code % fname],
+                       env=env, check=True, capture_output=True)
+    timport, tread = [float(v) for v in r.stdout.split()]
+    return (timport, tread, timport + tread)
+
+def time_startup(fname, repeat, env_list):
+    '''Time starting a process with each of the environments in env_list.
+    We alternate between the environments, so any drift in the machine
+    load affects each the same way. Returns the best time for each.'''
+    tm = [[] for env in env_list]
+    for i in range(repeat):
+        for j, env in enumerate(env_list):
+            tm[j].append(run_process(fname, env))
+    return [[min(t[i] for t in tml) for i in range(3)] for tml in tm]
+
+parser = argparse.ArgumentParser(description="Benchmark pynitf startup")
+parser.add_argument("nitf_file", nargs="?",
+                    help="File to read. If not supplied we generate a sample")
+parser.add_argument("--repeat", type=int, default=10,
+                    help="Number of processes to start for each timing")
+args = parser.parse_args()
+
+with tempfile.TemporaryDirectory() as tdir:
+    fname = args.nitf_file
+    if(fname is None):
+        sys.path.append(os.path.dirname(__file__) +
+                        "/../tests/pynitf_test_support")
+        fname = os.path.join(tdir, "benchmark_sample.ntf")
+        create_sample_file(fname)
+    fname = os.path.abspath(fname)
+    env = dict(os.environ)
+    env.pop("PYNITF_CACHE_DIR", None)
+    env_cache = dict(env, PYNITF_CACHE_DIR=os.path.join(tdir, "cache"))
+    # First run fills in the cache
+    run_process(fname, env_cache)
+    no_cache, with_cache = time_startup(fname, args.repeat, [env, env_cache])
+    print("Best of %d processes, reading %s" % (args.repeat,
+                                               os.path.basename(fname)))
+    print("                 import   first read   total")
+    print("No cache:       %7.3f s  %7.3f s  %7.3f s" % tuple(no_cache))
+    print("Layout cache:   %7.3f s  %7.3f s  %7.3f s" % tuple(with_cache))
@@ -1,18 +1,50 @@
-# Just import any files we find in this directory, rather than listing
-# everything
+# We import the core modules needed to read and write a NITF file. The
+# rest (support for particular TREs and DESs, nitf_diff support, etc.) is
+# imported the first time it is needed, see lazy_module_registry.py.
 
 import os as _os
-import glob as _glob
 from .version import __version__
+from .lazy_module_registry import (lazy_module_exports as _lazy_module_exports,
+                                   lazy_name_to_module as _lazy_name_to_module,
+                                   load_lazy_module as _load_lazy_module)
 
-for _i in _glob.glob(_os.path.dirname(__file__) + "/*.py"):
-    _mname = _os.path.basename(_i).split('.')[0]
-    # Don't load ipython, which is ipython magic extensions
-    if(not _mname == 'ipython'):
-        exec("from .%s import *" % _mname)
+_core_module = ["priority_handle_set", "weak_key_value_dict",
+                "nitf_diff_handle", "nitf_field", "nitf_security",
+                "nitf_file_header", "nitf_image_subheader",
+                "nitf_text_subheader", "nitf_graphic_subheader",
+                "nitf_des_subheader", "nitf_res_subheader", "nitf_segment",
+                "nitf_segment_hook", "nitf_segment_user_subheader_handle",
+                "nitf_segment_data_handle", "nitf_tre", "nitf_tre_engrda",
+                "nitf_file", "nitf_copy_data", "nitf_block_cache",
+                "nitf_image_mask", "nitf_pixel_packing", "nitf_image_codec",
+                "nitf_image", "nitf_text",
+                "nitf_des",
+                "lazy_module_registry"]
+
+__all__ = []
+for _mname in _core_module:
+    exec("from .%s import *" % _mname)
+    exec("__all__.extend(%s.__all__)" % _mname)
+__all__.extend(_lazy_name_to_module.keys())
+
+# The layout cache needs to be loaded before we start using the
+# FieldStruct classes
+if(_os.environ.get("PYNITF_CACHE_DIR")):
+    from .nitf_layout_cache import *
+
+def __getattr__(name):
+    '''Import the lazily loaded modules when one of the names they export
+    is used.'''
+    if(name in _lazy_name_to_module):
+        v = getattr(_load_lazy_module(_lazy_name_to_module[name]), name)
+        globals()[name] = v
+        return v
+    if(name in _lazy_module_exports):
+        return _load_lazy_module(name)
+    raise AttributeError("module 'pynitf' has no attribute '%s'" % name)
+
+def __dir__():
+    return sorted(set(globals().keys()) | set(__all__) |
+                  set(_lazy_module_exports.keys()))
 
-del _i
 del _mname
-del _os
-del _glob
-        
@@ -0,0 +1,168 @@
+# Registry of the pynitf modules that we only import when they are needed.
+#
+# Most of pynitf is support for particular TREs and DESs. There isn't any
+# point in importing all of these (and things like h5py that they use)
+# just to read a file header, so we instead list here what each of these
+# modules provides. The module then gets imported the first time it is
+# needed, either because a file contains a TRE tag or DES ID handled by
+# the module, or because something accessed one of the names the module
+# exports (see __getattr__ in pynitf/__init__.py).
+#
+# This is a static list, so if you add a new TRE or DES module (or export
+# a new name from one) you need to add it here. The unit test
+# lazy_module_registry_test.py checks that this is in sync with the modules.
+
+import importlib
+import sys
+
+# Map of module name to the names it exports (i.e., the __all__ for the
+# module)
+lazy_module_exports = {
+    "docopt_simple" : [],
+    "nitf_des_associated_user_subheader" : ["add_uuid_des_function",
+                                            "DesAssociatedUserSubheader"],
+    "nitf_des_csatta" : ["DesCSATTA"],
+    "nitf_des_csattb" : ["DesCSATTB"],
+    "nitf_des_cscsdb" : ["DesCSCSDB"],
+    "nitf_des_csephb" : ["DesCSEPHB"],
+    "nitf_des_cssfab" : ["DesCSSFAB"],
+    "nitf_des_ext_def_content" : ["DesEXT_DEF_CONTENT", "DesEXT_h5",
+                                  "DesExtContentHeader"],
+    "nitf_diff_support" : ["DefaultHandle", "DiffHandle", "DiffHandleList",
+                           "dseg_handle", "DSegHandle", "file_header_handle",
+                           "iseg_handle", "ISegHandle", "nitf_file_diff",
+                           "register_dseg_handle",
+                           "register_file_header_handle",
+                           "register_iseg_handle", "register_tre_handle",
+                           "register_tseg_handle", "tre_handle",
+                           "TREFileHeadHandle", "tseg_handle", "TSegHandle"],
+    "nitf_file_diff" : ["NitfDiff", "NitfFileHandle", "SegmentDiff"],
+    "nitf_file_json" : ["NitfFileJson"],
+    "nitf_file_merge" : ["NitfFileMerge"],
+    "nitf_image_hdf5" : ["NitfImageHDF5"],
+    "nitf_layout_cache" : ["layout_cache_file", "layout_cache_key",
+                           "load_layout_cache", "save_layout_cache"],
+    "nitf_scan" : ["default_scan_file_fields", "default_scan_image_fields",
+                   "NitfReadResult", "read_many", "scan_headers"],
+    "nitf_tre_bandsb" : ["TreBANDSB"],
+    "nitf_tre_camsda" : ["TreCAMSDA"],
+    "nitf_tre_cscrna" : ["TreCSCRNA"],
+    "nitf_tre_csde" : ["TreSTDIDC", "TreUSE00A"],
+    "nitf_tre_csdida" : ["TreCSDIDA"],
+    "nitf_tre_csepha" : ["TreCSEPHA"],
+    "nitf_tre_csexrb" : ["TreCSEXRB"],
+    "nitf_tre_geosde" : ["TreGEOPSB", "TreMAPLOB", "TrePRJPSB"],
+    "nitf_tre_histoa" : ["TreHISTOA"],
+    "nitf_tre_ichipb" : ["TreICHIPB"],
+    "nitf_tre_illuma" : ["TreILLUMA"],
+    "nitf_tre_illumb" : ["TreILLUMB"],
+    "nitf_tre_matesa" : ["TreMATESA"],
+    "nitf_tre_micida" : ["TreMICIDA"],
+    "nitf_tre_mimcsa" : ["TreMIMCSA"],
+    "nitf_tre_mtimfa" : ["TreMTIMFA"],
+    "nitf_tre_mtimsa" : ["TreMTIMSA"],
+    "nitf_tre_piae" : ["TrePIAIMC"],
+    "nitf_tre_pixmta" : ["TrePIXMTA"],
+    "nitf_tre_pixqla" : ["TrePIXQLA"],
+    "nitf_tre_rpc" : ["TreRPC00A", "TreRPC00B"],
+    "nitf_tre_rsmapa" : ["TreRSMAPA"],
+    "nitf_tre_rsmapb" : ["TreRSMAPB"],
+    "nitf_tre_rsmdca" : ["TreRSMDCA"],
+    "nitf_tre_rsmecb" : ["TreRSMECB"],
+    "nitf_tre_rsmgga" : ["TreRSMGGA"],
+    "nitf_tre_rsmgia" : ["TreRSMGIA"],
+    "nitf_tre_rsmida" : ["TreRSMIDA"],
+    "nitf_tre_rsmpca" : ["TreRSMPCA"],
+    "nitf_tre_rsmpia" : ["TreRSMPIA"],
+    "nitf_tre_sensrb" : ["TreSENSRB"],
+    "nitf_tre_tminta" : ["TreTMINTA"],
+}
+
+# Map of TRE tag to the module that handles it.
+tre_tag_to_module = {
+    "BANDSB" : "nitf_tre_bandsb",
+    "CAMSDA" : "nitf_tre_camsda",
+    "CSCRNA" : "nitf_tre_cscrna",
+    "CSDIDA" : "nitf_tre_csdida",
+    "CSEPHA" : "nitf_tre_csepha",
+    "CSEXRB" : "nitf_tre_csexrb",
+    "GEOPSB" : "nitf_tre_geosde",
+    "HISTOA" : "nitf_tre_histoa",
+    "ICHIPB" : "nitf_tre_ichipb",
+    "ILLUMA" : "nitf_tre_illuma",
+    "ILLUMB" : "nitf_tre_illumb",
+    "MAPLOB" : "nitf_tre_geosde",
+    "MATESA" : "nitf_tre_matesa",
+    "MICIDA" : "nitf_tre_micida",
+    "MIMCSA" : "nitf_tre_mimcsa",
+    "MTIMFA" : "nitf_tre_mtimfa",
+    "MTIMSA" : "nitf_tre_mtimsa",
+    "PIAIMC" : "nitf_tre_piae",
+    "PIXMTA" : "nitf_tre_pixmta",
+    "PIXQLA" : "nitf_tre_pixqla",
+    "PRJPSB" : "nitf_tre_geosde",
+    "RPC00A" : "nitf_tre_rpc",
+    "RPC00B" : "nitf_tre_rpc",
+    "RSMAPA" : "nitf_tre_rsmapa",
+    "RSMAPB" : "nitf_tre_rsmapb",
+    "RSMDCA" : "nitf_tre_rsmdca",
+    "RSMECB" : "nitf_tre_rsmecb",
+    "RSMGGA" : "nitf_tre_rsmgga",
+    "RSMGIA" : "nitf_tre_rsmgia",
+    "RSMIDA" : "nitf_tre_rsmida",
+    "RSMPCA" : "nitf_tre_rsmpca",
+    "RSMPIA" : "nitf_tre_rsmpia",
+    "SENSRB" : "nitf_tre_sensrb",
+    "STDIDC" : "nitf_tre_csde",
+    "TMINTA" : "nitf_tre_tminta",
+    "USE00A" : "nitf_tre_csde",
+}
+
+# Map of DES ID to the module that handles it.
+desid_to_module = {
+    "CSATTA" : "nitf_des_csatta",
+    "CSATTB" : "nitf_des_csattb",
+    "CSCSDB" : "nitf_des_cscsdb",
+    "CSEPHB" : "nitf_des_csephb",
+    "CSSFAB" : "nitf_des_cssfab",
+    "EXT_DEF_CONTENT" : "nitf_des_ext_def_content",
+}
+
+# Map of exported name to the module it comes from
+lazy_name_to_module = {nm : m for m, nlist in lazy_module_exports.items()
+                       for nm in nlist}
+
+def load_lazy_module(mname):
+    '''Import the given pynitf module (e.g., "nitf_tre_rsmpca"), if it
+    hasn't already been imported, and return the module.'''
+    m = sys.modules.get("pynitf." + mname)
+    if(m is None):
+        m = importlib.import_module("pynitf." + mname)
+    return m
+
+def load_tre_module(tre_tag):
+    '''Import the module that handles the given TRE tag (either str
+    or bytes). Returns True if we have a module for the TRE tag, False
+    otherwise.'''
+    if(isinstance(tre_tag, bytes)):
+        tre_tag = tre_tag.decode("utf-8", errors="replace")
+    mname = tre_tag_to_module.get(tre_tag)
+    if(mname is None):
+        return False
+    load_lazy_module(mname)
+    return True
+
+def load_des_module(desid):
+    '''Import the module that handles the given DES ID. Returns True if
+    we have a module for the DES ID, False otherwise.'''
+    mname = desid_to_module.get(desid)
+    if(mname is None):
+        return False
+    load_lazy_module(mname)
+    return True
+
+def loaded_lazy_modules():
+    '''Return the set of lazy modules that have been imported so far.'''
+    return {m for m in lazy_module_exports if "pynitf." + m in sys.modules}
+
+__all__ = ["load_lazy_module", "load_tre_module", "load_des_module"]
@@ -0,0 +1,127 @@
+# A process wide cache of decoded image blocks.
+#
+# Reading a window of a blocked image means getting each block that
+# intersects the window. For uncompressed data this is just a view of a
+# memory mapped file, but for data that needs to be decoded (e.g., a
+# compressed image) we don't want to decode the same block again each
+# time an overlapping window is read. Image classes derived from
+# NitfImageWithSubset can opt in to using block_cache (see
+# NitfImageWithSubset.use_block_cache).
+
+import collections
+import os
+import threading
+
+class NitfBlockCache(object):
+    '''A least recently used cache of decoded blocks, limited to a total
+    of max_bytes. The values are numpy arrays (or anything with a nbytes
+    attribute), and the keys are normally the tuple returned by
+    NitfImageWithSubset.block_cache_key.
+
+    This is thread safe. Note that we don't hold the lock while creating
+    a value in get, so two threads asking for the same missing block may
+    both decode it (the second just replaces the first).
+
+    :ivar hits:      Number of times we found the value in the cache
+    :ivar misses:    Number of times we needed to create the value
+    :ivar evictions: Number of values removed to stay within max_bytes
+    '''
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self._lock = threading.Lock()
+        self._d = collections.OrderedDict()
+        self._max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def max_bytes(self):
+        '''The maximum number of bytes to keep in the cache. Set to 0 to
+        turn off caching.'''
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, v):
+        with self._lock:
+            self._max_bytes = v
+            self._evict()
+
+    def __len__(self):
+        return len(self._d)
+
+    def __contains__(self, key):
+        return key in self._d
+
+    def get(self, key, create_func):
+        '''Return the value for key. If it isn't in the cache, we call
+        create_func() to create it and add it to the cache.
+
+        The value is made read only, since it is shared with everything
+        else that reads the same block.'''
+        with self._lock:
+            v = self._d.get(key)
+            if(v is not None):
+                self._d.move_to_end(key)
+                self.hits += 1
+                return v
+            self.misses += 1
+        v = create_func()
+        if(hasattr(v, "setflags")):
+            v.setflags(write=False)
+        with self._lock:
+            old = self._d.pop(key, None)
+            if(old is not None):
+                self.nbytes -= old.nbytes
+            if(v.nbytes <= self._max_bytes):
+                self._d[key] = v
+                self.nbytes += v.nbytes
+                self._evict()
+        return v
+
+    def _evict(self):
+        '''Remove the least recently used values until we are within
+        max_bytes. Should be called with the lock held.'''
+        while(self.nbytes > self._max_bytes):
+            k, v = self._d.popitem(last=False)
+            self.nbytes -= v.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        '''Remove everything from the cache. This doesn't reset the
+        counters, see reset_stats.'''
+        with self._lock:
+            self._d.clear()
+            self.nbytes = 0
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        '''Return a dict with the cache statistics.'''
+        with self._lock:
+            return {"hits" : self.hits, "misses" : self.misses,
+                    "evictions" : self.evictions, "nbytes" : self.nbytes,
+                    "max_bytes" : self._max_bytes, "nblock" : len(self._d)}
+
+    def __str__(self):
+        s = self.stats()
+        return ("NitfBlockCache %d blocks, %d of %d bytes, %d hits, %d misses, %d evictions" %
+                (s["nblock"], s["nbytes"], s["max_bytes"], s["hits"],
+                 s["misses"], s["evictions"]))
+
+def file_identity(fname):
+    '''Return a tuple identifying the file for use in the block cache
+    key. We include the modification time and size so a file that has
+    been rewritten doesn't get stale blocks.'''
+    st = os.stat(fname)
+    return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+# The cache shared by all the images. You can change the size with
+# block_cache.max_bytes.
+block_cache = NitfBlockCache()
+
+__all__ = ["NitfBlockCache", "block_cache", "file_identity"]
@@ -0,0 +1,85 @@
+# Copy the data for a segment from an input file to the output file.
+#
+# When we are just copying data (e.g., rewriting a file to change some
+# metadata), the data is most of the time. So rather than reading and
+# writing the data through python, we use os.copy_file_range (which
+# can be done entirely in the kernel, or even just share the data blocks
+# on file systems that support it), falling back to os.sendfile and then
+# a buffered copy if those aren't available.
+
+import io
+import os
+
+# The methods we try, in order. You can change this (e.g., to compare
+# the performance of each, see extra/benchmark_copy.py).
+copy_methods = ("copy_file_range", "sendfile", "buffered")
+
+def _copy_file_range(fd_in, offset, fd_out, pos, size):
+    return os.copy_file_range(fd_in, fd_out, size, offset, pos)
+
+def _sendfile(fd_in, offset, fd_out, pos, size):
+    # sendfile writes at the current position of fd_out
+    os.lseek(fd_out, pos, os.SEEK_SET)
+    return os.sendfile(fd_out, fd_in, offset, size)
+
+_copy_func = {"copy_file_range" : _copy_file_range, "sendfile" : _sendfile}
+
+def copy_file_data(fh, fname_in, offset=0, size=None, methods=None):
+    '''Copy size bytes starting at offset in the file fname_in to the
+    current position of the file handle fh. If size is None, we copy to
+    the end of fname_in.
+
+    We try each of the methods (default copy_methods) in order, moving on
+    to the next one if the method isn't available or fails for this
+    pair of files (e.g., fh isn't a real file). Returns the number of
+    bytes copied.'''
+    methods = copy_methods if methods is None else methods
+    with open(fname_in, "rb") as fh_in:
+        if(size is None):
+            size = os.fstat(fh_in.fileno()).st_size - offset
+        ncopy = 0
+        try:
+            fd_out = fh.fileno()
+        except (io.UnsupportedOperation, AttributeError):
+            fd_out = None
+        if(fd_out is not None and
+           os.path.sameopenfile(fd_out, fh_in.fileno())):
+            # Opening the output file normally truncates it, so the
+            # data is already gone.
+            raise RuntimeError("Can't copy data from %s to the same file" %
+                               fname_in)
+        if(fd_out is not None):
+            fh.flush()
+            pos = fh.tell()
+            for m in methods:
+                f = _copy_func.get(m)
+                if(f is None or not hasattr(os, m)):
+                    continue
+                try:
+                    while(ncopy < size):
+                        n = f(fh_in.fileno(), offset + ncopy, fd_out,
+                              pos + ncopy, size - ncopy)
+                        if(n == 0):
+                            break
+                        ncopy += n
+                except OSError:
+                    # Try the next method, starting where we left off
+                    pass
+                if(ncopy == size):
+                    break
+            fh.seek(pos + ncopy, os.SEEK_SET)
+        if(ncopy < size and "buffered" in methods):
+            buffer_size = 1024 * 1024
+            fh_in.seek(offset + ncopy)
+            while(ncopy < size):
+                d = fh_in.read(min(buffer_size, size - ncopy))
+                if(len(d) == 0):
+                    break
+                fh.write(d)
+                ncopy += len(d)
+        if(ncopy < size):
+            raise RuntimeError("Only copied %d of %d bytes from %s" %
+                               (ncopy, size, fname_in))
+        return ncopy
+
+__all__ = ["copy_file_data"]
@@ -37,7 +37,7 @@ class NitfDesFieldStruct(NitfDes, FieldStruct):
         self.data_to_copy = None
         
     def read_from_file(self, fh, seg_index=None, force_raw_read=False):
-        if(self.subheader.desid != self.des_tag):
+        if(not self.can_handle(self.subheader, self.user_subheader)):
             return False
         if(self.des_implementation_field and not force_raw_read):
             setattr(self, self.des_implementation_field,
@@ -110,6 +110,7 @@ class NitfDesFieldStruct(NitfDes, FieldStruct):
     
 class DesFieldStructDiff(FieldStructDiff):
     '''Compare two NitfDesObjectHandle.'''
+    diff_type = NitfDesFieldStruct
     def configuration(self, nitf_diff):
         return self._config
     def handle_diff(self, des1, des2, nitf_diff):
@@ -169,7 +170,7 @@ class TreOverflow(NitfDes):
 
     def read_from_file(self, fh, seg_index=None):
         '''Read an DES from a file.'''
-        if(self.subheader.desid != self.des_tag):
+        if(not self.can_handle(self.subheader, self.user_subheader)):
             return False
         self.data = fh.read(self._seg().data_size)
         return True
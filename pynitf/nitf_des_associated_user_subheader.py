@@ -112,6 +112,7 @@ def add_uuid_des_function(cls):
 
 class DesAssociatedUserSubheaderDiff(FieldStructDiff):
     '''Compare two user headers.'''
+    diff_type = DesAssociatedUserSubheader
     def configuration(self, nitf_diff):
         return nitf_diff.config.get("DesAssociatedUserSubheader", {})
 
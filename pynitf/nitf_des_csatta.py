@@ -46,6 +46,7 @@ NitfSegmentDataHandleSet.add_default_handle(DesCSATTA)
 
 class CsattaDiff(FieldStructDiff):
     '''Compare two DesCSATTA.'''
+    diff_type = DesCSATTA
     def configuration(self, nitf_diff):
         return nitf_diff.config.get("DesCSATTA", {})
 
@@ -26,10 +26,10 @@ desc =[['qual_flag_att', 'Attitude Data Quality Flag', 1, int],
         ['t0_att', "UTC Timestamp of First Attitude Reference Point", 16, float, {'frmt': '%016.9lf'}],
         ['num_att', "Number of Attitude Reference Points", 5, int],
         [["loop", "f.num_att"],
-         ["q1", "Quaternion Q1 of Attitude Reference Point", 18, float, {"frmt": _quat_format}],
-         ["q2", "Quaternion Q2 of Attitude Reference Point", 18, float, {"frmt": _quat_format}],
-         ["q3", "Quaternion Q3 of Attitude Reference Point", 18, float, {"frmt": _quat_format}],
-         ["q4", "Quaternion Q4 of Attitude Reference Point", 18, float, {"frmt": _quat_format}],
+         ["q1", "Quaternion Q1 of Attitude Reference Point", 18, float, {"frmt": _quat_format, "array_storage": True}],
+         ["q2", "Quaternion Q2 of Attitude Reference Point", 18, float, {"frmt": _quat_format, "array_storage": True}],
+         ["q3", "Quaternion Q3 of Attitude Reference Point", 18, float, {"frmt": _quat_format, "array_storage": True}],
+         ["q4", "Quaternion Q4 of Attitude Reference Point", 18, float, {"frmt": _quat_format, "array_storage": True}],
         ], #end loop
         ["reserved_len", "Size of the Reserved Field", 9, int],
         ["reserved", "Reserved Data Field", "f.reserved_len", None, {'field_value_class' : BytesFieldData}]
@@ -53,6 +53,7 @@ NitfSegmentDataHandleSet.add_default_handle(DesCSATTB)
 
 class CsattbDiff(FieldStructDiff):
     '''Compare two DesCSATTB.'''
+    diff_type = DesCSATTB
     def configuration(self, nitf_diff):
         return nitf_diff.config.get("DesCSATTB", {})
 
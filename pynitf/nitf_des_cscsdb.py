@@ -346,6 +346,7 @@ NitfSegmentDataHandleSet.add_default_handle(DesCSCSDB)
 
 class CsscdbDiff(FieldStructDiff):
     '''Compare two DesCSCSDB.'''
+    diff_type = DesCSCSDB
     def configuration(self, nitf_diff):
         return nitf_diff.config.get("DesCSCSDB", {})
 
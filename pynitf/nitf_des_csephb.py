@@ -26,9 +26,9 @@ desc =[['qual_flag_eph', 'Ephemeris Data Quality Flag', 1, int],
         ['t0_ephem', "UTC Timestamp of First Ephemeris Vector", 16, float, {'frmt': '%016.9lf'}],
         ['num_ephem', "Number of Ephemeris Vectors", 5, int],
         [["loop", "f.num_ephem"],
-         ["ephem_x", "X-Coordinate", 12, float, {"frmt": _eph_format}],
-         ["ephem_y", "Y-Coordinate", 12, float, {"frmt": _eph_format}],
-         ["ephem_z", "Z-Coordinate", 12, float, {"frmt": _eph_format}],
+         ["ephem_x", "X-Coordinate", 12, float, {"frmt": _eph_format, "array_storage": True}],
+         ["ephem_y", "Y-Coordinate", 12, float, {"frmt": _eph_format, "array_storage": True}],
+         ["ephem_z", "Z-Coordinate", 12, float, {"frmt": _eph_format, "array_storage": True}],
         ], #end loop
         ["reserved_len", "Size of the Reserved Field", 9, int],
         ["reserved", "Reserved Data Field", "f.reserved_len", None, {'field_value_class' : BytesFieldData}]
@@ -53,6 +53,7 @@ NitfSegmentDataHandleSet.add_default_handle(DesCSEPHB)
 
 class CsephbDiff(FieldStructDiff):
     '''Compare two DesCSEPHB.'''
+    diff_type = DesCSEPHB
     def configuration(self, nitf_diff):
         return nitf_diff.config.get("DesCSEPHB", {})
 
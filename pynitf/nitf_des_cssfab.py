@@ -163,6 +163,7 @@ NitfSegmentDataHandleSet.add_default_handle(DesCSSFAB)
 
 class CssfabDiff(FieldStructDiff):
     '''Compare two DesCSSFAB.'''
+    diff_type = DesCSSFAB
     def configuration(self, nitf_diff):
         return nitf_diff.config.get("DesCSSFAB", {})
 
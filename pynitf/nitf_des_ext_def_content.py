@@ -3,10 +3,10 @@ from .nitf_segment_data_handle import (NitfDes,
                                        NitfSegmentDataHandleSet)
 from .nitf_diff_handle import NitfDiffHandle, NitfDiffHandleSet
 from .nitf_segment_user_subheader_handle import desid_to_user_subheader_handle
+from .nitf_copy_data import copy_file_data
 import io
 import os
 import datetime
-import shutil
 import tempfile
 import numpy as np
 import warnings
@@ -104,6 +104,7 @@ class DesExtContentHeader(FieldStruct):
     
 class DesExtContentHeaderDiff(FieldStructDiff):
     '''Compare two user headers.'''
+    diff_type = DesExtContentHeader
     def configuration(self, nitf_diff):
         return nitf_diff.config.get("DesExtContentHeader", {})
 
@@ -146,7 +147,7 @@ class DesEXT_DEF_CONTENT(NitfDes):
         This version doesn't actually read in the data (which might be
         large). Instead, it memory maps a numpy array to the data.
         '''
-        if(self.subheader.desid != "EXT_DEF_CONTENT"):
+        if(not self.can_handle(self.subheader, self.user_subheader)):
             return False
         foff = fh.tell()
         self.data = np.memmap(fh, mode="r", dtype=np.int8,
@@ -185,6 +186,7 @@ class DesExtDefContentDiff(NitfDiffHandle):
        exclude_but_warn - of true, warn about differences but don't treat
           as a failure.
    '''
+    diff_type = DesEXT_DEF_CONTENT
     def configuration(self, nitf_diff):
         return nitf_diff.config.get("DesExtDefContent", {})
 
@@ -269,10 +271,15 @@ class DesEXT_h5(DesEXT_DEF_CONTENT):
         self._h5py_fh = h5py.File(self.tfh.name, "r")
         return self._h5py_fh
 
+    @classmethod
+    def can_handle(cls, subheader, user_subheader):
+        '''We only handle EXT_DEF_CONTENT that contains a HDF5 file.'''
+        return (super().can_handle(subheader, user_subheader) and
+                user_subheader is not None and
+                user_subheader.content_type == b"application/x-hdf5")
+    
     def read_from_file(self, fh, seg_index=None):
-        if(self.subheader.desid != "EXT_DEF_CONTENT"):
-            return False
-        if(self.user_subheader.content_type != b"application/x-hdf5"):
+        if(not self.can_handle(self.subheader, self.user_subheader)):
             return False
         super().read_from_file(fh, seg_index)
         return True
@@ -289,8 +296,7 @@ class DesEXT_h5(DesEXT_DEF_CONTENT):
         '''This is a dummy write operation. We just write self.data_size
         '0''s.'''
         if(self.file):
-            with open(self.file, "rb") as fhin:
-                shutil.copyfileobj(fhin, fh)
+            copy_file_data(fh, self.file)
         elif (self.data is not None):
             fh.write(self.data)
 
@@ -65,6 +65,7 @@ class NitfDesSubheader(FieldStruct):
 
 class DesSubheaderDiff(FieldStructDiff):
     '''Compare two des subheaders.'''
+    diff_type = NitfDesSubheader
     def configuration(self, nitf_diff):
         return nitf_diff.config.get("Des Subheader", {})
 
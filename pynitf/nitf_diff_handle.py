@@ -101,12 +101,38 @@ class NitfDiffHandleSet(PriorityHandleSet):
     def handle_h(self, h, obj1, obj2, nitf_diff):
         return h.handle_diff(obj1, obj2, nitf_diff)
 
+    def dispatch_key(self, obj1, obj2, nitf_diff):
+        return (type(obj1), type(obj2))
+
+    def handle_applies(self, h, key):
+        '''Skip handles where the objects aren't the diff_type.'''
+        t = getattr(h, "diff_type", None)
+        return t is None or (issubclass(key[0], t) and issubclass(key[1], t))
+
+    def handle_type_only(self, h):
+        # Only trust a diff_type the handle's class sets itself. A derived
+        # class that inherits diff_type may decline some objects based on
+        # their content.
+        return type(h).__dict__.get("diff_type") is not None
+
     
 
 class NitfDiffHandle(object):
     '''Base class for handling difference between two NITF object. Like always,
     you don't need to actually derive from this class if for whatever reason
-    this isn't convenient but you should provide this interface.'''
+    this isn't convenient but you should provide this interface.
+
+    If diff_type is set to a type (or tuple of types), then we only
+    handle objects that are both of that type, and handle_diff should
+    accept any two such objects (i.e., never return (False, None) for
+    them). This lets NitfDiffHandleSet skip this handle for other types,
+    and remember which handle to use for a given pair of types. The
+    remembering only happens if diff_type is set in the class itself, so a
+    derived class that inherits diff_type can still decline objects. The
+    default of None means handle_diff gets called for every pair of 
+    objects. A derived class that handles a different set of objects 
+    should update this.'''
+    diff_type = None
     def handle_diff(self, obj1, obj2, nitf_diff):
         '''Handle determining difference between object. Returns a tuple, with
         the first value indicating if we can handle the types and the second
@@ -128,6 +154,7 @@ class NitfDiffHandle(object):
 class AlwaysTrueHandle(NitfDiffHandle):
     '''Handle that always says things are equal. Nice for various test cases
     where we want to check for only a subset of things.'''
+    diff_type = object
     def handle_diff(self, obj1, obj2, nitf_diff):
         logger.info("Using default always match handler")
         logger.info("obj1: %s" % obj1.summary())
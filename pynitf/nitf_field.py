@@ -33,6 +33,62 @@ def float_to_fixed_width(n, max_width, maximum_precision=False):
         raise RuntimeError("Can't fit %f into length %d" % (n, max_width))
     return s
 
+def _float_to_fixed_width_column(vals, max_width):
+    '''Batch version of float_to_fixed_width (without maximum_precision),
+    returning a list of strings for the floats in vals.
+
+    Rather than trying each precision for each value, we estimate the
+    precision from the integer part and do the formatting with a single
+    % for all the values. We then check that the estimate gave the same
+    precision that float_to_fixed_width would have picked (i.e., the 
+    result fits and one more digit doesn't), and fall back to
+    float_to_fixed_width for any value where it didn't.'''
+    n = len(vals)
+    if(max_width < 2):
+        return [float_to_fixed_width(v, max_width) for v in vals]
+    ilen = np.fromiter(map(len, (("%.0f\n" * n) % tuple(vals)).split("\n")),
+                       dtype=int, count=n+1)[:-1]
+    prec = np.clip(max_width - 1 - ilen, 0, max_width - 2)
+    args = [None] * (2 * n)
+    args[1::2] = vals
+    args[0::2] = prec.tolist()
+    res = (("%.*f\n" * n) % tuple(args)).split("\n")[:-1]
+    args[0::2] = (prec + 1).tolist()
+    res2 = (("%.*f\n" * n) % tuple(args)).split("\n")[:-1]
+    rlen = np.fromiter(map(len, res), dtype=int, count=n)
+    rlen2 = np.fromiter(map(len, res2), dtype=int, count=n)
+    bad = (rlen > max_width) | ((rlen2 <= max_width) & (prec < max_width - 2))
+    for i in np.nonzero(bad)[0]:
+        res[i] = float_to_fixed_width(vals[i], max_width)
+    return res
+
+def _format_column(vals, sz, ty, frmt, field_name):
+    '''Batch version of NitfField._format_val, used when writing a whole
+    column of a loop. This returns a str with the formatted values for
+    everything in vals, which is the same as joining the results of 
+    _format_val for each value.'''
+    n = len(vals)
+    if(n == 0):
+        return ""
+    if(frmt is None and ty == int):
+        frmt = "%%0%dd" % sz
+    elif(frmt is None and ty == float):
+        res = _float_to_fixed_width_column(vals, sz)
+    elif(frmt is None):
+        frmt = "%s"
+    if(isinstance(frmt, str)):
+        res = (((frmt + "\n") * n) % tuple(vals)).split("\n")[:-1]
+    elif(frmt is not None):
+        res = [frmt(v) for v in vals]
+    if(any(len(t) != sz for t in res)):
+        # Same padding as _format_val. Note ints aren't padded
+        if(ty != int):
+            res = [t.ljust(sz) for t in res]
+        for t in res:
+            if(len(t) != sz):
+                raise RuntimeError("Formatting error. String '%s' is not right length for NITF field %s" % (t, field_name))
+    return "".join(res)
+
 class NitfLiteral(object):
     '''Sometimes we have a field with a particularly odd format, and it 
     is easier to just return a literal string to return as the TRE field 
@@ -44,30 +100,135 @@ class NitfLiteral(object):
         else:
             self.value = bytes(value)[0:(trunc_size-1)]
 
+# Cache of compiled expressions, keyed by the expression source and the
+# kind of function we generated from it.
+_compiled_expr = {}
+
+# The code objects for the compiled expressions, with the same key as
+# _compiled_expr. Unlike the functions, these can be saved to disk (see
+# nitf_layout_cache.py) so we can skip compiling in a new process.
+_compiled_code = {}
+
+def _compile_expr(expr, kind="eval"):
+    '''The description for a FieldStruct has expressions for things like
+    the size of a field, a condition, or the shape of a loop (e.g.,
+    "f.nluts[i1]"). We used to call eval on these each time we needed
+    the value, which meant parsing the same string over and over again.
+    Instead we compile each expression once into a python function, and
+    cache it. Since the cache is keyed by the source string, this is
+    shared by every instance of every FieldStruct class.
+
+    The kind can be:
+
+    eval - Return function func(f, i1, i2, i3, i4) that evaluates expr
+    exec - Return function func(f, i1, i2, i3, i4) that executes expr
+    set  - expr is something that can be assigned to (e.g. "f.foo[i1]").
+           Return function func(f, v, i1, i2, i3, i4) that does "expr = v".
+
+    In all cases 'f' is the FieldStruct and i1 through i4 are indices.
+    The indices can be left off, so for a scalar this is called as
+    func(f) (or func(f, v)).'''
+    k = (expr, kind)
+    func = _compiled_expr.get(k)
+    if func is None:
+        code = _compiled_code.get(k)
+        if code is None:
+            code = _compile_expr_code(expr, kind)
+            _compiled_code[k] = code
+        ns = {}
+        exec(code, globals(), ns)
+        func = ns["_expr"]
+        _compiled_expr[k] = func
+    return func
+
+def _compile_expr_code(expr, kind):
+    '''Return the code object used by _compile_expr.'''
+    if(kind == "eval"):
+        src = ("def _expr(f, i1=None, i2=None, i3=None, i4=None):\n"
+               "    return (%s)\n" % expr)
+    elif(kind == "exec"):
+        src = ("def _expr(f, i1=None, i2=None, i3=None, i4=None):\n"
+               "    %s\n" % expr)
+    elif(kind == "set"):
+        src = ("def _expr(f, v, i1=None, i2=None, i3=None, i4=None):\n"
+               "    %s = v\n" % expr)
+    else:
+        raise ValueError("Unknown expression kind %s" % kind)
+    return compile(src, "<FieldStruct expression %r>" % expr, "exec")
+
 def _eval_or_exec_expr(fs, key, expr, do_eval):
     '''We have a few places where we evaluate or execute an expression,
     with various local variables set up for the evaluation context. As
     a convenience we centralize this to one place, so there is only
     one function to update if we add new variables (e.g., add to the number
-    of index variables).'''
-    f = fs
-    if(len(key) > 0):
-        i1 = key[0]
-    if(len(key) > 1):
-        i2 = key[1]
-    if(len(key) > 2):
-        i3 = key[2]
-    if(len(key) > 3):
-        i4 = key[3]
-    if(do_eval):
-        return eval(expr)
-    else:
-        exec(expr)
-    
+    of index variables).
+
+    Note that most of the code now calls the function returned by
+    _compile_expr directly, this is just a convenience wrapper.'''
+    return _compile_expr(expr, "eval" if do_eval else "exec")(fs, *key)
+
+def _default_factory(v):
+    '''Return a function returning v, used for the defaultdict in NitfField.
+    We create this once per field in the _FieldSchema, rather than a new
+    lambda for every NitfField.'''
+    return lambda : v
+
+class _FieldSchema(object):
+    '''This is the layout of a single field in a FieldStruct description
+    (e.g., the size, type, and options). This is built once for a 
+    description and is then shared by all the NitfField objects for that
+    field in every instance of the FieldStruct class. It should be treated
+    as immutable.'''
+    def __init__(self, field_name, size, ty, loop, options, index=None):
+        self.field_name = field_name
+        self.size = size
+        # Compile the size expression once, rather than each time we use it
+        self.size_func = None
+        if(isinstance(size, str)):
+            self.size_func = _compile_expr(size)
+        self.size_offset = options.get("size_offset", 0)
+        self.size_not_updated = options.get("size_not_updated", False)
+        self.ty = ty
+        # The _LoopSchema we are in, or None for a standalone NitfField
+        self.loop = loop
+        self.frmt = options.get("frmt", None)
+        self.default = options.get("default", None)
+        self.condition = options.get("condition", None)
+        self.condition_func = None
+        if(self.condition is not None):
+            self.condition_func = _compile_expr(self.condition)
+        self.optional = options.get("optional", False)
+        self.optional_char = options.get("optional_char", " ")
+        self.hardcoded_value = options.get("hardcoded_value", False)
+        self.value_func = options.get("value", None)
+        self.field_value_class = options.get("field_value_class", NitfField)
+        self.options = options
+        # Index in FieldStructSchema.item_list
+        self.index = index
+        if(self.default is not None):
+            self.default_factory = _default_factory(self.default)
+        elif(self.optional):
+            self.default_factory = _default_factory(None)
+        elif(self.ty == str):
+            self.default_factory = _default_factory("")
+        else:
+            self.default_factory = _default_factory(0)
+
 class NitfField(object):
     '''A NITF field is complicated enough that we have a separate class
     to handle it. This class worries about the looping structure, conditional
-    and optional fields, etc.'''
+    and optional fields, etc.
+
+    The layout of the field (size, type, options) is kept in a _FieldSchema
+    that is shared between all instances of a FieldStruct class, this
+    object just holds the values for one instance.'''
+    __slots__ = ("fs", "_schema", "loop", "value_dict", "raw_value_dict",
+                 "fh_loc", "lazy_loc")
+    # If true, then we check the size of data set by __setitem__.
+    # This is really meant for the derived class FieldData where
+    # we separately handling going to and from bytes.
+    _check_or_set_size = False
+    
     def __init__(self, fs, field_name, size, ty, loop, options):
         '''Give the size, type, loop structure, and options to to use. If
         default is given as None, we use a default default value of
@@ -75,54 +236,61 @@ class NitfField(object):
 
         The fs should point to the parent FieldStruct, so we can do things
         like check conditions. 
+
+        Note that FieldStruct doesn't use this constructor, it instead 
+        uses _from_schema with a shared _FieldSchema. This is the 
+        constructor for a standalone field (e.g., in unit tests).
         '''
         # Allow fs to be None, as an aid with unit testing
-        if(fs is None):
-            self.fs = None
-            self.fs_name = "None"
-        else:
-            self.fs = fs
-            self.fs_name = type(fs).__name__
-        self.field_name = field_name
-        self._size = size
-        self.size_offset = options.get("size_offset", 0)
-        self.size_not_updated = options.get("size_not_updated", False)
-        self.ty = ty
-        self.loop = None
-        if(loop):
-            self.loop = weakref.proxy(loop)
-        self.frmt = options.get("frmt", None)
-        self.default = options.get("default", None)
-        self.condition = options.get("condition", None)
-        self.optional = options.get("optional", False)
-        self.optional_char = options.get("optional_char", " ")
-        self.hardcoded_value = options.get("hardcoded_value", False)
-        self.value_func = options.get("value", None)
+        self._bind(fs, _FieldSchema(field_name, size, ty, None, options),
+                   loop)
+
+    @classmethod
+    def _from_schema(cls, fs, schema, loop):
+        '''Create a field for the FieldStruct fs, using the shared schema.
+        Note that this doesn't call __init__, so derived classes should
+        not depend on __init__ to set anything up.'''
+        fv = cls.__new__(cls)
+        fv._bind(fs, schema, loop)
+        return fv
+
+    def _bind(self, fs, schema, loop):
+        self.fs = fs
+        self._schema = schema
+        self.loop = loop
         # Have a dictionary that maps the index/looping key to a value.
         # To prevent needing special handling, a single value is still
         # treated as a dict with a key of (). You
         # get the value by self.value_dict[key].  
-        if(self.field_name is None):
-            self.value_dict = None
-        if(self.default is not None):
-            self.value_dict = defaultdict(lambda : self.default)
-        elif(self.optional):
-            self.value_dict = defaultdict(lambda : None)
-        elif(self.ty == str):
-            self.value_dict = defaultdict(lambda : "")
-        else:
-            self.value_dict = defaultdict(lambda : 0)
+        self.value_dict = defaultdict(schema.default_factory)
         # Second version that saves the raw data. I don't think saving
         # data twice will be a problem, but if it is we can come back
         # to this.
         self.raw_value_dict = {}
         # Location data was written in file, used by update_file.
         self.fh_loc = {}
-        # If true, then we check the size of data set by __setitem__.
-        # This is really meant for the derived class FieldData where
-        # we separately handling going to and from bytes.
-        self._check_or_set_size = False
-
+        # When reading with lazy_decode, this maps the key to a tuple of
+        # buffer, offset and size for the raw data. We only decode this
+        # when the value is used (see FieldStruct.read_from_file). This
+        # is None unless we have read lazily.
+        self.lazy_loc = None
+
+    # The layout information all comes from the shared schema.
+    fs_name = property(lambda self: "None" if self.fs is None
+                       else type(self.fs).__name__)
+    field_name = property(lambda self: self._schema.field_name)
+    _size = property(lambda self: self._schema.size)
+    size_offset = property(lambda self: self._schema.size_offset)
+    size_not_updated = property(lambda self: self._schema.size_not_updated)
+    ty = property(lambda self: self._schema.ty)
+    frmt = property(lambda self: self._schema.frmt)
+    default = property(lambda self: self._schema.default)
+    condition = property(lambda self: self._schema.condition)
+    optional = property(lambda self: self._schema.optional)
+    optional_char = property(lambda self: self._schema.optional_char)
+    hardcoded_value = property(lambda self: self._schema.hardcoded_value)
+    value_func = property(lambda self: self._schema.value_func)
+    
     @property
     def has_loop(self):
         return self.loop.dim_size != 0
@@ -164,20 +332,24 @@ class NitfField(object):
         '''Return the size. In the simplest case, this is just self._size,
         but if self._size is an expression then we evaluate it. We also
         apply size_offset'''
-        if (type(self._size) == int):
-            sz = self._size
+        sc = self._schema
+        if (sc.size_func is None):
+            sz = sc.size
         else:
-            sz = self.eval_expr(self.key_as_tuple(key), self._size)
+            sz = sc.size_func(self.fs, *self.key_as_tuple(key))
         if(sz != 0):
-            sz -= self.size_offset
+            sz -= sc.size_offset
         return sz
 
     def _set_size(self, key, sz):
         '''Set the value given by the sz expression'''
+        # Not every size expression can be assigned to, so only compile
+        # this when we actually need it.
+        set_func = _compile_expr(self._size, "set")
         if(sz == 0):
-            self.exec_expr(key, "%s = 0" % self._size)
+            set_func(self.fs, 0, *key)
         else:
-            self.exec_expr(key, "%s = %d" % (self._size, sz + self.size_offset))
+            set_func(self.fs, sz + self.size_offset, *key)
 
     def _format_val(self, v, sz):
         '''Format a value to a given size.'''
@@ -223,9 +395,9 @@ class NitfField(object):
     def check_condition(self, key):
         '''Evaluate the condition (if present) and return False if it isn't
         met, True if it is or if there is no condition'''
-        if(self.condition is None):
+        if(self._schema.condition_func is None):
             return True
-        v = self.eval_expr(key, self.condition)
+        v = self._schema.condition_func(self.fs, *key)
         if(DEBUG):
             print("Condition: " + self.condition)
             print("eval: " + str(v))
@@ -244,10 +416,18 @@ class NitfField(object):
         k = self.key_as_tuple(key)
         if(k in self.raw_value_dict):
             return self.raw_value_dict[k].value
+        if(self.lazy_loc and k in self.lazy_loc):
+            return self._lazy_raw_bytes(k)
         return self.bytes(k)
+
+    def _lazy_raw_bytes(self, k):
+        '''Return the raw bytes for a field read with lazy_decode.'''
+        buf, offset, sz = self.lazy_loc[k]
+        return bytes(buf[offset:offset+sz])
     
     def __getitem__(self, key):
-        if(self.field_name is None):
+        sc = self._schema
+        if(sc.field_name is None):
             return ''
         k = self.key_as_tuple(key)
         if(self.loop is not None):
@@ -256,23 +436,27 @@ class NitfField(object):
             return None
         try:
             v = None
-            if(self.value_func is not None):
-                v = self.value_func(self.fs, k)
+            if(sc.value_func is not None):
+                v = sc.value_func(self.fs, k)
             else:
+                if(self.lazy_loc and k not in self.value_dict and
+                   k in self.lazy_loc):
+                    self.value_dict[k] = self._decode(self._lazy_raw_bytes(k),
+                                                      False)
                 v = self.value_dict[k]
-            if(self.optional and v is None):
+            if(sc.optional and v is None):
                 return None
             if(isinstance(v, NitfLiteral)):
                 v = v.value
-                if(self.optional and
-                   v.rstrip(self.optional_char.encode(_text_codec) + b' ') == b''):
+                if(sc.optional and
+                   v.rstrip(sc.optional_char.encode(_text_codec) + b' ') == b''):
                     return None
-            if(self.ty == str):
+            if(sc.ty == str):
                 if(isinstance(v, bytes)):
                     return v.decode(_text_codec).rstrip()
-                return self.ty(v).rstrip()
+                return sc.ty(v).rstrip()
             else:
-                return self.ty(v)
+                return sc.ty(v)
         except Exception as e:
             if(self.loop is None):
                 raise RuntimeError("Error occurred getting '%s' from '%s'. Value '%s'" % (self.field_name, self.fs_name, v)) from e
@@ -299,6 +483,8 @@ class NitfField(object):
         self.value_dict[k] = v
         if k in self.raw_value_dict:
             del self.raw_value_dict[k]
+        if self.lazy_loc:
+            self.lazy_loc.pop(k, None)
         if self._check_or_set_size:
             if(self.size_not_updated):
                 sz = self.size(k)
@@ -314,6 +500,10 @@ class NitfField(object):
         # that is handled outside of this class. Pad, but otherwise don't
         # process this.
         k = self.key_as_tuple(key)
+        # Fields read with lazy_decode that haven't been changed are
+        # written back exactly as we read them.
+        if(self.lazy_loc and k in self.lazy_loc):
+            return self._lazy_raw_bytes(k)
         sz = self.size(k)
         if(isinstance(self.value_dict[k], NitfLiteral)):
             t = self.value_dict[k].value.ljust(sz)
@@ -361,39 +551,90 @@ class NitfField(object):
         fh.write(self.bytes(k))
         fh.seek(last_pos)
         
-    def read_from_file(self, fh, nitf_literal, key):
+    def read_from_file(self, fh, nitf_literal, key, lazy_buffer=None):
+        '''Read the value for the given key. If lazy_buffer is passed
+        in, we append the raw data to it and decode it the first time
+        the value is used.'''
+        sc = self._schema
         k = self.key_as_tuple(key)
         if(not self.check_condition(k)):
             return
         sz = self.size(k)
-        if(DEBUG and self.field_name is not None):
-            print("Reading: ", self.field_name, " bytes: ", sz)
+        if(DEBUG and sc.field_name is not None):
+            print("Reading: ", sc.field_name, " bytes: ", sz)
         t = fh.read(sz)
-        if(DEBUG and self.field_name is not None):
+        if(DEBUG and sc.field_name is not None):
             print("Value: " + str(t))
         if(len(t) != sz):
-            raise RuntimeError("Not enough bytes left to read %d bytes for field %s" % (sz, self.field_name))
-        if(self.field_name is not None):
-            try:
-                self.raw_value_dict[k] = NitfLiteral(t)
-                if(nitf_literal):
-                    self.value_dict[k] = NitfLiteral(t)
-                elif(self.optional and
-                 t.rstrip(self.optional_char.encode(_text_codec) + b' ') == b''):
-                    self.value_dict[k] = None
-                elif(self.ty == str):
-                    self.value_dict[k] = t.rstrip().decode(_text_codec, "replace")
-                elif(self.ty == bytes):
-                    # Don't strip spaces or nulls, since these are valid
-                    # byte values
-                    self.value_dict[k] = self.ty(t)
-                else:
-                    v = t.rstrip()
-                    if(v == b''):
-                        raise RuntimeError("Empty string read for field %s" % self.field_name)
-                    self.value_dict[k] = self.ty(v)
-            except Exception as e:
-                raise Exception("Exception while parsing ", self.field_name, " from ", t.rstrip(), "underlying error: ", e)
+            raise RuntimeError("Not enough bytes left to read %d bytes for field %s" % (sz, sc.field_name))
+        if(sc.field_name is None):
+            return
+        if(lazy_buffer is not None):
+            if(self.lazy_loc is None):
+                self.lazy_loc = {}
+            self.lazy_loc[k] = (lazy_buffer, len(lazy_buffer), sz)
+            lazy_buffer += t
+            self.value_dict.pop(k, None)
+            self.raw_value_dict.pop(k, None)
+            return
+        self.raw_value_dict[k] = NitfLiteral(t)
+        self.value_dict[k] = self._decode(t, nitf_literal)
+        if(self.lazy_loc):
+            self.lazy_loc.pop(k, None)
+
+    def _decode(self, t, nitf_literal):
+        '''Convert the raw bytes t read from a file to our value.'''
+        sc = self._schema
+        try:
+            if(nitf_literal):
+                return NitfLiteral(t)
+            elif(sc.optional and
+                 t.rstrip(sc.optional_char.encode(_text_codec) + b' ') == b''):
+                return None
+            elif(sc.ty == str):
+                return t.rstrip().decode(_text_codec, "replace")
+            elif(sc.ty == bytes):
+                # Don't strip spaces or nulls, since these are valid
+                # byte values
+                return sc.ty(t)
+            else:
+                v = t.rstrip()
+                if(v == b''):
+                    raise RuntimeError("Empty string read for field %s" % sc.field_name)
+                return sc.ty(v)
+        except Exception as e:
+            raise Exception("Exception while parsing ", sc.field_name, " from ", t.rstrip(), "underlying error: ", e)
+
+    def _column_bytes(self, n):
+        '''Return the bytes for the first n values of a field in a 1d loop,
+        or None if we can't do this all at once (e.g., we have NitfLiteral
+        values). This is used by NitfLoop when writing a regular loop.'''
+        sc = self._schema
+        if(sc.field_name is None):
+            return self.bytes((0,)) * n
+        if(self.lazy_loc):
+            return None
+        vd = self.value_dict
+        vals = [vd[(i,)] for i in range(n)]
+        if(any(isinstance(v, NitfLiteral) for v in vals)):
+            return None
+        return _format_column(list(map(sc.ty, vals)), self.size((0,)),
+                              sc.ty, sc.frmt,
+                              sc.field_name).encode(_text_codec)
+        
+    def _read_column(self, col):
+        '''Set all the values for a field in a 1d loop. col is a numpy "S"
+        array with the bytes for each index. This is used by NitfLoop
+        when reading a regular loop, and is only used for int and float 
+        fields.'''
+        try:
+            v = col.astype(np.int64 if self.ty == int else np.float64)
+        except ValueError as e:
+            raise RuntimeError("Error decoding values for field %s" % self.field_name) from e
+        self.value_dict.update(((i,), x) for i, x in enumerate(v.tolist()))
+        self.lazy_loc = None
+        self.raw_value_dict.update(((i,), NitfLiteral(t))
+                                   for i, t in enumerate(col.tolist()))
 
 class FieldData(NitfField):
     '''Class to handle generic variable size data, which in some cases
@@ -403,9 +644,10 @@ class FieldData(NitfField):
     the underlying data to and from bytes.  Often derived classes will
     also want to supply a different get_print function.
     '''
+    __slots__ = ()
+    _check_or_set_size = True
     def __init__(self, fs, field_name, size, ty, loop, options):
         super().__init__(fs, field_name, size, bytes, loop, options)
-        self._check_or_set_size = True
         
     def pack(self, key, val):
         '''Return bytes representing the given value.'''
@@ -428,6 +670,7 @@ class FieldData(NitfField):
             super().__setitem__(key, self.pack(key, None))
             
 class StringFieldData(FieldData):
+    __slots__ = ()
     def get_print(self, key):
         t = self[key]
         if(t is None or len(t) == 0):
@@ -443,6 +686,7 @@ class StringFieldData(FieldData):
         return v.encode(_text_codec)
 
 class BytesFieldData(FieldData):
+    __slots__ = ()
     def get_print(self, key):
         t = self[key]
         if(t is None or len(t) == 0):
@@ -458,6 +702,7 @@ class BytesFieldData(FieldData):
         return v.encode(_text_codec)
     
 class FloatFieldData(FieldData):
+    __slots__ = ()
     def get_print(self, key):
         t = self[key]
         if(t is None):
@@ -471,9 +716,10 @@ class FloatFieldData(FieldData):
         return pack(">f", v)
 
 class IntFieldData(FieldData):
-    def __init__(self, fs, field_name, size, ty, loop, options):
-        super().__init__(fs, field_name, size, ty, loop, options)
-        self.signed = options.get("signed", False)
+    __slots__ = ()
+    @property
+    def signed(self):
+        return self._schema.options.get("signed", False)
         
     def get_print(self, key):
         t = self[key]
@@ -527,53 +773,323 @@ class IntFieldData(FieldData):
         else:
             raise Exception("Can't determine number format")
 
-class NitfLoop(object):
-    '''This handles a NITF looping structure.
+class NitfArrayField(NitfField):
+    '''This is an alternative storage for fixed width int and float 
+    fields in a 1d loop (e.g., the quaternions in DesCSATTB). Rather than
+    a separate dictionary entry for each value, we keep the values in
+    a numpy array. This is selected by the "array_storage" option in
+    the FieldStruct description, see FieldStruct for details.
+
+    When reading, we just save the raw bytes in a numpy "S" array. The
+    values are decoded in one pass the first time they are needed.
+
+    Values that are NitfLiteral (e.g., read with nitf_literal set to True)
+    are kept in value_dict like a normal NitfField.'''
+    __slots__ = ("_array", "_raw", "_nread")
+    # Types we can store in an array
+    _dtype = {int : np.int64, float : np.float64}
+    
+    def _bind(self, fs, schema, loop):
+        super()._bind(fs, schema, loop)
+        # Decoded values, or None if we haven't decoded _raw yet
+        self._array = None
+        # Raw bytes read from the file, and how many of these we have.
+        # An empty entry means the value has been set since we read it.
+        self._raw = None
+        self._nread = 0
+
+    def _values(self):
+        '''Return the array of values, decoding the raw data if needed.'''
+        if(self._array is None):
+            dtype = self._dtype[self._schema.ty]
+            if(self._raw is None):
+                self._array = np.zeros((0,), dtype=dtype)
+            else:
+                try:
+                    self._array = self._raw[:self._nread].astype(dtype)
+                except ValueError as e:
+                    raise RuntimeError("Error decoding values for field %s" % self.field_name) from e
+        return self._array
+
+    def _resize(self, n):
+        '''Make sure we have space for at least n values, filling in new
+        values with the default.'''
+        arr = self._values()
+        if(arr.shape[0] < n):
+            d = self.default if self.default is not None else 0
+            t = np.full((max(n, 2 * arr.shape[0]),), d, dtype=arr.dtype)
+            t[:arr.shape[0]] = arr
+            self._array = arr = t
+        return arr
+
+    def to_numpy(self):
+        '''Return the values as a numpy array. Normally this is a view
+        of the underlying storage, so changing it changes the field values
+        (but note get_raw_bytes will still return the data read from the
+        file). If any of the values are NitfLiteral, we instead return
+        a copy.'''
+        n = self.loop.shape(())
+        if(self.value_dict):
+            return np.array([self[(i,)] for i in range(n)],
+                            dtype=self._dtype[self.ty])
+        return self._resize(n)[:n]
 
-    Because it is convenient, we have a "null" pseudo loop as the
-    outer loop.  This just allows us to treat the outer fields not in
-    a loop the same way we treat the loops.  This is indicated by
-    having parent_list None.
+    def __getitem__(self, key):
+        k = self.key_as_tuple(key)
+        self.loop.check_index(k)
+        if(self.value_dict and k in self.value_dict):
+            return super().__getitem__(k)
+        arr = self._values()
+        if(k[0] < arr.shape[0]):
+            return self.ty(arr[k[0]])
+        return self.ty(self.default if self.default is not None else 0)
 
-    The keys of the pseudo loop are just the list [(),]
-    ''' 
-    def __init__(self, fs, parent_loop, desc, field):
-        '''Note, this also fills in data in the OrderedDict field.'''
-        self.fs = fs
+    def __setitem__(self, key, v):
+        if(isinstance(v, NitfLiteral) or v is None):
+            super().__setitem__(key, v)
+            return
+        k = self.key_as_tuple(key)
+        self.loop.check_index(k)
+        if(self.hardcoded_value):
+            raise RuntimeError("Can't set value for field " + self.field_name)
+        if(self.fs and hasattr(self.fs, "tre_implementation_field") and
+           self.fs.tre_implementation_field is not None):
+            raise RuntimeError("You can't directly set fields in %s TRE. Instead, set this through the %s object" % (self.fs.cetag_value(), self.fs.tre_implementation_field))
+        self.value_dict.pop(k, None)
+        self.raw_value_dict.pop(k, None)
+        self._resize(k[0] + 1)[k[0]] = self.ty(v)
+        if(k[0] < self._nread):
+            self._raw[k[0]] = b''
+
+    def get_raw_bytes(self, key):
+        k = self.key_as_tuple(key)
+        if(k in self.raw_value_dict):
+            return self.raw_value_dict[k].value
+        if(k[0] < self._nread and self._raw[k[0]] != b''):
+            return bytes(self._raw[k[0]])
+        return self.bytes(k)
+
+    def bytes(self, key=()):
+        k = self.key_as_tuple(key)
+        if(k in self.value_dict):
+            return super().bytes(k)
+        sz = self.size(k)
+        t = self._format_val(self[k], sz)
+        if(len(t) != sz):
+            raise RuntimeError("Formatting error. String '%s' is not right length for NITF field %s" % (t, self.field_name))
+        return t.encode(_text_codec)
+
+    def _column_bytes(self, n):
+        if(self.value_dict):
+            return None
+        return _format_column(self._resize(n)[:n].tolist(), self.size((0,)),
+                              self.ty, self.frmt,
+                              self.field_name).encode(_text_codec)
+    
+    def _read_column(self, col):
+        self.value_dict.clear()
+        self.raw_value_dict.clear()
+        self._array = None
+        self._raw = col
+        self._nread = col.shape[0]
+        
+    def read_from_file(self, fh, nitf_literal, key, lazy_buffer=None):
+        # Note that we already delay decoding the values, so we don't
+        # do anything different for lazy_buffer
+        k = self.key_as_tuple(key)
+        if(k[0] == 0):
+            self.value_dict.clear()
+            self.raw_value_dict.clear()
+            self._array = None
+            self._raw = None
+            self._nread = 0
+        if(nitf_literal):
+            super().read_from_file(fh, nitf_literal, k)
+            return
+        sz = self.size(k)
+        t = fh.read(sz)
+        if(len(t) != sz):
+            raise RuntimeError("Not enough bytes left to read %d bytes for field %s" % (sz, self.field_name))
+        if(self._raw is None):
+            self._raw = np.empty((self.loop.shape(()),), dtype="S%d" % sz)
+        self._raw[k[0]] = t
+        self._nread = k[0] + 1
+        
+class _LoopSchema(object):
+    '''This is the layout of a loop in a FieldStruct description. Like
+    _FieldSchema, this is shared by all instances of a FieldStruct class
+    and should be treated as immutable.
+
+    parent_list is None for the pseudo outer loop, otherwise it is a tuple
+    of the enclosing _LoopSchema objects (outermost first).
+    '''
+    def __init__(self, parent_loop, desc, item_list, field):
+        '''Note, this also fills in item_list and the OrderedDict field.'''
+        self.index = len(item_list)
+        item_list.append(self)
         self.parent_list = None
         if(parent_loop):
             if(parent_loop.parent_list):
-                self.parent_list = (*parent_loop.parent_list,
-                                    weakref.proxy(parent_loop),)
+                self.parent_list = (*parent_loop.parent_list, parent_loop)
             else:
-                self.parent_list = (weakref.proxy(parent_loop),)
+                self.parent_list = (parent_loop,)
         self.field_list = []
+        self.dim_size = 0 if self.parent_list is None else len(self.parent_list)
         if(self.parent_list):
             if(desc[0][0] != "loop"):
                 raise RuntimeError("Error parsing looping structure:\n" + desc)
-            self._shape = desc[0][1]
+            self.shape = desc[0][1]
+            self.shape_func = _compile_expr(self.shape)
             desc_rest = desc[1:]
         else:
-            self._shape = None
+            self.shape = None
+            self.shape_func = None
             desc_rest = desc
         for row in desc_rest:
             if(isinstance(row[0], list)):
-                self.field_list.append(NitfLoop(self.fs, self, row, field))
+                self.field_list.append(_LoopSchema(self, row, item_list,
+                                                   field))
             else:
                 field_name, desc, size, ty, rest = row[0],row[1],row[2],row[3],row[4:]
                 options = {}
                 if(len(rest) > 0):
                     options = rest[0]
-                fv = options.get("field_value_class", NitfField)(self.fs,
-                              field_name, size, ty, self, options)
+                # FieldData always stores the underlying bytes
+                cls = options.get("field_value_class", NitfField)
+                if(issubclass(cls, FieldData)):
+                    ty = bytes
+                if(options.get("array_storage", False)):
+                    if(ty not in NitfArrayField._dtype or
+                       not isinstance(size, int) or self.dim_size != 1 or
+                       "condition" in options or options.get("optional", False) or
+                       "value" in options or
+                       "field_value_class" in options):
+                        raise RuntimeError("array_storage can only be used for a fixed size int or float field in a 1d loop, without a condition, optional or value. Field %s" % field_name)
+                    options = dict(options, field_value_class=NitfArrayField)
+                fsc = _FieldSchema(field_name, size, ty, self, options,
+                                   index=len(item_list))
+                item_list.append(fsc)
                 if(field_name):
-                    field[field_name] = fv
-                self.field_list.append(fv)
-                
+                    field[field_name] = fsc
+                self.field_list.append(fsc)
+        self.record_dtype = self._record_dtype()
+
+    def _record_dtype(self):
+        '''If this is a "regular" loop, return the numpy dtype of one
+        record of the loop, otherwise return None.
+
+        A regular loop is a 1d loop where each field has a fixed size and
+        no condition, so the data is just a 2d array of bytes. We can then
+        read all of it at once, and convert a column at a time (see
+        NitfLoop.read_from_file).'''
+        if(self.dim_size != 1 or len(self.field_list) == 0):
+            return None
+        names = []
+        formats = []
+        for i, fsc in enumerate(self.field_list):
+            if(not isinstance(fsc, _FieldSchema) or
+               not isinstance(fsc.size, int) or
+               fsc.condition_func is not None or fsc.value_func is not None):
+                return None
+            sz = fsc.size - fsc.size_offset if fsc.size != 0 else 0
+            if(sz <= 0):
+                return None
+            # Reserved fields are just skipped
+            if(fsc.field_name is not None and
+               fsc.field_value_class is not NitfArrayField and
+               (fsc.field_value_class is not NitfField or fsc.optional or
+                fsc.ty not in (int, float) or
+                (fsc.ty == int and sz > 18))):
+                return None
+            names.append("f%d" % i)
+            formats.append("S%d" % sz)
+        return np.dtype({"names" : names, "formats" : formats})
+
+class _FieldStructSchema(object):
+    '''This is the parsed version of a FieldStruct description. We
+    parse the description (and compile all the expressions in it) once
+    for each FieldStruct class, and then share this between all the
+    instances of the class. Each instance then just needs to create the
+    NitfField and NitfLoop objects to hold its own values.
+
+    item_list has all the _LoopSchema and _FieldSchema objects, in an
+    order where a loop always comes before anything it contains. The
+    index attribute of each item is its position in this list.
+    '''
+    def __init__(self, desc):
+        self.desc = desc
+        self.item_list = []
+        self.field = OrderedDict()
+        self.pseudo_outer_loop = _LoopSchema(None, desc, self.item_list,
+                                             self.field)
+
+    def create_instance_objects(self, fs):
+        '''Create the NitfLoop and NitfField objects for the FieldStruct
+        fs. This returns a list lined up with item_list.'''
+        res = []
+        for item in self.item_list:
+            if(isinstance(item, _LoopSchema)):
+                parent = None
+                if(item.parent_list):
+                    parent = res[item.parent_list[-1].index]
+                obj = NitfLoop(fs, parent, item)
+            else:
+                parent = res[item.loop.index]
+                obj = item.field_value_class._from_schema(fs, item, parent)
+            if(parent is not None):
+                parent.field_list.append(obj)
+            res.append(obj)
+        return res
+
+# Cache of _FieldStructSchema, indexed by id of the class desc. Note that
+# the _FieldStructSchema holds onto the desc, so the id stays valid.
+_field_struct_schema_cache = {}
+
+def _field_struct_schema(desc):
+    '''Return the shared _FieldStructSchema for the class description
+    desc, creating it if needed.'''
+    sc = _field_struct_schema_cache.get(id(desc))
+    if(sc is None):
+        sc = _FieldStructSchema(desc)
+        _field_struct_schema_cache[id(desc)] = sc
+    return sc
+
+class NitfLoop(object):
+    '''This handles a NITF looping structure.
+
+    Because it is convenient, we have a "null" pseudo loop as the
+    outer loop.  This just allows us to treat the outer fields not in
+    a loop the same way we treat the loops.  This is indicated by
+    having parent_list None.
+
+    The keys of the pseudo loop are just the list [(),]
+
+    The layout of the loop is kept in a _LoopSchema shared between all
+    the instances of a FieldStruct class, this object just ties the
+    layout to the NitfField objects for one instance.
+    ''' 
+    __slots__ = ("fs", "_schema", "parent_list", "field_list")
+    def __init__(self, fs, parent_loop, schema):
+        '''Note, this doesn't fill in field_list, that is done by
+        _FieldStructSchema.create_instance_objects.'''
+        self.fs = fs
+        self._schema = schema
+        self.parent_list = None
+        if(parent_loop):
+            if(parent_loop.parent_list):
+                self.parent_list = (*parent_loop.parent_list, parent_loop)
+            else:
+                self.parent_list = (parent_loop,)
+        self.field_list = []
+
+    @property
+    def _shape(self):
+        return self._schema.shape
+    
     def shape(self, key):
         '''Return size of this dimension.'''
         if(len(key) >= self.dim_size - 1):
-            t = _eval_or_exec_expr(self.fs, key, self._shape, True)
+            t = self._schema.shape_func(self.fs, *key)
             if(t is None):
                 t = 0
             return t
@@ -583,16 +1099,14 @@ class NitfLoop(object):
     @property
     def dim_size(self):
         '''Return the dim size of this loop (e.g., 2d, 3d, etc)'''
-        if(self.parent_list is None):
-            return 0
-        return len(self.parent_list)
+        return self._schema.dim_size
     
     def check_index(self, key):
         '''Check if key is within the range of the loops'''
         # Skip if we are null outer loop
         if(self.parent_list is None):
             return
-        if(len(key) != self.dim_size):
+        if(len(key) != self._schema.dim_size):
             raise IndexError()
         if(isinstance(key[-1], slice)):
             raise RuntimeError("FieldStruct doesn't support slices in arrays")
@@ -624,16 +1138,64 @@ class NitfLoop(object):
         
     def write_to_file(self, fh, lead=()):
         '''Write data stored in the loop to a file'''
+        if(self._schema.record_dtype is not None and
+           self._write_records(fh, lead)):
+            return
         for k in self.key_subloop(lead):
             for fv in self.field_list:
                 fv.write_to_file(fh, k)
             
-    def read_from_file(self, fh, nitf_literal=False, lead=()):
-        '''Read data from a file for the fields in this loop'''
+    def read_from_file(self, fh, nitf_literal=False, lead=(),
+                       lazy_buffer=None):
+        '''Read data from a file for the fields in this loop. See 
+        FieldStruct.read_from_file for lazy_buffer.'''
+        if(not nitf_literal and self._schema.record_dtype is not None):
+            self._read_records(fh, lead)
+            return
         for k in self.key_subloop(lead):
             for fv in self.field_list:
-                fv.read_from_file(fh, nitf_literal, k)
-
+                fv.read_from_file(fh, nitf_literal, k, lazy_buffer)
+
+    def _write_records(self, fh, lead):
+        '''Write a regular loop (see _LoopSchema.record_dtype) by
+        formatting each column at once. This returns False if some field
+        can't be done this way, in which case nothing is written.'''
+        dtype = self._schema.record_dtype
+        n = max(self.shape(lead), 0)
+        cols = [fv._column_bytes(n) for fv in self.field_list]
+        if(any(t is None for t in cols)):
+            return False
+        if(DEBUG):
+            print("Writing loop: ", self._shape, " records: ", n)
+        buf = np.empty((n, dtype.itemsize), dtype=np.uint8)
+        start = fh.tell()
+        for i, (fv, t) in enumerate(zip(self.field_list, cols)):
+            fdtype, offset = dtype.fields["f%d" % i]
+            buf[:, offset:offset+fdtype.itemsize] = \
+                np.frombuffer(t, dtype=np.uint8).reshape(n, fdtype.itemsize)
+            if(fv.field_name is not None):
+                fv.fh_loc.update(((j,), start + offset + j * dtype.itemsize)
+                                 for j in range(n))
+        fh.write(buf.tobytes())
+        return True
+    
+    def _read_records(self, fh, lead):
+        '''Read a regular loop (see _LoopSchema.record_dtype) with one
+        read, and then pass each field its column of the data.'''
+        dtype = self._schema.record_dtype
+        # Note that a negative shape is treated as 0, like range does
+        n = max(self.shape(lead), 0)
+        sz = n * dtype.itemsize
+        if(DEBUG):
+            print("Reading loop: ", self._shape, " records: ", n)
+        t = fh.read(sz)
+        if(len(t) != sz):
+            raise RuntimeError("Not enough bytes left to read %d bytes for loop %s" % (sz, self._shape))
+        rec = np.frombuffer(bytearray(t), dtype=dtype)
+        for i, fv in enumerate(self.field_list):
+            if(fv.field_name is not None):
+                fv._read_column(rec["f%d" % i])
+        
     def to_list(self, fld,lead=()):
         '''Return the data in NitfField fld as a nested list. Scalar items 
         are returned as a scalar'''
@@ -745,6 +1307,12 @@ class FieldStruct(object):
     size_not_updated - See below
     signed  - Used by IntFieldData to determine if data is signed or
               unsigned. Default is False, or unsigned.
+    array_storage - If True, store the values in a numpy array rather than
+              separately for each index (see NitfArrayField). This is
+              for large loops (e.g., the attitude points in DesCSATTB), and 
+              is only allowed for a fixed size int or float field in a 1d
+              loop, without condition, optional or value. You can get the
+              values for these fields as a numpy array with to_numpy().
 
     The 'frmt' can be a format string (e.g., "%03d" for a 3 digit integer),
     or it can be a function that takes a value and returns a string - useful
@@ -796,8 +1364,10 @@ class FieldStruct(object):
         # structure including reserve fields (without a field name) and
         # looping structure. It is focused on the layout of the data
         # in the NITF file.
-        
-        self.pseudo_outer_loop = None
+        #
+        # These are created the first time they are used (see
+        # _create_field_objects), so a FieldStruct that we never look at
+        # (e.g., a Tre read with delayed_read) is cheap to create.
 
         # We can do delayed reads, useful for data that we might never
         # actual use
@@ -807,14 +1377,24 @@ class FieldStruct(object):
         # order. However, we don't want to assume we are using that new
         # of a version. So for now, we use a OrderedDict.
         
-        self.field = OrderedDict()
         self._desc_init_none = True
         if(description is not None):
             self.desc = copy.deepcopy(description)
             self._desc_init_none = False
-        # Note this also fills in self.field
-        self.pseudo_outer_loop = NitfLoop(weakref.proxy(self), None, self.desc,
-                                          self.field)
+            self._schema = _FieldStructSchema(self.desc)
+        else:
+            # Parsing the description is shared by all instances of
+            # the class.
+            self._schema = _field_struct_schema(self.desc)
+
+    def _create_field_objects(self):
+        '''Create the NitfField and NitfLoop objects for this instance.'''
+        d = self.__dict__
+        d["_field_struct_obj"] = \
+            self._schema.create_instance_objects(weakref.proxy(self))
+        d["field"] = OrderedDict((nm, d["_field_struct_obj"][fsc.index])
+                                 for nm, fsc in self._schema.field.items())
+        d["pseudo_outer_loop"] = d["_field_struct_obj"][0]
 
     def __deepcopy__(self, dict):
         '''Generate a deepcopy. 
@@ -832,29 +1412,46 @@ class FieldStruct(object):
         return res
         
             
-    def __getattr__(self, nm):
-        if('_delayed_read' in self.__dict__ and self._delayed_read):
+    def _finish_delayed_read(self):
+        '''If we did a delayed_read and haven't actually read the data yet,
+        do so now. This gets called before we use any of the fields.'''
+        if(self.__dict__.get('_delayed_read', False)):
             self._delayed_read = False
             self._fh.seek(self._start_pos)
             self.pseudo_outer_loop.read_from_file(self._fh,
-                                                  self._nitf_literal)
-        if("field" not in self.__dict__):
-            raise AttributeError()
-        fld = self.__dict__["field"]
-        if(nm not in fld):
-            raise AttributeError()
-        t = fld[nm]
+                                                  self._nitf_literal,
+                                 lazy_buffer=self._lazy_buffer())
+            
+    def __getattr__(self, nm):
+        if("_schema" not in self.__dict__):
+            raise AttributeError(nm)
+        if(nm in ("field", "pseudo_outer_loop", "_field_struct_obj")):
+            self._create_field_objects()
+            # The field objects can be used to change values, so we need
+            # to have finished reading them first.
+            self._finish_delayed_read()
+            return self.__dict__[nm]
+        self._finish_delayed_read()
+        # Finishing the read may set the attribute (e.g., the
+        # tre_implementation_field of a Tre)
+        if(nm in self.__dict__):
+            return self.__dict__[nm]
+        if(nm not in self._schema.field):
+            raise AttributeError(nm)
+        t = self.field[nm]
         return t if t.has_loop else t[()]
 
     def get_raw_bytes(self, nm, key=()):
         '''Return the raw bytes for a field.'''
-        fld = self.__dict__["field"]
+        self._finish_delayed_read()
+        fld = self.field
         if(nm not in fld):
             raise AttributeError()
         return fld[nm].get_raw_bytes(key)
     
     def __setattr__(self, nm, value):
-        if("field" in self.__dict__ and nm in self.__dict__["field"]):
+        if("_schema" in self.__dict__ and nm in self._schema.field):
+            self._finish_delayed_read()
             t = self.field[nm]
             if(t.has_loop):
                 raise RuntimeError("Need to supply index to %s" % nm)
@@ -864,6 +1461,7 @@ class FieldStruct(object):
 
     def field_names(self):
         '''Return an iterator that returns the field names'''
+        self._finish_delayed_read()
         for f in self.field.values():
             if(f.field_name is not None):
                 yield f.field_name
@@ -888,6 +1486,7 @@ class FieldStruct(object):
         iterate function which can be used to step through the array (e.g.,
         in comparing 2 arrays).
         '''
+        self._finish_delayed_read()
         for f in self.field.values():
             if(f.field_name is not None):
                 if(array_as_list):
@@ -911,9 +1510,11 @@ class FieldStruct(object):
         
     def write_to_file(self, fh):
         '''Write to a file stream.'''
+        self._finish_delayed_read()
         self.pseudo_outer_loop.write_to_file(fh)
 
-    def read_from_file(self, fh, nitf_literal=False, delayed_read=False):
+    def read_from_file(self, fh, nitf_literal=False, delayed_read=False,
+                       lazy_decode=False):
         '''
         Read from a file stream.
 
@@ -923,17 +1524,35 @@ class FieldStruct(object):
         NitfLiteral objects. Normally you don't want this option, but
         it can be useful for cases hard to capture otherwise (e.g.,
         heritage systems that depend on specific formatting).
+
+        lazy_decode set to True just saves the raw bytes of the structure
+        in one buffer, and we only convert a field the first time it is
+        used. This is useful when we only look at a handful of fields
+        (e.g., scanning a large number of files). Fields that haven't 
+        been changed are written back exactly as they were read (rather
+        than being formatted again).
         '''
+        self._lazy_decode = lazy_decode
         if(delayed_read):
             self._delayed_read = True
             self._fh = fh
             self._start_pos = fh.tell()
             self._nitf_literal = nitf_literal
         else:
-            self.pseudo_outer_loop.read_from_file(fh, nitf_literal)
+            self._delayed_read = False
+            self.pseudo_outer_loop.read_from_file(fh, nitf_literal,
+                                 lazy_buffer=self._lazy_buffer())
+
+    def _lazy_buffer(self):
+        '''Return a new buffer to read into if we are doing lazy_decode,
+        None otherwise.'''
+        if(self.__dict__.get("_lazy_decode", False)):
+            return bytearray()
+        return None
             
     def update_field(self, fh, field_name, value, key = ()):
         '''Update a field name in an open file'''
+        self._finish_delayed_read()
         fv = self.field[field_name]
         fv[key] = value
         fv.update_file(fh, key)
@@ -942,6 +1561,7 @@ class FieldStruct(object):
         '''Text description of structure, e.g., something you can print
         out.'''
         res = io.StringIO()
+        self._finish_delayed_read()
         self.pseudo_outer_loop.print_to_fh(res)
         return res.getvalue()
 
@@ -1068,4 +1688,4 @@ class FieldStructDiff(NitfDiffHandle):
     
 __all__ = ["FieldStruct", "NitfField", "FieldData", "BytesFieldData",
            "StringFieldData", "FloatFieldData", "IntFieldData",
-           "FieldStructDiff", "float_to_fixed_width", "NitfLiteral"]
+           "NitfArrayField", "FieldStructDiff", "float_to_fixed_width", "NitfLiteral"]
@@ -16,6 +16,9 @@ from .nitf_segment_data_handle import NitfSegmentDataHandleSet
 import io,copy,weakref
 import copy
 import collections
+import os
+import shutil
+import tempfile
 
 class ListNitfFileReference(collections.UserList):
     '''Useful to add nitf_file to various NitfSegment as they get added
@@ -29,6 +32,24 @@ class ListNitfFileReference(collections.UserList):
         if(v.nitf_file):
             v.nitf_file.segment_hook_set.after_append_hook(v, v.nitf_file)
         
+def _changed_span(old, new):
+    '''Return (start, end) of the part of new that is different from
+    old, or None if they are the same.'''
+    if(old == new):
+        return None
+    if(len(old) != len(new)):
+        return (0, len(new))
+    start = 0
+    while(old[start] == new[start]):
+        start += 1
+    end = len(new)
+    while(old[end - 1] == new[end - 1]):
+        end -= 1
+    return (start, end)
+
+def _is_tre_overflow(dseg):
+    return dseg.subheader.desid.encode("utf-8") == b'TRE_OVERFLOW'
+
 class NitfFile(object):
     '''This is used to read and write a NITF File.
 
@@ -46,15 +67,24 @@ class NitfFile(object):
        :ivar des_segment:      List of NitfDesSegment objects for the file.
        :ivar res_segment:      List of NitfResSegment objects for the file.
        :ivar tre_list:         List of Tre objects for the file level TREs.
+       :ivar lazy_tre:         If True, TREs are only parsed when they are
+                               first used.
 
     '''        
-    def __init__(self, file_name = None, security = security_unclassified):
+    def __init__(self, file_name = None, security = security_unclassified,
+                 lazy_tre = False):
         '''Create a NitfFile for reading or writing. Because it is common, if
         you give a file_name we read from that file to populate the Nitf 
         structure. Otherwise we start with a default file (a file header, but
-        no segments) - which you can then populate before calling write'''
+        no segments) - which you can then populate before calling write
+
+        If lazy_tre is True, then when reading we only find the tag and
+        location of each TRE. A TRE is parsed the first time it is used
+        (e.g., accessing a field). This is much faster if you only need a
+        few TREs from a file with a large number of them.'''
         self.file_header = NitfFileHeader()
         self.file_name = file_name
+        self.lazy_tre = lazy_tre
         self.report_raw = False
         self.segment_hook_set = copy.copy(NitfSegmentHookSet.default_hook_set())
         self.user_subheader_handle_set = copy.copy(NitfSegmentUserSubheaderHandleSet.default_handle_set())
@@ -73,6 +103,16 @@ class NitfFile(object):
         if(file_name is None):
             self.security = security
 
+    @classmethod
+    def open_for_update(cls, file_name, lazy_tre = False):
+        '''Read the given file, so we can change the metadata and then
+        write the changes back to the same file with update, rather than
+        rewriting the whole file with write.
+
+        lazy_tre is useful here, the TREs we don't touch are then written
+        back exactly as they were read.'''
+        return cls(file_name, lazy_tre=lazy_tre)
+
     def __str__(self):
         '''Text description of structure, e.g., something you can print out'''
         res = io.StringIO()
@@ -183,9 +223,10 @@ class NitfFile(object):
                 seg.read_from_file(fh, i)
             self.tre_list = read_tre(self.file_header, self.des_segment,
                                      [["xhdl", "xhdlofl", "xhd"],
-                                      ["udhdl", "udhofl", "udhd"]])
+                                      ["udhdl", "udhofl", "udhd"]],
+                                     delayed_read=self.lazy_tre)
             for seg in self.segments():
-                seg.read_tre(self.des_segment)
+                seg.read_tre(self.des_segment, delayed_read=self.lazy_tre)
             for seg in self.segments():
                 self.segment_hook_set.after_read_hook(seg, self)
     def write(self, file_name):
@@ -225,6 +266,142 @@ class NitfFile(object):
                                    if(dseg.subheader.desid.encode("utf-8") !=
                                       b'TRE_OVERFLOW')])
 
+    def update(self, allow_rewrite=False):
+        '''Write changes to the metadata (file header, subheaders and TREs)
+        back in place to the file we read (see open_for_update).
+
+        We generate the file header and each subheader just like write
+        does, and compare against what is in the file. Only the bytes that
+        changed get written (with os.pwrite), the data for the segments
+        isn't rewritten. So you can change fields (e.g., iid2, idatim or
+        the security markings) or replace a TRE with one of the same
+        length. The data of segments that we can't copy directly (e.g.,
+        the TRE_OVERFLOW DES, or a DES edited through its fields) is
+        updated the same way.
+
+        If a change would alter the length or position of anything (e.g.,
+        a TRE that has grown, or an added segment) we can't update in
+        place. By default this is an error, but if allow_rewrite is True
+        we instead write a new file, replace the old one with it, and
+        read it back in (so the segments are new objects).
+
+        Returns a list of (offset, size) of the bytes written.'''
+        try:
+            plan = self._update_plan()
+        except RuntimeError:
+            if(not allow_rewrite):
+                raise
+            return self._update_rewrite()
+        res = []
+        with open(self.file_name, "r+b") as fh:
+            fd = fh.fileno()
+            for offset, d in plan:
+                span = _changed_span(os.pread(fd, len(d), offset), d)
+                if(span is None):
+                    continue
+                t = memoryview(d)[span[0]:span[1]]
+                pos = offset + span[0]
+                res.append((pos, len(t)))
+                while(len(t) > 0):
+                    n = os.pwrite(fd, t, pos)
+                    t = t[n:]
+                    pos += n
+        return res
+
+    def _update_plan(self):
+        '''Return a list of (offset, bytes) of the file header, subheaders
+        and the data that can't be copied directly, as write would
+        generate them. Raises a RuntimeError if anything would change
+        size or position in the file.'''
+        if(self.file_name is None):
+            raise RuntimeError("Can only update a NitfFile that was read from a file")
+        for seg in self.segments():
+            self.segment_hook_set.before_write_hook(seg, self)
+        # Leave des_segment like we found it if we can't do the update
+        old_des = list(self.des_segment)
+        try:
+            return self._update_layout(old_des)
+        except RuntimeError:
+            self.des_segment = ListNitfFileReference(self, old_des)
+            raise
+
+    def _update_layout(self, old_des):
+        '''Do the work for _update_plan.'''
+        self.des_segment = \
+            ListNitfFileReference(self, [dseg for dseg in old_des
+                                         if not _is_tre_overflow(dseg)])
+        h = self.file_header
+        prepare_tre_write(self.tre_list, h, self.des_segment,
+                          [["xhdl", "xhdlofl", "xhd"],
+                           ["udhdl", "udhofl", "udhd"]])
+        for i, seg in self.segments(include_seg_index=True):
+            seg.prepare_tre_write(i, self.des_segment)
+        # A regenerated TRE_OVERFLOW DES takes the place of the one we
+        # read, if it is at the same place in the list
+        if(len(old_des) == len(self.des_segment)):
+            for dold, dnew in zip(old_des, self.des_segment):
+                if(dold is not dnew and _is_tre_overflow(dold) and
+                   _is_tre_overflow(dnew)):
+                    dnew.header_start = dold.header_start
+                    dnew.header_size = dold.header_size
+                    dnew.data_size = dold.data_size
+        h.numi = len(self.image_segment)
+        h.nums = len(self.graphic_segment)
+        h.numt = len(self.text_segment)
+        h.numdes = len(self.des_segment)
+        h.numres = len(self.res_segment)
+        fh = io.BytesIO()
+        h.write_to_file(fh)
+        if(len(fh.getvalue()) != h.hl):
+            raise RuntimeError("The file header would change size from %d to %d bytes, can't update in place" % (h.hl, len(fh.getvalue())))
+        res = [(0, fh.getvalue())]
+        pos = h.hl
+        for i, seg in self.segments(include_seg_index=True):
+            desc = "%s segment %d" % (seg.segment_type(), i)
+            if(seg.header_start != pos):
+                raise RuntimeError("The %s isn't in the file at the same place, can't update in place" % desc)
+            cls = self.user_subheader_handle_set.user_subheader_cls(seg)
+            if cls and not isinstance(seg.user_subheader, cls):
+                raise RuntimeError("Require user_subheader of type %s" % cls)
+            seg._write_user_subheader()
+            fh = io.BytesIO()
+            seg.subheader.write_to_file(fh)
+            if(len(fh.getvalue()) != seg.header_size):
+                raise RuntimeError("The subheader for the %s would change size from %d to %d bytes, can't update in place" % (desc, seg.header_size, len(fh.getvalue())))
+            res.append((pos, fh.getvalue()))
+            pos += seg.header_size
+            if(seg.can_passthrough_write):
+                pos += seg.data_size
+                continue
+            fh = io.BytesIO()
+            seg.data.write_to_file(fh)
+            if(len(fh.getvalue()) != seg.data_size):
+                raise RuntimeError("The data for the %s would change size from %d to %d bytes, can't update in place" % (desc, seg.data_size, len(fh.getvalue())))
+            res.append((pos, fh.getvalue()))
+            pos += seg.data_size
+        if(pos != h.fl):
+            raise RuntimeError("The file would change size from %d to %d bytes, can't update in place" % (h.fl, pos))
+        return res
+
+    def _update_rewrite(self):
+        '''Fall back for update, write the whole file to a temporary file
+        and then replace the original with it.'''
+        fname = self.file_name
+        fd, tname = tempfile.mkstemp(suffix=".ntf",
+                          dir=os.path.dirname(os.path.abspath(fname)))
+        os.close(fd)
+        try:
+            shutil.copymode(fname, tname)
+            # Segments we haven't changed copy their data from fname, so
+            # it needs to be in place until we are done writing
+            self.write(tname)
+            os.replace(tname, fname)
+        except:
+            os.remove(tname)
+            raise
+        self.read(fname)
+        return [(0, os.path.getsize(fname))]
+
     def segments(self, include_seg_index=False):
         '''Iterator to go through all the segments in a file. We often also
         need the seg_index, so you can pass that as True and we return the
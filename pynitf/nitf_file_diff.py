@@ -1,6 +1,7 @@
 from .nitf_file import (NitfFile, NitfSegment)
 from .nitf_diff_handle import (NitfDiffHandle, NitfDiffHandleSet,
                                DiffContextFilter)
+from .priority_handle_set import PriorityHandleSet
 from .nitf_file_merge import NitfFileMerge
 from .nitf_file_json import NitfFileJson
 import copy
@@ -22,6 +23,7 @@ class NitfDiff(object):
     def __init__(self):
         self.config = copy.deepcopy(NitfDiffHandleSet.default_config)
         self.handle_set = copy.deepcopy(NitfDiffHandleSet.default_handle_set())
+        self._config_generation = PriorityHandleSet._default_generation
         self.context_filter = DiffContextFilter("File level")
 
     def skip_obj(self, obj):
@@ -73,12 +75,23 @@ class NitfDiff(object):
         return self.compare_obj(f1, f2)
     
 
+    def _add_lazy_module_config(self):
+        '''Modules that are imported lazily (e.g., when we first read
+        a DES that uses them) might add default configuration after we
+        were created. Add any new configuration.'''
+        self._config_generation = PriorityHandleSet._default_generation
+        for k, v in NitfDiffHandleSet.default_config.items():
+            if(k not in self.config):
+                self.config[k] = copy.deepcopy(v)
+
     def compare_obj(self, obj1, obj2):
         '''Convenience short hand for calling self.handle_set.handle because
         we do that a lot. This can also be useful to compare
         individual components of a NITF file (e.g, you have 2 files
         open and want to know if two NitfImageSegment are the same)
         '''
+        if(self._config_generation != PriorityHandleSet._default_generation):
+            self._add_lazy_module_config()
         f = self.context_filter if self.context_filter not in logger.filters else None
         try:
             if(f):
@@ -92,6 +105,7 @@ class NitfFileHandle(NitfDiffHandle):
     '''Compare two files. This particular class doesn't try to do anything
     clever about reordering, so it compares the first image segment in file
     1 with the first image segment in file 2 etc.'''
+    diff_type = NitfFile
     def handle_diff(self, f1, f2, nitf_diff):
         if(not isinstance(f1, NitfFile) or
            not isinstance(f2, NitfFile)):
@@ -137,6 +151,7 @@ NitfDiffHandleSet.add_default_handle(NitfFileHandle())
 
 class SegmentDiff(NitfDiffHandle):
     '''Compare two NITF segments.'''
+    diff_type = NitfSegment
     def handle_diff(self, seg1, seg2, nitf_diff):
         if(not isinstance(seg1, NitfSegment) or
            not isinstance(seg2, NitfSegment)):
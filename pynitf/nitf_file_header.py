@@ -96,6 +96,7 @@ class NitfFileHeader(FieldStruct):
 
 class FileHeaderDiff(FieldStructDiff):
     '''Compare two file headers.'''
+    diff_type = NitfFileHeader
     def configuration(self, nitf_diff):
         return nitf_diff.config.get("File Header", {})
 
@@ -68,6 +68,7 @@ class NitfGraphicSubheader(FieldStruct):
 
 class GraphicSubheaderDiff(FieldStructDiff):
     '''Compare two graphic subheaders.'''
+    diff_type = NitfGraphicSubheader
     def configuration(self, nitf_diff):
         return nitf_diff.config.get("Graphic Subheader", {})
 
@@ -4,8 +4,17 @@ from .nitf_segment_data_handle import (NitfImage, NitfSegmentDataHandleSet)
 from .nitf_security import security_unclassified
 from .nitf_diff_handle import (NitfDiffHandle, NitfDiffHandleSet)
 from .weak_key_value_dict import WeakKeyValueDict
+from .nitf_block_cache import block_cache, file_identity
+from .nitf_image_mask import NitfImageMask, BLOCK_NOT_RECORDED
+from .nitf_pixel_packing import (packed_nbpp, packed_size, pack_pixels,
+                                 unpack_pixels)
+from .nitf_image_codec import NitfImageCodecSet, decode_map
+from .nitf_copy_data import copy_file_data
 import numpy as np
+import collections
+import concurrent.futures
 import io
+import os
 import mmap
 import logging
 import copy
@@ -18,10 +27,36 @@ class NitfImageWithSubset(NitfImage):
     for a given subset.
 
     This class provides this interface.
+
+    A derived class that reads blocks that need to be decoded (e.g.,
+    compressed data) can set use_block_cache to True and get the blocks
+    through cached_block. The decoded blocks are then kept in the process
+    wide block_cache (see nitf_block_cache.py), so reading overlapping
+    windows doesn't decode the same block again.
     '''
+    use_block_cache = False
+    
     def __str__(self):
         return 'NitfImageWithSubset'
 
+    def block_cache_key(self, brow, bcol, band=None):
+        '''Key used for the block in block_cache. The segment is
+        identified by the file and the offset of the data in the file
+        (we don't always know the segment index). A band of None means
+        the block contains all the bands.'''
+        if(getattr(self, "_file_identity", None) is None):
+            self._file_identity = file_identity(self.fh_in_name)
+        return (self._file_identity, self.data_start, brow, bcol, band)
+
+    def cached_block(self, brow, bcol, band, create_func):
+        '''Return the given block. If use_block_cache is True we look
+        for this in block_cache first, otherwise we just call
+        create_func() to create the block.'''
+        if(not self.use_block_cache):
+            return create_func()
+        return block_cache.get(self.block_cache_key(brow, bcol, band),
+                               create_func)
+
     def __getitem__(self, ind):
         '''Return data read from image segment. This takes band, line, and
         sample or line, sample. Because it is so common, we can take
@@ -45,6 +80,7 @@ class NitfImagePlaceHolder(NitfImage):
     '''Implementation that doesn't actually read any data, useful as a
     final place holder if none of our other NitfImage classes can handle
     a particular image. We just skip over the data when reading.'''
+    passthrough_write = True
     
     def __str__(self):
         return "NitfImagePlaceHolder %d bytes of data" % (self._seg().data_size)
@@ -71,23 +107,13 @@ class NitfImagePlaceHolder(NitfImage):
         return True
 
     def write_to_file(self, fh):
-        '''Write an image to a file.'''
-        bytes_left = self._data_size
-        buffer_size = 1024*1024
-        with open(self.fh_in_name, 'rb') as fh_in:
-            fh_in.seek(self.data_start)
-            while(bytes_left > 0):
-                if bytes_left < buffer_size:
-                    d = fh_in.read(bytes_left)
-                else:
-                    d = fh_in.read(buffer_size)
-                fh.write(d)
-
-                #This may go negative on the last loop but that's fine
-                bytes_left = bytes_left - buffer_size
+        '''Write an image to a file. We just copy the data from the
+        file we read.'''
+        copy_file_data(fh, self.fh_in_name, self.data_start, self._data_size)
 
 logger = logging.getLogger('nitf_diff')
 class ImagePlaceHolderDiff(NitfDiffHandle):
+    diff_type = NitfImagePlaceHolder
     def handle_diff(self, d1, d2, nitf_diff):
         if(not isinstance(d1, NitfImagePlaceHolder) or
            not isinstance(d2, NitfImagePlaceHolder)):
@@ -105,6 +131,8 @@ class NitfImageReadNumpy(NitfImageWithSubset):
     This is a good default class. It does not handle blocked data or 
     compression however.
     '''
+    # We write by copying the data from the file we read
+    passthrough_write = True
 
     # Keep a list of mmap associated with a filehandle. If either the
     # mmap or the filehandle disappears, this gets removed from this
@@ -119,6 +147,45 @@ class NitfImageReadNumpy(NitfImageWithSubset):
         super().__init__(*args, **kwargs)
         self.data = None
 
+    @classmethod
+    def handle_key(cls):
+        '''We only handle uncompressed data.'''
+        return ("NC",)
+
+    @staticmethod
+    def _single_block_pixel_interleave(ih):
+        '''True if the image is IMAGE_GEN_MODE_ROW_P, i.e., band
+        interleaved by pixel stored as one block per row.'''
+        return (ih.imode == "P" and ih.nbpr == 1 and ih.nbpc == ih.shape[1]
+                and ih.nppbh == ih.shape[2])
+    
+    @classmethod
+    def can_handle(cls, subheader, user_subheader):
+        '''Check if we can read the data.'''
+        ih = subheader
+        if(ih.ic != "NC"):
+            return False
+        # We have handling for IMAGE_GEN_MODE_ROW_P. We should be able to
+        # extend this over time, but for now just implement this one case.
+        if(not cls._single_block_pixel_interleave(ih)):
+            if(ih.nbpr != 1 or ih.nbpc != 1):
+                return False
+            # We could add support here for pixel or row interleave here if
+            # needed, just need to work though juggling the data here.
+            if(ih.imode != "B" and ih.imode != "P"):
+                return False
+        # Likewise, we don't work with packed data (e.g., 1 bit), see
+        # NitfImageReadBlocked for that.
+        if(ih.nbpp % 8 != 0):
+            return False
+        # Finally, there may be some weird combination of nbpp and pvtype
+        # that we don't recognize. In this case, skip handling
+        try:
+            dt = ih.dtype
+        except RuntimeError:
+            return False
+        return True
+
     def __getitem__(self, ind):
         return self.data[ind]
 
@@ -129,41 +196,21 @@ class NitfImageReadNumpy(NitfImageWithSubset):
 
     def read_from_file(self, fh, segindex=None):
         '''Read from a file'''
+        ih = self.subheader
+        if(not self.can_handle(ih, self.user_subheader)):
+            return False
 
         # Save the file handle and data start location in the file because
         # it will come in handy later
         self.data_start = fh.tell()
         self.fh_in_name = fh.name
 
-        # Check if we can read the data.
-        ih = self.subheader
-        if(ih.ic != "NC"):
-            return False
-        # We have handling for IMAGE_GEN_MODE_ROW_P. We should be able to extend
-        # this over time, but for now just implement this one case.
         strides = None
-        if(ih.imode == "P" and ih.nbpr == 1 and ih.nbpc == ih.shape[1] and
-           ih.nppbh == ih.shape[2]):
+        if(self._single_block_pixel_interleave(ih)):
             strides = np.array([1, ih.shape[0] * ih.shape[2], ih.shape[0]])
             # strides is in bytes for ndarray, so we need to multiple
             # by itemsize
             strides *= ih.dtype.itemsize
-        else:
-            if(ih.nbpr != 1 or ih.nbpc != 1):
-                return False
-            # We could add support here for pixel or row interleave here if
-            # needed, just need to work though juggling the data here.
-            if(ih.imode != "B" and ih.imode != "P"):
-                return False
-        # Likewise, we don't work with 1 bit data
-        if(ih.nbpp == 1):
-            return False
-        # Finally, there may be some weird combination of nbpp and pvtype
-        # that we don't recognize. In this case, skip handling
-        try:
-            dt = ih.dtype
-        except RuntimeError:
-            return False
         if(self.do_mmap):
             if(fh not in self.mmap_cache):
                 self.mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
@@ -187,22 +234,381 @@ class NitfImageReadNumpy(NitfImageWithSubset):
         return True
 
     def write_to_file(self, fh):
-        '''Write an image to a file.'''
-        bytes_left = self.data_size
-        buffer_size = 1024*1024
-        with open(self.fh_in_name, 'rb') as fh_in:
-            fh_in.seek(self.data_start)
-            while(bytes_left > 0):
-                if bytes_left < buffer_size:
-                    d = fh_in.read(bytes_left)
+        '''Write an image to a file. We just copy the data from the
+        file we read.'''
+        copy_file_data(fh, self.fh_in_name, self.data_start, self.data_size)
+
+class NitfImageReadBlocked(NitfImageWithSubset):
+    '''Implementation of NitfImage that reads blocked data.
+    This handles all the IMODE values (B, P, R and S), and masked data
+    (IC of NM). For masked data, blocks that aren't recorded in the file
+    are returned as pad pixels without reading anything.
+
+    We memory map the file, and create a numpy view of each block as we
+    need it. Reading a subset only touches the blocks that intersect it,
+    and if the subset is entirely in one block we just return a view of
+    that block without copying the data.
+
+    We also handle packed data with a nbpp of 1 or 12 (see 
+    nitf_pixel_packing.py). We unpack a full block at a time, and keep
+    the unpacked blocks in the block_cache.
+
+    Compressed data is handled if there is a NitfImageCodec for the IC
+    (see nitf_image_codec.py), for IMODE B and P. The blocks that a window
+    needs are decoded in parallel, and kept in the block_cache.
+
+    This is registered with a lower priority than NitfImageReadNumpy, 
+    which handles the simpler unblocked data.
+    '''
+    # We write by copying the data from the file we read
+    passthrough_write = True
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.mm = None
+
+    def __str__(self):
+        return "NitfImageReadBlocked %d x %d x %d %s image, %d x %d blocks" % (self.shape[0], self.shape[1], self.shape[2], str(self.dtype.newbyteorder("=")), self.subheader.nbpc, self.subheader.nbpr)
+
+    @classmethod
+    def handle_key(cls):
+        '''We handle any IC that has a codec, and codecs can be added
+        at any time. So we need to check in can_handle.'''
+        return None
+
+    @classmethod
+    def can_handle(cls, subheader, user_subheader):
+        '''Check if we can read the data.'''
+        ih = subheader
+        if(ih.imode not in ("B", "P", "R", "S")):
+            return False
+        if(ih.ic not in ("NC", "NM")):
+            # A codec decodes a record, which is either a band of a block
+            # (IMODE B) or a full block (IMODE P).
+            if(ih.imode not in ("B", "P") or
+               NitfImageCodecSet.default_handle_set().codec(ih) is None):
+                return False
+        elif(ih.nbpp % 8 != 0):
+            # We don't work with data that isn't a multiple of 8 bits, other
+            # than the packed data we support
+            if(ih.nbpp not in packed_nbpp):
+                return False
+        try:
+            dt = ih.dtype
+        except RuntimeError:
+            return False
+        return True
+    
+    def read_from_file(self, fh, segindex=None):
+        '''Read from a file. We don't actually read the data, just
+        memory map it.'''
+        ih = self.subheader
+        if(not self.can_handle(ih, self.user_subheader)):
+            return False
+        self.data_start = fh.tell()
+        self.fh_in_name = fh.name
+        self.data_size = self._seg().data_size
+        if(fh not in NitfImageReadNumpy.mmap_cache):
+            self.mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            NitfImageReadNumpy.mmap_cache[fh] = self.mm
+        else:
+            self.mm = NitfImageReadNumpy.mmap_cache[fh]
+        # A value of 0 means the block is the full image size (only
+        # allowed if there is 1 block in that direction)
+        self.nppbv = ih.nppbv if ih.nppbv != 0 else ih.nrows
+        self.nppbh = ih.nppbh if ih.nppbh != 0 else ih.ncols
+        isz = ih.dtype.itemsize
+        nband = ih.number_band
+        npix = self.nppbv * self.nppbh
+        # Strides of band, line, and sample within a block, and the
+        # offset between blocks
+        if(ih.imode == "B"):
+            # Band interleaved by block, so each block has all of its
+            # bands one after the other.
+            self.block_strides = (npix * isz, self.nppbh * isz, isz)
+            self.block_offset = npix * nband * isz
+        elif(ih.imode == "P"):
+            self.block_strides = (isz, self.nppbh * nband * isz, nband * isz)
+            self.block_offset = npix * nband * isz
+        elif(ih.imode == "R"):
+            self.block_strides = (self.nppbh * isz, self.nppbh * nband * isz,
+                                  isz)
+            self.block_offset = npix * nband * isz
+        else:
+            # Band sequential, so all the blocks of one band followed by
+            # the blocks of the next band.
+            self.block_strides = (npix * ih.nbpr * ih.nbpc * isz,
+                                  self.nppbh * isz, isz)
+            self.block_offset = npix * isz
+        self.codec = None
+        self.packed = False
+        if(ih.ic not in ("NC", "NM")):
+            self.codec = NitfImageCodecSet.default_handle_set().codec(ih)
+            # Decoding takes time, so cache the results
+            self.use_block_cache = True
+        elif(ih.nbpp % 8 != 0):
+            self.packed = True
+            # Size of a record, which is each band of a block for IMODE
+            # B and S, otherwise a full block
+            if(ih.imode in ("B", "S")):
+                self.record_size = packed_size(npix, ih.nbpp)
+            else:
+                self.record_size = packed_size(npix * nband, ih.nbpp)
+            # Unpacking takes some time, so cache the results
+            self.use_block_cache = True
+        self.mask = None
+        self.pad_value = ih.dtype.type(0)
+        if(NitfImageMask.has_mask(ih)):
+            self.mask = NitfImageMask.read_from_file(fh, ih)
+            self.pad_value = self.mask.pad_value(ih.dtype)
+            self.blocked_data_start = self.data_start + self.mask.imdatoff
+        else:
+            self.blocked_data_start = self.data_start
+        if(self.codec is not None):
+            self._find_records()
+        fh.seek(self.data_start + self.data_size, 0)
+        return True
+
+    def _find_records(self):
+        '''Find the start and end of each compressed record, in the
+        order given by _record_index. This comes from the mask table if
+        we have one, otherwise the codec finds the records. Each record
+        goes up to the start of the next record in the file.'''
+        ih = self.subheader
+        nrecord = ih.nbpr * ih.nbpc
+        if(ih.imode in ("B", "S")):
+            nrecord *= ih.number_band
+        end = self.data_start + self.data_size - self.blocked_data_start
+        if(self.mask is not None and self.mask.bmr is not None):
+            offs = [int(v) for v in self.mask.bmr]
+        else:
+            offs = self.codec.record_offsets(self.mm, self.blocked_data_start,
+                                             self.blocked_data_start + end,
+                                             nrecord)
+        srt = sorted(set(v for v in offs if v != BLOCK_NOT_RECORDED))
+        rend = dict(zip(srt, srt[1:] + [end]))
+        self.record_extent = [None if v == BLOCK_NOT_RECORDED else
+                              (v, rend[v]) for v in offs]
+        if(len(self.record_extent) < nrecord):
+            # For IMODE B the mask has one entry per block, with the
+            # records for each band one after the other.
+            start = self.blocked_data_start
+            ext = []
+            for e in self.record_extent:
+                if(e is None):
+                    ext.extend([None] * ih.number_band)
+                    continue
+                roffs = self.codec.record_offsets(self.mm, start + e[0],
+                                                  start + e[1],
+                                                  ih.number_band)
+                rends = roffs[1:] + [e[1] - e[0]]
+                ext.extend((e[0] + o, e[0] + oe)
+                           for o, oe in zip(roffs, rends))
+            self.record_extent = ext
+
+    def block(self, brow, bcol):
+        '''Return the given block, with all the bands.
+        Note that the blocks at the end of the image may extend past the
+        image (filled with pad pixels).'''
+        return self.cached_block(brow, bcol, None,
+                                 lambda : self.decode_block(brow, bcol))
+
+    def decode_block(self, brow, bcol):
+        '''Return a numpy view of the given block in the memory mapped
+        file. Derived classes with data that needs decoding can override
+        this, and set use_block_cache to True.'''
+        ih = self.subheader
+        n = brow * ih.nbpr + bcol
+        shape = (ih.number_band, self.nppbv, self.nppbh)
+        if(self.packed):
+            return self._decode_records(n, shape,
+                lambda buf, rshape : unpack_pixels(buf, ih.nbpp,
+                                                   int(np.prod(rshape))))
+        if(self.codec is not None):
+            return self._decode_records(n, shape,
+                lambda buf, rshape : self.codec.decode(buf, ih, rshape))
+        if(self.mask is None or self.mask.bmr is None):
+            return self._block_view(n * self.block_offset, shape)
+        if(ih.imode != "S"):
+            # One record for the block, with all the bands
+            off = int(self.mask.bmr[n])
+            if(off == BLOCK_NOT_RECORDED):
+                return self._pad_block(shape)
+            return self._block_view(off, shape)
+        # For IMODE S we have an offset for each band of the block
+        nblock = ih.nbpr * ih.nbpc
+        offs = [int(self.mask.bmr[b * nblock + n])
+                for b in range(ih.number_band)]
+        if(all(off == BLOCK_NOT_RECORDED for off in offs)):
+            return self._pad_block(shape)
+        if(all(off == offs[0] + b * self.block_strides[0]
+               for b, off in enumerate(offs))):
+            # Stored the same as without a mask, so we can use a view
+            return self._block_view(offs[0], shape)
+        res = np.empty(shape, dtype=ih.dtype)
+        for b, off in enumerate(offs):
+            if(off == BLOCK_NOT_RECORDED):
+                res[b] = self.pad_value
+            else:
+                res[b] = self._block_view(off, (1,) + shape[1:])[0]
+        return res
+
+    def _record_index(self, n, b):
+        '''Index of the record for band b of block n (b is None for
+        records that are a full block), counting in file order. For
+        IMODE B the bands of a block are together, for IMODE S all the
+        blocks of one band come before the next band.'''
+        ih = self.subheader
+        if(ih.imode == "B"):
+            return n * ih.number_band + b
+        if(ih.imode == "S"):
+            return b * ih.nbpr * ih.nbpc + n
+        return n
+
+    def _record_buffer(self, n, b=None):
+        '''Return a memoryview of the record for band b of block n (b is
+        None for records that are a full block) for packed or
+        compressed data, or None if it isn't recorded. This refers
+        directly to the memory mapped file, so we don't copy the data.'''
+        rec = self._record_index(n, b)
+        if(self.codec is not None):
+            if(self.record_extent[rec] is None):
+                return None
+            off, end = self.record_extent[rec]
+        else:
+            if(self.mask is None or self.mask.bmr is None):
+                off = rec * self.record_size
+            elif(self.subheader.imode == "B"):
+                # One mask entry for the block, with the bands one after
+                # the other
+                if(self.mask.bmr[n] == BLOCK_NOT_RECORDED):
+                    return None
+                off = int(self.mask.bmr[n]) + b * self.record_size
+            elif(self.mask.bmr[rec] == BLOCK_NOT_RECORDED):
+                return None
+            else:
+                off = int(self.mask.bmr[rec])
+            end = off + self.record_size
+        start = self.blocked_data_start
+        return memoryview(self.mm)[(start+off):(start+end)]
+    
+    def _decode_records(self, n, shape, decode_record):
+        '''Decode block n for data stored as records, which are each
+        band of a block for IMODE B and S, otherwise the full block. 
+        decode_record(buf, rshape) should return the data for the record
+        in buf, with the pixels in the same order as the file (so
+        something that can be reshaped to rshape).'''
+        ih = self.subheader
+        if(ih.imode in ("B", "S")):
+            res = np.empty(shape, dtype=ih.dtype)
+            for b in range(ih.number_band):
+                buf = self._record_buffer(n, b)
+                if(buf is None):
+                    res[b] = self.pad_value
                 else:
-                    d = fh_in.read(buffer_size)
-                fh.write(d)
+                    res[b] = np.reshape(decode_record(buf, shape[1:]),
+                                        shape[1:])
+            return res
+        buf = self._record_buffer(n)
+        if(buf is None):
+            return self._pad_block(shape)
+        if(ih.imode == "P"):
+            rshape = (shape[1], shape[2], shape[0])
+            d = np.reshape(decode_record(buf, rshape), rshape).transpose(2, 0, 1)
+        else:
+            rshape = (shape[1], shape[0], shape[2])
+            d = np.reshape(decode_record(buf, rshape), rshape).transpose(1, 0, 2)
+        return np.ascontiguousarray(d, dtype=ih.dtype)
+        
+    def _block_view(self, off, shape):
+        '''A view of the memory mapped data, starting off bytes into the
+        blocked image data.'''
+        return np.ndarray(shape, dtype=self.subheader.dtype, buffer=self.mm,
+                          strides=self.block_strides,
+                          offset=self.blocked_data_start + off)
 
-                #This may go negative on the last loop but that's fine
-                bytes_left = bytes_left - buffer_size
+    def _pad_block(self, shape):
+        '''A block that is all pad pixels. This is a read only view of a
+        single value, so it doesn't allocate the full block.'''
+        return np.broadcast_to(np.array(self.pad_value,
+                                        dtype=self.subheader.dtype), shape)
 
+    @staticmethod
+    def _index_range(ind, n):
+        '''Convert an int or slice to a (range, is_int) tuple.'''
+        if(isinstance(ind, slice)):
+            return (range(*ind.indices(n)), False)
+        i = int(ind)
+        if(i < 0):
+            i += n
+        if(i < 0 or i >= n):
+            raise IndexError("index %d is out of bounds for size %d" %
+                             (int(ind), n))
+        return (range(i, i+1), True)
+    
+    def __getitem__(self, ind):
+        if(not isinstance(ind, tuple)):
+            ind = (ind,)
+        if(len(ind) == 2):
+            ind = (0,) + ind
+        if(len(ind) == 1):
+            ind = ind + (slice(None), slice(None))
+        if(len(ind) != 3):
+            raise IndexError("NitfImageReadBlocked takes band, line, sample or line, sample")
+        rlist = [self._index_range(i, n) for (i, n) in zip(ind, self.shape)]
+        (rb, _), (rl, _), (rs, _) = rlist
+        if(len(rb) == 0 or len(rl) == 0 or len(rs) == 0):
+            return np.empty([len(r) for r, is_int in rlist if not is_int],
+                            dtype=self.dtype)
+        # Window of data we need to read
+        b0, b1 = min(rb), max(rb)+1
+        l0, l1 = min(rl), max(rl)+1
+        s0, s1 = min(rs), max(rs)+1
+        br0, br1 = l0 // self.nppbv, (l1 - 1) // self.nppbv + 1
+        bc0, bc1 = s0 // self.nppbh, (s1 - 1) // self.nppbh + 1
+        if(br1 - br0 == 1 and bc1 - bc0 == 1):
+            # In one block, so we can just return a view
+            loff = br0 * self.nppbv
+            soff = bc0 * self.nppbh
+            res = self.block(br0, bc0)[b0:b1, (l0-loff):(l1-loff),
+                                       (s0-soff):(s1-soff)]
+        else:
+            blist = [(br, bc) for br in range(br0, br1)
+                     for bc in range(bc0, bc1)]
+            if(self.codec is not None):
+                # Decode the blocks in parallel
+                blocks = decode_map(self.block, blist)
+            else:
+                blocks = [self.block(br, bc) for br, bc in blist]
+            res = np.empty((b1-b0, l1-l0, s1-s0), dtype=self.dtype)
+            for (br, bc), blk in zip(blist, blocks):
+                bl0 = max(l0, br * self.nppbv)
+                bl1 = min(l1, (br + 1) * self.nppbv)
+                bs0 = max(s0, bc * self.nppbh)
+                bs1 = min(s1, (bc + 1) * self.nppbh)
+                res[:, (bl0-l0):(bl1-l0), (bs0-s0):(bs1-s0)] = \
+                    blk[b0:b1, (bl0-br*self.nppbv):(bl1-br*self.nppbv),
+                        (bs0-bc*self.nppbh):(bs1-bc*self.nppbh)]
+        # Now handle steps, and remove the dimensions that were given
+        # as an int. Note that the window starts at min(r), so for a
+        # negative step r.stop - v0 is -1, which we need as None.
+        sub = []
+        for (r, is_int), v0 in zip(rlist, (b0, l0, s0)):
+            if(is_int):
+                sub.append(r[0] - v0)
+            else:
+                stop = r.stop - v0
+                sub.append(slice(r.start - v0, stop if stop >= 0 else None,
+                                 r.step))
+        return res[tuple(sub)]
+
+    def write_to_file(self, fh):
+        '''Write an image to a file. We just copy the data from the
+        file we read.'''
+        copy_file_data(fh, self.fh_in_name, self.data_start, self.data_size)
+        
 class ImageWithSubsetDiff(NitfDiffHandle):
+    diff_type = NitfImageWithSubset
     def handle_diff(self, d1, d2, nitf_diff):
         if(not isinstance(d1, NitfImageWithSubset) or
            not isinstance(d2, NitfImageWithSubset)):
@@ -253,6 +659,7 @@ class NitfImageWriteDataOnDemand(NitfImageWithSubset):
     IMAGE_GEN_MODE_ROW_P = 3 #Write out one row at a time, pixel first
     IMAGE_GEN_MODE_COL_B = 4 #Write out one column at a time, bands first
     IMAGE_GEN_MODE_COL_P = 5 # Write out one column at a time, pixel first
+    IMAGE_GEN_MODE_BLOCK = 6 # Write out one block at a time
 
     
     # Keep a list of mmap associated with a filehandle. If either the
@@ -268,6 +675,8 @@ class NitfImageWriteDataOnDemand(NitfImageWithSubset):
                  icat="VIS",
                  idlvl = 0,
                  image_gen_mode=IMAGE_GEN_MODE_ALL,
+                 nppbv=None, nppbh=None, imode="B",
+                 workers=1, max_in_flight=None,
                  security=security_unclassified):
         '''If generate_by_band==True, we call data_to_write a single band 
         at a time, otherwise we do everything at once. Depending on how
@@ -277,6 +686,21 @@ class NitfImageWriteDataOnDemand(NitfImageWithSubset):
         at a time. This would make sense if we have multi-band images that
         come in numerous "slices"
 
+        For IMAGE_GEN_MODE_BLOCK, the image is blocked with nppbv x nppbh
+        blocks using the given imode (B, P, R, or S). We call
+        data_to_write once for each block (or each band of each block for
+        IMODE S), so we only need memory for a single block. The blocks
+        at the edge of the image are padded with 0, d only covers the
+        part of the block that is in the image.
+
+        If workers is larger than 1, we call data_to_write in a pool of
+        that many threads (so it needs to be thread safe), and write each
+        chunk at its place in the file with os.pwrite. This is useful if
+        data_to_write releases the GIL (e.g., it is numpy heavy). At most
+        max_in_flight chunks (default 2 * workers) are generated at
+        once, to bound the memory used. The file is the same as writing
+        serially.
+
         You can pass a number of values to set in the image subheader. You
         can also just modify the image subheader after the constructor, 
         whatever is more convenient.
@@ -297,6 +721,8 @@ class NitfImageWriteDataOnDemand(NitfImageWithSubset):
         self.security = security
         self.data_callback = data_callback
         self.image_gen_mode = image_gen_mode
+        self.workers = workers
+        self.max_in_flight = max_in_flight
         ih = self.subheader
         self.data_written = None # We'll fill this in when we write the data
         if(self.image_gen_mode == self.IMAGE_GEN_MODE_ALL):
@@ -308,7 +734,13 @@ class NitfImageWriteDataOnDemand(NitfImageWithSubset):
             # right for this mode
             pass
         elif(self.image_gen_mode == self.IMAGE_GEN_MODE_ROW_B):
-            raise NotImplemented()
+            # Same blocking as IMAGE_GEN_MODE_ROW_P, but with the bands
+            # of each row one after the other.
+            ih.nbpr = 1
+            ih.nbpc = nrow
+            ih.nppbh = ncol
+            ih.nppbv = 1
+            ih.imode = "R"
         elif(self.image_gen_mode == self.IMAGE_GEN_MODE_ROW_P):
             # Note that we could have a row broken up into multiple blocks,
             # plus the row doesn't have to be 1. But this is what is
@@ -318,10 +750,27 @@ class NitfImageWriteDataOnDemand(NitfImageWithSubset):
             ih.nppbh = ncol
             ih.nppbv = 1
             ih.imode = "P"
-        elif(self.image_gen_mode == self.IMAGE_GEN_MODE_COL_B):
-            raise NotImplemented()
-        elif(self.image_gen_mode == self.IMAGE_GEN_MODE_COL_P):
-            raise NotImplemented()
+        elif(self.image_gen_mode in (self.IMAGE_GEN_MODE_COL_B,
+                                     self.IMAGE_GEN_MODE_COL_P)):
+            # Each column is a block. For IMAGE_GEN_MODE_COL_B the bands
+            # are one after the other in the block (IMODE B), otherwise
+            # the bands are interleaved by pixel.
+            ih.nbpr = ncol
+            ih.nbpc = 1
+            ih.nppbh = 1
+            ih.nppbv = nrow
+            ih.imode = ("B" if self.image_gen_mode == self.IMAGE_GEN_MODE_COL_B
+                        else "P")
+        elif(self.image_gen_mode == self.IMAGE_GEN_MODE_BLOCK):
+            if(nppbv is None or nppbh is None):
+                raise RuntimeError("Need to supply nppbv and nppbh for IMAGE_GEN_MODE_BLOCK")
+            if(imode not in ("B", "P", "R", "S")):
+                raise RuntimeError("Unrecognized imode %s" % imode)
+            ih.imode = imode
+            ih.nppbv = nppbv
+            ih.nppbh = nppbh
+            ih.nbpc = (nrow + nppbv - 1) // nppbv
+            ih.nbpr = (ncol + nppbh - 1) // nppbh
         else:
             raise RuntimeError("Unrecognized image_gen_mode")
 
@@ -340,55 +789,173 @@ class NitfImageWriteDataOnDemand(NitfImageWithSubset):
             raise RuntimeError("Don't have data")
         return self.data_written[ind]
         
-    def write_to_file(self, fh):
+    def _chunk_list(self):
+        '''Return the list of chunks we write, in file order. Each chunk
+        is a tuple (shape, nvalid, bstart, lstart, sstart, axes, per_band).
+        We call data_to_write with a buffer of the given shape (or just
+        the first nvalid lines and samples of the buffer, for the padded
+        blocks at the edge of the image for IMAGE_GEN_MODE_BLOCK), and
+        then write the buffer transposed by axes (if not None). For
+        packed data, if per_band is True we pack each band separately.'''
         ih = self.subheader
+        m = self.image_gen_mode
+        nband, nrow, ncol = ih.number_band, ih.nrows, ih.ncols
+        if(m == self.IMAGE_GEN_MODE_ALL):
+            return [((nband, nrow, ncol), None, 0, 0, 0, None, True)]
+        if(m == self.IMAGE_GEN_MODE_BAND):
+            return [((nrow, ncol), None, b, 0, 0, None, False)
+                    for b in range(nband)]
+        if(m == self.IMAGE_GEN_MODE_ROW_B):
+            return [((nband, ncol), None, 0, r, 0, None, False)
+                    for r in range(nrow)]
+        if(m == self.IMAGE_GEN_MODE_ROW_P):
+            return [((ncol, nband), None, 0, r, 0, None, False)
+                    for r in range(nrow)]
+        if(m == self.IMAGE_GEN_MODE_COL_B):
+            return [((nband, nrow), None, 0, 0, c, None, False)
+                    for c in range(ncol)]
+        if(m == self.IMAGE_GEN_MODE_COL_P):
+            return [((nrow, nband), None, 0, 0, c, None, False)
+                    for c in range(ncol)]
+        if(m == self.IMAGE_GEN_MODE_BLOCK):
+            # IMODE S has all the blocks of one band, followed by the
+            # next band. The others have all the bands of a block
+            # together (one after the other for B, so we don't need to
+            # transpose).
+            axes = {"P" : (1, 2, 0), "R" : (1, 0, 2)}.get(ih.imode)
+            shape = (1 if ih.imode == "S" else nband, ih.nppbv, ih.nppbh)
+            res = []
+            for b in (range(nband) if ih.imode == "S" else [0]):
+                for br in range(ih.nbpc):
+                    for bc in range(ih.nbpr):
+                        lstart = br * ih.nppbv
+                        sstart = bc * ih.nppbh
+                        nvalid = (min(ih.nppbv, nrow - lstart),
+                                  min(ih.nppbh, ncol - sstart))
+                        if(nvalid == shape[1:]):
+                            nvalid = None
+                        res.append((shape, nvalid, b, lstart, sstart, axes,
+                                    ih.imode == "B"))
+            return res
+        raise RuntimeError("Incorrect Image Gen Mode %d" % self.image_gen_mode)
 
+    def _chunk_size(self, chunk):
+        '''Size in bytes of the given chunk in the file.'''
+        shape, nvalid, bstart, lstart, sstart, axes, per_band = chunk
+        n = int(np.prod(shape))
+        nbpp = self.subheader.nbpp
+        if(nbpp % 8 == 0):
+            return n * self.subheader.dtype.itemsize
+        if(per_band):
+            return shape[0] * packed_size(n // shape[0], nbpp)
+        return packed_size(n, nbpp)
+    
+    def _chunk_data(self, chunk, buf):
+        '''Fill in buf for the given chunk using data_to_write, and
+        return the data to write to the file. We pack the data if the
+        nbpp isn't a multiple of 8 (see nitf_pixel_packing.py).'''
+        shape, nvalid, bstart, lstart, sstart, axes, per_band = chunk
+        if(nvalid is None):
+            self.data_to_write(buf, bstart, lstart, sstart)
+        else:
+            self.data_to_write(buf[:, :nvalid[0], :nvalid[1]], bstart,
+                               lstart, sstart)
+        d = buf if axes is None else buf.transpose(axes)
+        nbpp = self.subheader.nbpp
+        if(nbpp % 8 == 0):
+            # Use the array directly, rather than copying to bytes
+            return np.ascontiguousarray(d).data
+        if(per_band):
+            return b"".join(pack_pixels(d[b], nbpp) for b in range(d.shape[0]))
+        return pack_pixels(d, nbpp)
+
+    def _write_serial(self, fh, chunks):
+        '''Write the chunks one at a time. We reuse a scratch buffer
+        for each chunk shape, except for padded chunks which need a 
+        buffer filled with 0.'''
+        dtype = self.subheader.dtype
+        buf = {}
+        for chunk in chunks:
+            shape = chunk[0]
+            if(chunk[1] is not None):
+                d = np.zeros(shape, dtype=dtype)
+            else:
+                if(shape not in buf):
+                    buf[shape] = np.zeros(shape, dtype=dtype)
+                d = buf[shape]
+            fh.write(self._chunk_data(chunk, d))
+
+    def _write_chunk_at(self, fd, pos, chunk):
+        t = memoryview(self._chunk_data(chunk, np.zeros(chunk[0],
+                                        dtype=self.subheader.dtype))).cast("B")
+        while(len(t) > 0):
+            n = os.pwrite(fd, t, pos)
+            t = t[n:]
+            pos += n
+
+    def _write_parallel(self, fh, chunks):
+        '''Generate the chunks in a thread pool with self.workers threads,
+        writing each one at its offset with os.pwrite. We only have
+        max_in_flight chunks generated at once, which bounds the memory
+        used. The output is the same as _write_serial.'''
+        fh.flush()
+        fd = fh.fileno()
+        pos = fh.tell()
+        max_in_flight = (self.max_in_flight if self.max_in_flight is not None
+                         else 2 * self.workers)
+        pending = collections.deque()
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+            try:
+                for chunk in chunks:
+                    if(len(pending) >= max_in_flight):
+                        pending.popleft().result()
+                    pending.append(pool.submit(self._write_chunk_at, fd, pos,
+                                               chunk))
+                    pos += self._chunk_size(chunk)
+                while(len(pending) > 0):
+                    pending.popleft().result()
+            finally:
+                for f in pending:
+                    f.cancel()
+        fh.seek(pos, 0)
+
+    def _can_write_parallel(self, fh, chunks):
+        if(self.workers <= 1 or len(chunks) <= 1 or
+           not hasattr(os, "pwrite")):
+            return False
+        try:
+            fh.fileno()
+        except (io.UnsupportedOperation, AttributeError):
+            return False
+        return True
+        
+    def write_to_file(self, fh):
+        ih = self.subheader
         foff = fh.tell()
-        strides = None
-        # We don't support all the data modes yet, so only allow read for things
-        # we have supported
-        can_have_data = False
-        if (self.image_gen_mode == NitfImageWriteDataOnDemand.IMAGE_GEN_MODE_ALL):
-            d = np.zeros((ih.number_band,ih.nrows, ih.ncols), dtype = ih.dtype)
-            self.data_to_write(d, 0, 0, 0)
-            fh.write(d.tobytes())
-            can_have_data = True
-
-        elif(self.image_gen_mode == NitfImageWriteDataOnDemand.IMAGE_GEN_MODE_BAND):
-            d = np.zeros((ih.nrows, ih.ncols), dtype = ih.dtype)
-            for b in range(ih.number_band):
-                self.data_to_write(d, b, 0, 0)
-                fh.write(d.tobytes())
-            can_have_data = True
-
-        elif (self.image_gen_mode == NitfImageWriteDataOnDemand.IMAGE_GEN_MODE_ROW_B):
-            d = np.zeros((ih.number_band, ih.ncols), dtype=ih.dtype)
-            for r in range(ih.nrows):
-                self.data_to_write(d, 0, r, 0)
-                fh.write(d.tobytes())
-
-        elif (self.image_gen_mode == NitfImageWriteDataOnDemand.IMAGE_GEN_MODE_ROW_P):
-            d = np.zeros((ih.ncols, ih.number_band), dtype=ih.dtype)
-            for r in range(ih.nrows):
-                self.data_to_write(d, 0, r, 0)
-                fh.write(d.tobytes())
-            strides = np.array([1, ih.shape[0] * ih.shape[2], ih.shape[0]])
-            strides *= ih.dtype.itemsize
-            can_have_data = True
-
-        elif (self.image_gen_mode == NitfImageWriteDataOnDemand.IMAGE_GEN_MODE_COL_B):
-            d = np.zeros((ih.number_band, ih.nrows), dtype=ih.dtype)
-            for c in range(ih.ncols):
-                self.data_to_write(d, 0, 0, c)
-                fh.write(d.tobytes())
-
-        elif (self.image_gen_mode == NitfImageWriteDataOnDemand.IMAGE_GEN_MODE_COL_P):
-            d = np.zeros((ih.nrows, ih.number_band), dtype=ih.dtype)
-            for c in range(ih.ncols):
-                self.data_to_write(d, 0, 0, c)
-                fh.write(d.tobytes())
+        chunks = self._chunk_list()
+        if(self._can_write_parallel(fh, chunks)):
+            self._write_parallel(fh, chunks)
         else:
-            raise RuntimeError("Incorrect Image Gen Mode %d" % self.image_gen_mode)
+            self._write_serial(fh, chunks)
+        # Strides of data_written for each mode. We can't view blocked
+        # data as a single array.
+        nband, nrow, ncol = ih.shape
+        strides = {
+            self.IMAGE_GEN_MODE_ALL : None,
+            self.IMAGE_GEN_MODE_BAND : None,
+            self.IMAGE_GEN_MODE_ROW_B : (ncol, nband * ncol, 1),
+            self.IMAGE_GEN_MODE_ROW_P : (1, ncol * nband, nband),
+            self.IMAGE_GEN_MODE_COL_B : (nrow, 1, nband * nrow),
+            self.IMAGE_GEN_MODE_COL_P : (1, nband, nrow * nband),
+            }
+        can_have_data = self.image_gen_mode in strides
+        if(can_have_data):
+            strides = strides[self.image_gen_mode]
+            if(strides is not None):
+                strides = np.array(strides) * ih.dtype.itemsize
+        # We can't memory map packed data
+        if(ih.nbpp % 8 != 0):
+            can_have_data = False
         # Set up to allow reading of data
         if(can_have_data and fh not in self.mmap_cache):
             try:
@@ -399,7 +966,7 @@ class NitfImageWriteDataOnDemand(NitfImageWithSubset):
                 # Ok if this fails, not all file handle types can handle
                 # being memorymapped
                 can_have_data = False
-        else:
+        elif(can_have_data):
             try:
                 self.mm = self.mmap_cache[fh]
                 self.mm.resize(fh.tell())
@@ -412,6 +979,7 @@ class NitfImageWriteDataOnDemand(NitfImageWithSubset):
                                            buffer = self.mm,
                                            strides = strides,
                                            offset = foff)
+
     def flush_update(self):
         '''Flush any updates made to data_written'''
         if(self.data_written is None):
@@ -437,7 +1005,118 @@ class NitfImageWriteNumpy(NitfImageWriteDataOnDemand):
         return "NitfImageWriteNumpy %d x %d x %d %s image" % (self.shape[0],self.shape[1], self.shape[2], str(self.dtype.newbyteorder("=")))
 
     def data_to_write(self, d, bstart, lstart, sstart):
-        d[:,:,:] = self._data[bstart:(bstart+d.shape[0]),lstart:(lstart+d.shape[1]),sstart:(sstart+d.shape[2])]
+        m = self.image_gen_mode
+        if(m == self.IMAGE_GEN_MODE_BAND):
+            d[:,:] = self._data[bstart,:,:]
+        elif(m == self.IMAGE_GEN_MODE_ROW_B):
+            d[:,:] = self._data[:,lstart,:]
+        elif(m == self.IMAGE_GEN_MODE_ROW_P):
+            d[:,:] = self._data[:,lstart,:].transpose()
+        elif(m == self.IMAGE_GEN_MODE_COL_B):
+            d[:,:] = self._data[:,:,sstart]
+        elif(m == self.IMAGE_GEN_MODE_COL_P):
+            d[:,:] = self._data[:,:,sstart].transpose()
+        else:
+            d[:,:,:] = self._data[bstart:(bstart+d.shape[0]),lstart:(lstart+d.shape[1]),sstart:(sstart+d.shape[2])]
+
+class NitfImageWriteMaskedNumpy(NitfImageWriteNumpy):
+    '''Like NitfImageWriteNumpy, but write a blocked, masked image (IC of
+    NM). Blocks that are entirely pad_value aren't written to the file, 
+    which can make a big difference for sparse images (e.g., a mosaic
+    that is mostly empty).
+
+    The block size is given by nppbv and nppbh, and the imode can be any
+    of B, P, R, or S.'''
+    def __init__(self, nrow, ncol, data_type, nppbv, nppbh, imode="B",
+                 pad_value=0, **keywords):
+        super().__init__(nrow, ncol, data_type, **keywords)
+        ih = self.subheader
+        ih.ic = "NM"
+        ih.imode = imode
+        ih.nppbv = nppbv
+        ih.nppbh = nppbh
+        ih.nbpc = (nrow + nppbv - 1) // nppbv
+        ih.nbpr = (ncol + nppbh - 1) // nppbh
+        self.pad_value = pad_value
+
+    def __str__(self):
+        return "NitfImageWriteMaskedNumpy %d x %d x %d %s image" % (self.shape[0],self.shape[1], self.shape[2], str(self.dtype.newbyteorder("=")))
+
+    def _block(self, n, band=None):
+        '''Return block n, filled with pad_value past the end of the
+        image. If band is None this is all the bands, otherwise just the
+        given band.'''
+        ih = self.subheader
+        brow, bcol = divmod(n, ih.nbpr)
+        rs = slice(brow * ih.nppbv, (brow + 1) * ih.nppbv)
+        cs = slice(bcol * ih.nppbh, (bcol + 1) * ih.nppbh)
+        if(band is None):
+            d = np.full((ih.number_band, ih.nppbv, ih.nppbh), self.pad_value,
+                        dtype=ih.dtype)
+            t = self._data[:, rs, cs]
+            d[:, :t.shape[1], :t.shape[2]] = t
+        else:
+            d = np.full((ih.nppbv, ih.nppbh), self.pad_value, dtype=ih.dtype)
+            t = self._data[band, rs, cs]
+            d[:t.shape[0], :t.shape[1]] = t
+        return d
+
+    def _records(self):
+        '''Go through the data we record in the file. This returns 
+        (n, band, size), where band is None for the full block. Only
+        IMODE S has a separate record for each band of a block.'''
+        ih = self.subheader
+        npix = ih.nppbv * ih.nppbh
+        nblock = ih.nbpr * ih.nbpc
+        if(ih.imode == "S"):
+            for b in range(ih.number_band):
+                for n in range(nblock):
+                    yield (n, b, packed_size(npix, ih.nbpp))
+        elif(ih.imode == "B"):
+            # Each band of the block is packed separately
+            for n in range(nblock):
+                yield (n, None, ih.number_band * packed_size(npix, ih.nbpp))
+        else:
+            for n in range(nblock):
+                yield (n, None, packed_size(npix * ih.number_band, ih.nbpp))
+
+    def _record_data(self, d, band):
+        '''Return the bytes for the record with data d from _block(n, band).'''
+        ih = self.subheader
+        if(band is None and ih.imode == "P"):
+            d = d.transpose(1, 2, 0)
+        elif(band is None and ih.imode == "R"):
+            d = d.transpose(1, 0, 2)
+        if(ih.nbpp % 8 != 0):
+            if(band is None and ih.imode == "B"):
+                return b"".join(pack_pixels(d[b], ih.nbpp)
+                                for b in range(d.shape[0]))
+            return pack_pixels(d, ih.nbpp)
+        return d.tobytes()
+        
+    def write_to_file(self, fh):
+        ih = self.subheader
+        nblock = ih.nbpr * ih.nbpc
+        nrec = NitfImageMask.number_record(ih)
+        # First pass, find the blocks that we need to write. We go
+        # through this a block at a time so we don't need a copy of the
+        # full image.
+        bmr = np.full((nrec,), BLOCK_NOT_RECORDED, dtype=np.uint32)
+        off = 0
+        keep = []
+        for n, band, sz in self._records():
+            if(np.all(self._block(n, band) == self.pad_value)):
+                keep.append(False)
+                continue
+            keep.append(True)
+            bmr[n if band is None else band * nblock + n] = off
+            off += sz
+        tpxcdlnth, tpxcd = NitfImageMask.pad_code(self.pad_value, ih.dtype)
+        NitfImageMask(bmr=bmr, tpxcdlnth=tpxcdlnth,
+                      tpxcd=tpxcd).write_to_file(fh)
+        for (n, band, sz), k in zip(self._records(), keep):
+            if(k):
+                fh.write(self._record_data(self._block(n, band), band))
 
 # I think we want this. Not 100% sure, but for now we'll have a deepcopy
 # of any image written to a NitfImageWriteNumpy
@@ -470,10 +1149,16 @@ class NitfRadCalc(object):
         d[:,:,:] = self.dn[bs,ls,ss] * self.gain[bs,ls,ss] + self.offset[bs,ls,ss]
 
 NitfSegmentDataHandleSet.add_default_handle(NitfImageReadNumpy)
+# Fall back to the more general NitfImageReadBlocked if NitfImageReadNumpy
+# can't handle the data.
+NitfSegmentDataHandleSet.add_default_handle(NitfImageReadBlocked,
+                                            priority_order=-1)
 NitfSegmentDataHandleSet.add_default_handle(NitfImagePlaceHolder,
                                             priority_order= -1000)
         
 __all__ = ["NitfImageWithSubset", "NitfImagePlaceHolder",
-           "NitfImageReadNumpy", "NitfImageWriteDataOnDemand",
-           "NitfImageWriteNumpy", "NitfRadCalc"]
+           "NitfImageReadNumpy", "NitfImageReadBlocked",
+           "NitfImageWriteDataOnDemand",
+           "NitfImageWriteNumpy", "NitfImageWriteMaskedNumpy",
+           "NitfRadCalc"]
 
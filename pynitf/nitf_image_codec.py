@@ -0,0 +1,143 @@
+# Support for decoding compressed image data (IC other than NC or NM).
+#
+# NitfImageReadBlocked handles the blocking, masks, caching of decoded
+# blocks, etc. It hands each compressed record off to a NitfImageCodec to
+# decode. The codecs are found by the IC value through
+# NitfImageCodecSet, so support for other compression types can be added
+# by registering a new codec.
+#
+# We supply a codec for JPEG DCT (C3 and M3), which uses Pillow if it is
+# available. Without a codec for an image, it falls back to
+# NitfImagePlaceHolder like before, so we can still copy the data.
+
+from .priority_handle_set import PriorityHandleSet
+import concurrent.futures
+import threading
+import io
+import os
+import numpy as np
+
+# Pillow is optional. If it isn't available, we just don't have a codec
+# for JPEG.
+try:
+    from PIL import Image as PILImage
+    have_pillow = True
+except ImportError:
+    have_pillow = False
+
+class NitfImageCodec(object):
+    '''Base class for decoding the records of a compressed image.
+
+    A record is a band of a block for IMODE B, otherwise it is a full
+    block with all the bands.
+
+    :ivar ic_list: Tuple of the IC values this codec handles.
+    '''
+    ic_list = ()
+
+    def can_decode(self, ih):
+        '''Return True if we can decode the data for the given image
+        subheader. Derived classes should override this to check things
+        like nbpp and imode.'''
+        return ih.ic in self.ic_list
+
+    def record_offsets(self, mm, start, end, nrecord):
+        '''For data without a mask table, return the offset of each
+        of the nrecord records found in mm[start:end], relative to start.'''
+        raise NotImplementedError
+
+    def decode(self, buf, ih, shape):
+        '''Decode the record in buf (a bytes like object), returning a
+        numpy array of the given shape. shape is (nppbv, nppbh) for
+        IMODE B, or (nppbv, nppbh, nband) otherwise (so in the order that
+        the pixels are found in the decoded data for IMODE P).'''
+        raise NotImplementedError
+
+class NitfImageCodecSet(PriorityHandleSet):
+    '''Find the NitfImageCodec to use for an image.'''
+    def codec(self, ih):
+        '''Return the codec to use for the given image subheader, or None
+        if we don't have one.'''
+        try:
+            return self.handle(ih)
+        except RuntimeError:
+            # No codec wanted to handle this
+            return None
+
+    def dispatch_key(self, ih):
+        return ih.ic
+
+    def handle_applies(self, h, key):
+        return key in h.ic_list
+
+    def handle_h(self, h, ih):
+        if(h.can_decode(ih)):
+            return (True, h)
+        return (False, None)
+
+class NitfImageCodecJpeg(NitfImageCodec):
+    '''JPEG DCT compression, decoded with Pillow. This handles 8 bit
+    data, either IMODE B (one JPEG stream for each band of a block) or
+    IMODE P with 3 bands (e.g., RGB or YCbCr601, which Pillow converts
+    to RGB).'''
+    ic_list = ("C3", "M3")
+
+    def can_decode(self, ih):
+        if(ih.ic not in self.ic_list or ih.nbpp != 8 or ih.pvtype != "INT"):
+            return False
+        return (ih.imode == "B" or
+                (ih.imode == "P" and ih.number_band == 3))
+
+    def record_offsets(self, mm, start, end, nrecord):
+        '''Each record is a JPEG stream, starting with a SOI marker.
+        The entropy coded data never has a 0xFF followed by anything
+        other than 0x00 or a RST marker, so we can just search for the
+        SOI.'''
+        res = []
+        i = mm.find(b"\xff\xd8\xff", start, end)
+        while(i >= 0 and len(res) < nrecord):
+            res.append(i - start)
+            i = mm.find(b"\xff\xd8\xff", i + 3, end)
+        if(len(res) != nrecord):
+            raise RuntimeError("Found %d JPEG streams, but expected %d" %
+                               (len(res), nrecord))
+        return res
+
+    def decode(self, buf, ih, shape):
+        # Pillow releases the GIL while decoding, so this can be run in
+        # multiple threads.
+        img = PILImage.open(io.BytesIO(buf))
+        res = np.asarray(img)
+        if(res.shape != shape):
+            raise RuntimeError("JPEG block has shape %s, but expected %s" %
+                               (res.shape, shape))
+        return res
+
+if(have_pillow):
+    NitfImageCodecSet.add_default_handle(NitfImageCodecJpeg())
+
+# Number of threads used to decode the blocks of a window. Set to 1 to
+# decode everything in the calling thread.
+decode_threads = os.cpu_count() or 1
+_decode_pool = None
+_decode_pool_size = 0
+_decode_pool_lock = threading.Lock()
+
+def decode_map(func, args):
+    '''Return [func(*a) for a in args], using a pool of decode_threads
+    threads if there is more than one thing to do.'''
+    global _decode_pool, _decode_pool_size
+    args = list(args)
+    if(len(args) <= 1 or decode_threads <= 1):
+        return [func(*a) for a in args]
+    with _decode_pool_lock:
+        if(_decode_pool is None or _decode_pool_size != decode_threads):
+            if(_decode_pool is not None):
+                _decode_pool.shutdown(wait=False)
+            _decode_pool = concurrent.futures.ThreadPoolExecutor(decode_threads)
+            _decode_pool_size = decode_threads
+        pool = _decode_pool
+    return list(pool.map(lambda a: func(*a), args))
+
+__all__ = ["NitfImageCodec", "NitfImageCodecSet", "NitfImageCodecJpeg",
+           "decode_map"]
@@ -0,0 +1,120 @@
+# Support for the mask table found at the start of the image data for
+# masked images (IC of NM, M1, M3, M4, M5, M8). This is described in
+# MIL-STD-2500C, "Image data mask table".
+#
+# The mask table gives the offset of each block, so blocks that are
+# completely pad pixels don't need to be recorded in the file at all.
+
+import numpy as np
+import struct
+
+# Offset used in the block mask to indicate that a block isn't recorded.
+BLOCK_NOT_RECORDED = 0xFFFFFFFF
+
+class NitfImageMask(object):
+    '''The image data mask table.
+
+    There is one record for each block, except for IMODE S which has
+    one record for each block and band, ordered by band and then by
+    block (so all the blocks for the first band, followed by the second
+    band, etc.). This is what MIL-STD-2500C gives for the BMR and TMR
+    tables.
+
+    :ivar imdatoff:  Offset from the start of the image data to the
+                     blocked image data (i.e., the size of the mask table)
+    :ivar bmr:       Numpy array with the offset of each block record from
+                     the start of the blocked image data, or
+                     BLOCK_NOT_RECORDED. None if we don't have a block mask.
+    :ivar tmr:       Numpy array with the offset of each block record that
+                     contains pad pixels, or BLOCK_NOT_RECORDED. None if
+                     we don't have a pad pixel mask.
+    :ivar tpxcdlnth: Length in bits of the pad pixel code, 0 if we don't
+                     have one.
+    :ivar tpxcd:     The pad pixel code as bytes, or None.
+    '''
+    def __init__(self, bmr=None, tmr=None, tpxcdlnth=0, tpxcd=None):
+        self.bmr = bmr
+        self.tmr = tmr
+        self.tpxcdlnth = tpxcdlnth
+        self.tpxcd = tpxcd
+
+    @staticmethod
+    def has_mask(ih):
+        '''True if the image data for the given image subheader starts
+        with a mask table.'''
+        return ih.ic == "NM" or ih.ic.startswith("M")
+
+    @staticmethod
+    def number_record(ih):
+        '''The number of records in the mask for the given image subheader.'''
+        nblock = ih.nbpr * ih.nbpc
+        if(ih.imode == "S"):
+            return nblock * ih.number_band
+        return nblock
+
+    @property
+    def imdatoff(self):
+        res = 10
+        if(self.tpxcdlnth != 0):
+            res += (self.tpxcdlnth + 7) // 8
+        if(self.bmr is not None):
+            res += 4 * len(self.bmr)
+        if(self.tmr is not None):
+            res += 4 * len(self.tmr)
+        return res
+
+    @classmethod
+    def read_from_file(cls, fh, ih):
+        '''Read the mask table from fh, which should be at the start of the
+        image data.'''
+        t = fh.read(10)
+        if(len(t) != 10):
+            raise RuntimeError("Not enough data to read image mask table")
+        imdatoff, bmrlnth, tmrlnth, tpxcdlnth = struct.unpack(">IHHH", t)
+        if(bmrlnth not in (0, 4) or tmrlnth not in (0, 4)):
+            raise RuntimeError("Unsupported image mask table record length BMRLNTH=%d, TMRLNTH=%d" % (bmrlnth, tmrlnth))
+        res = cls(tpxcdlnth=tpxcdlnth)
+        if(tpxcdlnth != 0):
+            res.tpxcd = fh.read((tpxcdlnth + 7) // 8)
+        nrec = cls.number_record(ih)
+        if(bmrlnth == 4):
+            res.bmr = np.frombuffer(fh.read(4 * nrec), dtype=">u4")
+        if(tmrlnth == 4):
+            res.tmr = np.frombuffer(fh.read(4 * nrec), dtype=">u4")
+        if(res.imdatoff != imdatoff):
+            raise RuntimeError("Image mask table IMDATOFF is %d, but expected %d" % (imdatoff, res.imdatoff))
+        return res
+
+    def write_to_file(self, fh):
+        fh.write(struct.pack(">IHHH", self.imdatoff,
+                             0 if self.bmr is None else 4,
+                             0 if self.tmr is None else 4, self.tpxcdlnth))
+        if(self.tpxcdlnth != 0):
+            fh.write(self.tpxcd)
+        if(self.bmr is not None):
+            fh.write(np.asarray(self.bmr, dtype=">u4").tobytes())
+        if(self.tmr is not None):
+            fh.write(np.asarray(self.tmr, dtype=">u4").tobytes())
+
+    def pad_value(self, dtype):
+        '''Return the pad pixel value for the given dtype, 0 if we don't
+        have a pad pixel code.'''
+        if(self.tpxcd is None):
+            return dtype.type(0)
+        if(len(self.tpxcd) == dtype.itemsize):
+            return np.frombuffer(self.tpxcd, dtype=dtype)[0]
+        return dtype.type(int.from_bytes(self.tpxcd, "big"))
+
+    @staticmethod
+    def pad_code(pad_value, dtype):
+        '''Return the tpxcdlnth and tpxcd for the given pad value.'''
+        return (dtype.itemsize * 8,
+                np.array([pad_value], dtype=dtype.newbyteorder(">")).tobytes())
+
+    def __str__(self):
+        nrec = 0 if self.bmr is None else len(self.bmr)
+        nmissing = 0 if self.bmr is None else \
+            int(np.count_nonzero(self.bmr == BLOCK_NOT_RECORDED))
+        return "NitfImageMask %d records, %d blocks not recorded" % (nrec, nmissing)
+
+__all__ = ["NitfImageMask", "BLOCK_NOT_RECORDED"]
@@ -129,9 +129,16 @@ class NitfImageSubheader(FieldStruct):
     def dtype(self):
         '''Return the data type. Note that this is always big endian because
         this is what NITF uses. This is the opposite of the native intel format
-        (which is little endian).'''
+        (which is little endian).
+
+        For packed data (see nitf_pixel_packing.py) this is the type we
+        unpack to, so nbpp of 1 is uint8 and 12 is uint16.'''
         if(self.nbpp == 8 and self.pvtype == "INT"):
             return np.dtype(np.uint8)
+        elif(self.nbpp == 1 and self.pvtype in ("B", "INT")):
+            return np.dtype(np.uint8)
+        elif(self.nbpp == 12 and self.pvtype == "INT"):
+            return np.dtype('>u2')
         elif(self.nbpp == 8 and self.pvtype == "SI"):
             return np.dtype(np.int8)
         elif(self.nbpp ==16 and self.pvtype == "INT"):
@@ -168,8 +175,13 @@ class NitfImageSubheader(FieldStruct):
         endian). I believe this is what we want, but if it turns out that this
         is confusing or a bad idea, then we can revisit this.
 
+        A data_type of bool gives bilevel data (nbpp of 1).
         '''
-        if (data_type == np.uint8):
+        if (data_type == np.bool_):
+            self.abpp = 1
+            self.nbpp = 1
+            self.pvtype = "B"
+        elif (data_type == np.uint8):
             self.abpp = 8
             self.nbpp = 8
             self.pvtype = "INT"
@@ -420,6 +432,7 @@ def set_default_image_subheader(ih, nrow, ncol, data_type, numbands=1,
 
 class ImageSubheaderDiff(FieldStructDiff):
     '''Compare two image subheaders.'''
+    diff_type = NitfImageSubheader
     def configuration(self, nitf_diff):
         return nitf_diff.config.get("Image Subheader", {})
 
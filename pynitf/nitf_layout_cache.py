@@ -0,0 +1,181 @@
+# Optional on-disk cache of the compiled FieldStruct layouts.
+#
+# Each FieldStruct description gets parsed the first time it is used, and
+# the expressions in it (sizes, conditions, loop shapes) get compiled into
+# python functions (see _compile_expr in nitf_field.py). Most of this time
+# is spent in the python compiler. For a long running program this doesn't
+# matter, but short lived command line programs and worker processes (e.g.,
+# read_many) pay this cost every time they start.
+#
+# If the environment variable PYNITF_CACHE_DIR is set, we load the compiled
+# code from a cache file in that directory when pynitf is imported. If the
+# cache file doesn't exist yet, or the program compiled layouts that
+# weren't in it (e.g., for a TRE module the program imported that earlier
+# programs didn't), we write it when the program exits. The
+# cache file name includes a hash of the pynitf source files, so changing
+# any of the descriptions (or the python version) just creates a new cache
+# file.
+#
+# The cache holds compiled python code that we run, so the cache directory
+# must be trusted. Anyone who can write the cache file can run code as any
+# user that loads it. As a basic check, we ignore a cache file that isn't
+# owned by the current user or that is writable by group or other.
+
+from .nitf_field import FieldStruct, _field_struct_schema, _compiled_code
+import atexit
+import glob
+import hashlib
+import logging
+import marshal
+import os
+import stat
+import sys
+
+logger = logging.getLogger('nitf_layout_cache')
+
+_layout_cache_key = None
+
+def layout_cache_key():
+    '''Return the key used for the layout cache. This is a hash of the
+    pynitf source files, along with the python version (since the compiled
+    code depends on the python version).
+
+    Like python does for .pyc files, we use the size and modification
+    time of each source file rather than reading all the files. This is
+    noticeably faster, and is good enough to tell if something has changed.'''
+    global _layout_cache_key
+    if(_layout_cache_key is None):
+        h = hashlib.sha256(sys.implementation.cache_tag.encode("utf-8"))
+        for fname in sorted(glob.glob(os.path.dirname(__file__) + "/*.py")):
+            st = os.stat(fname)
+            h.update(("%s %d %d\n" % (os.path.basename(fname), st.st_size,
+                                      st.st_mtime_ns)).encode("utf-8"))
+        _layout_cache_key = h.hexdigest()[0:16]
+    return _layout_cache_key
+
+def layout_cache_file(cache_dir=None):
+    '''Return the layout cache file name in the given directory. If
+    cache_dir is None we use PYNITF_CACHE_DIR, and return None if that
+    isn't set.'''
+    if(cache_dir is None):
+        cache_dir = os.environ.get("PYNITF_CACHE_DIR")
+        if(not cache_dir):
+            return None
+    return os.path.join(cache_dir,
+                        "pynitf_layout_%s.cache" % layout_cache_key())
+
+def _all_field_struct_classes(cls=FieldStruct):
+    for c in cls.__subclasses__():
+        yield c
+        yield from _all_field_struct_classes(c)
+
+def _load_all_modules():
+    '''Import all the lazily loaded modules, so we have all the
+    FieldStruct classes. A module that can't be imported (e.g., it needs
+    h5py and that isn't available) is skipped.'''
+    from .lazy_module_registry import lazy_module_exports, load_lazy_module
+    for mname in lazy_module_exports:
+        try:
+            load_lazy_module(mname)
+        except ImportError as e:
+            logger.debug("Skipping %s for layout cache: %s", mname, e)
+
+def save_layout_cache(cache_dir=None, load_all=True):
+    '''Compile the layouts of all the FieldStruct classes we know about,
+    and save the compiled code to the layout cache file. Returns the
+    file name.
+
+    If load_all is True, we first import all the modules that are
+    normally only imported when needed (see lazy_module_registry.py), so
+    the cache has all the pynitf FieldStruct classes.
+
+    The file is written to a temporary file and then moved into place, so
+    it is safe to have multiple processes doing this at the same time.'''
+    fname = layout_cache_file(cache_dir)
+    if(fname is None):
+        raise RuntimeError("Need to either pass cache_dir or set PYNITF_CACHE_DIR")
+    if(load_all):
+        _load_all_modules()
+    for cls in _all_field_struct_classes():
+        desc = cls.__dict__.get("desc")
+        if(isinstance(desc, list)):
+            _field_struct_schema(desc)
+    # Only import this when we need it, it is noticeable in the startup
+    # time
+    import tempfile
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    fd, tname = tempfile.mkstemp(dir=os.path.dirname(fname))
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            marshal.dump({"key" : layout_cache_key(),
+                          "code" : _compiled_code}, fh)
+        # mkstemp creates a file only readable by the user, we want
+        # the normal permissions.
+        os.chmod(tname, 0o644)
+        os.replace(tname, fname)
+    except:
+        os.unlink(tname)
+        raise
+    return fname
+
+def _trusted_cache_file(fh):
+    '''Check that the open cache file is owned by us, and that nobody
+    else can write to it.'''
+    st = os.fstat(fh.fileno())
+    if(hasattr(os, "getuid") and st.st_uid != os.getuid()):
+        return False
+    return (st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)) == 0
+
+def load_layout_cache(cache_dir=None):
+    '''Load the compiled code from the layout cache file, if it
+    exists. Returns True if we loaded the cache, False otherwise.
+
+    The cache directory must be trusted, since we run the code in the
+    cache. We skip a cache file that isn't owned by the current user or
+    that is writable by group or other.'''
+    fname = layout_cache_file(cache_dir)
+    if(fname is None or not os.path.exists(fname)):
+        return False
+    try:
+        with open(fname, "rb") as fh:
+            if(not _trusted_cache_file(fh)):
+                logger.warning("Ignoring layout cache %s, it needs to be owned by the current user and not writable by others", fname)
+                return False
+            d = marshal.load(fh)
+        if(d["key"] != layout_cache_key()):
+            return False
+        code = d["code"]
+    except Exception as e:
+        # The cache is just an optimization, so don't fail if there is
+        # a problem with it.
+        logger.warning("Trouble reading layout cache %s: %s", fname, e)
+        return False
+    for k, v in code.items():
+        _compiled_code.setdefault(k, v)
+    return True
+
+# The compiled code we had after loading the cache at import, or None if
+# we didn't have a cache to load
+_cache_keys = None
+
+def _save_layout_cache_at_exit():
+    '''Save the cache if we compiled anything that wasn't in it. Most
+    modules are only imported when needed, so a program only compiles
+    the layouts it uses. Saving again when there is something new
+    means the cache fills in over time. We can't import modules this
+    late in the shutdown, so we just save what we have.'''
+    if(_cache_keys is not None and
+       all(k in _cache_keys for k in _compiled_code)):
+        return
+    try:
+        save_layout_cache(load_all=False)
+    except Exception as e:
+        logger.warning("Trouble writing layout cache: %s", e)
+
+if(os.environ.get("PYNITF_CACHE_DIR")):
+    if(load_layout_cache()):
+        _cache_keys = set(_compiled_code.keys())
+    atexit.register(_save_layout_cache_at_exit)
+
+__all__ = ["layout_cache_key", "layout_cache_file", "save_layout_cache",
+           "load_layout_cache"]
@@ -0,0 +1,58 @@
+# Support for images where the number of bits per pixel (NBPP) isn't a
+# multiple of 8. The pixels are then packed together, most significant bit
+# first, with each block (or band of a block, for IMODE B) padded out to a
+# full byte.
+#
+# We currently support NBPP of 1 (e.g., bilevel masks) and 12 (common for
+# older sensors). These are done a full block at a time with numpy, which
+# is much faster than working with a pixel at a time.
+
+import numpy as np
+
+packed_nbpp = (1, 12)
+
+def packed_size(npixel, nbpp):
+    '''Number of bytes needed to hold npixel packed pixels.'''
+    return (npixel * nbpp + 7) // 8
+
+def unpack_pixels(buf, nbpp, npixel):
+    '''Unpack npixel pixels from buf, which can be anything supporting the
+    buffer protocol (e.g., bytes, or a memoryview of a mmap, so we don't
+    need to copy the data first). Returns a 1d array of uint8 for nbpp 1
+    and uint16 for nbpp 12.'''
+    b = np.frombuffer(buf, dtype=np.uint8, count=packed_size(npixel, nbpp))
+    if(nbpp == 1):
+        return np.unpackbits(b, count=npixel)
+    if(nbpp == 12):
+        # Each 3 bytes holds 2 pixels. Pad out to a full 3 bytes if we
+        # have an odd number of pixels
+        npair = (npixel + 1) // 2
+        t = np.zeros((npair * 3,), dtype=np.uint16)
+        t[:len(b)] = b
+        t = t.reshape((npair, 3))
+        res = np.empty((npair * 2,), dtype=np.uint16)
+        res[0::2] = (t[:, 0] << 4) | (t[:, 1] >> 4)
+        res[1::2] = ((t[:, 1] & 0xF) << 8) | t[:, 2]
+        return res[:npixel]
+    raise RuntimeError("Don't support unpacking nbpp %d" % nbpp)
+
+def pack_pixels(data, nbpp):
+    '''Pack the array data (in C order) into bytes. This is the reverse
+    of unpack_pixels.'''
+    d = np.asarray(data).ravel()
+    if(nbpp == 1):
+        return np.packbits(d != 0).tobytes()
+    if(nbpp == 12):
+        npixel = d.shape[0]
+        t = np.zeros((npixel + npixel % 2,), dtype=np.uint16)
+        t[:npixel] = d
+        t &= 0xFFF
+        t = t.reshape((-1, 2))
+        res = np.empty((t.shape[0], 3), dtype=np.uint8)
+        res[:, 0] = t[:, 0] >> 4
+        res[:, 1] = ((t[:, 0] & 0xF) << 4) | (t[:, 1] >> 8)
+        res[:, 2] = t[:, 1] & 0xFF
+        return res.ravel()[:packed_size(npixel, nbpp)].tobytes()
+    raise RuntimeError("Don't support packing nbpp %d" % nbpp)
+
+__all__ = ["packed_nbpp", "packed_size", "unpack_pixels", "pack_pixels"]
@@ -54,6 +54,7 @@ class NitfResSubheader(FieldStruct):
 
 class ResSubheaderDiff(FieldStructDiff):
     '''Compare two res subheaders.'''
+    diff_type = NitfResSubheader
     def configuration(self, nitf_diff):
         return nitf_diff.config.get("Res Subheader", {})
 
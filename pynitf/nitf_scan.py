@@ -0,0 +1,164 @@
+# Fast scanning of NITF headers, useful for things like cataloging a
+# large number of NITF files where we only need a handful of fields.
+
+from .nitf_file_header import NitfFileHeader
+from .nitf_image_subheader import NitfImageSubheader
+from .nitf_tre import TreWarning
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import io
+import traceback
+import warnings
+
+default_scan_file_fields = ["ostaid", "fdt", "ftitle", "fsclas"]
+default_scan_image_fields = ["iid1", "idatim", "nrows", "ncols", "igeolo",
+                             "ic"]
+
+def _field_values(fs, fields):
+    '''Return a dict of the values of the given fields in the FieldStruct
+    fs. Fields in a loop are returned as a list.'''
+    res = {}
+    for nm in fields:
+        if(nm not in fs.field):
+            raise RuntimeError("Unknown field %s in %s" %
+                               (nm, fs.__class__.__name__))
+        res[nm] = fs.field[nm].to_list()
+    return res
+
+def scan_headers(path, fields=default_scan_image_fields,
+                 file_fields=default_scan_file_fields):
+    '''Read the file header and the image subheaders of a NITF file, and
+    return the values of the requested fields.
+
+    This is much faster than reading the file with NitfFile. We use the
+    segment lengths in the file header to go directly to each image
+    subheader, and only decode the fields we need (see lazy_decode in
+    FieldStruct.read_from_file). We don't read any of the TREs, other
+    segments, or the segment data.
+
+    The results are returned as a dict, with the file_fields values from
+    the file header, "file_name", and "image_segment" which is a list with
+    a dict of the fields values for each image subheader. A field that is
+    conditional and not present (e.g., igeolo when icords is blank) has
+    the value None.'''
+    with open(path, 'rb') as fh:
+        fhead = NitfFileHeader()
+        fhead.read_from_file(fh, lazy_decode=True)
+        if(fhead.fl == 999999999999):
+            raise RuntimeError("We don't currently support reading streaming NITF files")
+        res = _field_values(fhead, file_fields)
+        res["file_name"] = path
+        res["image_segment"] = []
+        pos = fhead.hl
+        for i in range(fhead.numi):
+            fh.seek(pos)
+            t = fh.read(fhead.lish[i])
+            if(len(t) != fhead.lish[i]):
+                raise RuntimeError("Not enough bytes left to read image subheader %d" % (i+1))
+            ish = NitfImageSubheader()
+            ish.read_from_file(io.BytesIO(t), lazy_decode=True)
+            res["image_segment"].append(_field_values(ish, fields))
+            pos += fhead.lish[i] + fhead.li[i]
+    return res
+
+class NitfReadResult(object):
+    '''The result of reading one file in read_many. 
+
+    :ivar path:      The file name
+    :ivar value:     The result of reading the file, None if we had an error
+    :ivar error:     None if we read the file, otherwise a string 
+                     describing the error.
+    :ivar traceback: The traceback for the error, or None.
+    '''
+    def __init__(self, path, value=None, error=None, traceback=None):
+        self.path = path
+        self.value = value
+        self.error = error
+        self.traceback = traceback
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __str__(self):
+        if(self.ok):
+            return "NitfReadResult for %s" % self.path
+        return "NitfReadResult for %s, error: %s" % (self.path, self.error)
+
+def _read_headers(path, **kwargs):
+    '''Read the file, and return a dict of the file header and subheaders.
+    These are all FieldStruct, which can be pickled.'''
+    # Avoid circular import
+    from .nitf_file import NitfFile
+    f = NitfFile(path, **kwargs)
+    res = {"file_header" : f.file_header}
+    for nm in ("image_segment", "graphic_segment", "text_segment",
+               "des_segment", "res_segment"):
+        res[nm] = [seg.subheader for seg in getattr(f, nm)]
+    return res
+
+def _read_summary(path, **kwargs):
+    from .nitf_file import NitfFile
+    return NitfFile(path, **kwargs).summary()
+
+_read_many_mode = {"scan" : scan_headers,
+                   "summary" : _read_summary,
+                   "headers" : _read_headers}
+
+def _read_one(path, mode, tre_warning_as_error, kwargs):
+    '''Read a single file for read_many. We catch all errors, and
+    report them in the NitfReadResult.'''
+    try:
+        with warnings.catch_warnings():
+            if(tre_warning_as_error):
+                warnings.simplefilter("error", TreWarning)
+            return NitfReadResult(path, _read_many_mode[mode](path, **kwargs))
+    except Exception as e:
+        return NitfReadResult(path, error="%s: %s" % (type(e).__name__, e),
+                              traceback=traceback.format_exc())
+
+def read_many(paths, workers=None, mode="scan", tre_warning_as_error=False,
+              **kwargs):
+    '''Read a number of NITF files, spreading the work over a pool of
+    worker processes (the parsing is all python, so threads don't help).
+
+    This is a generator returning a NitfReadResult for each file, in the 
+    order that they finish (not the order of paths). An error reading 
+    one file is reported in the NitfReadResult, it doesn't stop
+    the other files from being read.
+
+    The mode is one of:
+
+    scan    - Use scan_headers. Additional keywords (e.g., fields) are 
+              passed to scan_headers.
+    summary - Read with NitfFile, and return NitfFile.summary().
+    headers - Read with NitfFile, and return a dict with the 
+              "file_header" and a list of subheaders for each segment 
+              type (e.g., "image_segment"). Additional keywords (e.g., 
+              lazy_tre) are passed to NitfFile.
+
+    The workers is the number of processes to use, the default is the
+    number of CPUs. A workers of 0 reads the files in this process, 
+    which can be useful for debugging.
+
+    If tre_warning_as_error is True, we treat a TreWarning as an error
+    for that file.'''
+    if(mode not in _read_many_mode):
+        raise RuntimeError("Unknown read_many mode %s" % mode)
+    if(workers == 0):
+        for p in paths:
+            yield _read_one(p, mode, tre_warning_as_error, kwargs)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        flist = [ex.submit(_read_one, p, mode, tre_warning_as_error, kwargs)
+                 for p in paths]
+        try:
+            for f in as_completed(flist):
+                yield f.result()
+        finally:
+            # Don't bother reading the rest of the files if we stopped
+            # early
+            for f in flist:
+                f.cancel()
+
+__all__ = ["scan_headers", "default_scan_file_fields",
+           "default_scan_image_fields", "read_many", "NitfReadResult"]
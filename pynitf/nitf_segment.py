@@ -6,6 +6,7 @@ from .nitf_text_subheader import NitfTextSubheader
 from .nitf_des_subheader import NitfDesSubheader
 from .nitf_graphic_subheader import NitfGraphicSubheader
 from .nitf_res_subheader import NitfResSubheader
+from .nitf_copy_data import copy_file_data
 import io
 import weakref
 import copy
@@ -27,12 +28,26 @@ class NitfSharedHeader(object):
             self.user_subheader = None
         
 class NitfSegment(object):
+    '''Base class for the segments in a NITF file.
+
+    For a segment read from a file, data_source is (file name, offset,
+    size) of the data in that file, header_start is the offset of the
+    subheader in that file, and data_dirty is False until the
+    data is replaced (by assigning to data). When we write a segment that
+    isn't dirty, and the data class allows it (see 
+    NitfData.passthrough_write), we just copy the data from the file we
+    read rather than going through the data's write_to_file. If you
+    change the data some other way that the data class doesn't know
+    about, you can set data_dirty to True.
+    '''
     sh_class = None
     _update_file_header_field = (None, None)
     _type_support_tre = False
     _tre_field_list = None
     def __init__(self, data=None, header_size=None, data_size=None,
                  nitf_file = None, security = None):
+        self.data_source = None
+        self.header_start = None
         self.data = data
         if(self.data):
             self._shared_header = data._shared_header
@@ -74,6 +89,16 @@ class NitfSegment(object):
         '''This is Image, Graphics, Text, Des or Res'''
         pass
 
+    @property
+    def data(self):
+        '''The NitfData for the segment.'''
+        return self._data
+
+    @data.setter
+    def data(self, v):
+        self._data = v
+        self.data_dirty = True
+        
     @property
     def subheader(self):
         '''Return subheader for NitfSegment'''
@@ -146,11 +171,13 @@ class NitfSegment(object):
                 
         return self.subheader.summary() + res.getvalue()
 
-    def read_tre(self, des_list):
-        '''Read the TREs in a segment.'''
+    def read_tre(self, des_list, delayed_read=False):
+        '''Read the TREs in a segment. See read_tre_data for 
+        delayed_read.'''
         if(self._type_support_tre):
             self.tre_list = read_tre(self.subheader,des_list,
-                                     self._tre_field_list)
+                                     self._tre_field_list,
+                                     delayed_read=delayed_read)
 
     def prepare_tre_write(self, seg_index, des_list):
         '''Process the TREs in a segment putting them in the various places
@@ -168,6 +195,7 @@ class NitfSegment(object):
         number. Most readers don't care at all about this, but it can be
         useful for implementing some external code readers (e.g., GDAL
         can read an image segment by the file name and index)'''
+        self.header_start = fh.tell()
         self.subheader.read_from_file(fh)
         self._read_user_subheader()
         if self.nitf_file:
@@ -175,7 +203,12 @@ class NitfSegment(object):
         else:
             from .nitf_segment_data_handle import NitfSegmentDataHandleSet
             hs = NitfSegmentDataHandleSet.default_handle_set()
+        data_start = fh.tell()
         self.data = hs.read_from_file(self, fh, seg_index)
+        if(isinstance(getattr(fh, "name", None), str) and
+           self.data_size is not None):
+            self.data_source = (fh.name, data_start, self.data_size)
+        self.data_dirty = False
 
     def _update_file_header(self, fh, seg_index, sz_header, sz_data):
         '''Update the NITF file header with the segment header and data size.'''
@@ -207,6 +240,13 @@ class NitfSegment(object):
         else:
             self.subheader.user_subheader_data = ""
 
+    @property
+    def can_passthrough_write(self):
+        '''True if we can write the data by just copying it from
+        data_source.'''
+        return (self.data_source is not None and not self.data_dirty and
+                getattr(self.data, "passthrough_write", False))
+
     def write_to_file(self, fh, seg_index):
         '''Write to a file. We also update the file header information in 
         the nitf_file passed in with the header and data size for this segment.
@@ -226,7 +266,10 @@ class NitfSegment(object):
         start_pos = fh.tell()
 
         try:
-            self.data.write_to_file(fh)
+            if(self.can_passthrough_write):
+                copy_file_data(fh, *self.data_source)
+            else:
+                self.data.write_to_file(fh)
         except Exception as ex:
             raise(RuntimeError("Exception occurred while writing out segment number %d (zero-based index): \n\n%s" % (seg_index, str(ex))))
 
@@ -7,6 +7,8 @@ from .nitf_graphic_subheader import NitfGraphicSubheader
 from .nitf_res_subheader import NitfResSubheader
 from .nitf_diff_handle import (NitfDiffHandle, NitfDiffHandleSet)
 from .priority_handle_set import PriorityHandleSet
+from .lazy_module_registry import load_des_module
+from .nitf_copy_data import copy_file_data
 import abc
 import io
 import weakref
@@ -14,6 +16,11 @@ import logging
 
 class NitfSegmentDataHandleSet(PriorityHandleSet):
     '''Handle reading the data in a segment (e.g, a image)'''
+    # The subheader field we use as part of the dispatch_key for each
+    # type of segment.
+    dispatch_field = ((NitfImageSegment, "ic"), (NitfDesSegment, "desid"),
+                      (NitfTextSegment, "txtfmt"))
+    
     def read_from_file(self, seg, fh, seg_index=None):
         '''Read the data for the given NitfSegment from file handle fh.
 
@@ -22,15 +29,41 @@ class NitfSegmentDataHandleSet(PriorityHandleSet):
         information (e.g. NitfImageGdal found in GeoCal). So we hand off
         this information if we have the seg_index available (e.g., we
         are calling this through NitfFile).'''
+        # Make sure the module for the DES has been imported, so its
+        # handles are available
+        if(isinstance(seg, NitfDesSegment)):
+            load_des_module(seg.subheader.desid)
         return self.handle(seg, fh, seg_index)
+
+    def dispatch_key(self, seg, fh, seg_index=None):
+        '''The key is the type of the segment, along with the value of
+        the dispatch_field for that segment type (e.g., desid for a DES).'''
+        for cls, fld in self.dispatch_field:
+            if(isinstance(seg, cls)):
+                return (type(seg), getattr(seg.subheader, fld))
+        return (type(seg), None)
+
+    def handle_applies(self, cls, key):
+        '''Skip handles for a different segment class, or that don't
+        support the value of the dispatch_field (see NitfData.handle_key).'''
+        seg_type, v = key
+        if(cls.seg_class is not None and
+           not issubclass(seg_type, cls.seg_class)):
+            return False
+        hkey = cls.handle_key() if hasattr(cls, "handle_key") else None
+        return hkey is None or v in hkey
         
     def handle_h(self, cls, seg, fh, seg_index):
         '''Try reading using a given cls derived from NitfData. We 
         first check that the seg is the same class as cls.seg_class,
-        and if so try to read the data from file.
+        and that cls.can_handle the subheaders. Only then do we create
+        the object and read the data from file.
         '''
         if cls.seg_class is not None and not isinstance(seg, cls.seg_class):
             return (False, None)
+        if(hasattr(cls, "can_handle") and
+           not cls.can_handle(seg.subheader, seg.user_subheader)):
+            return (False, None)
         t = cls(seg = seg)
         could_handle = t.read_from_file(fh, seg_index)
         if not could_handle:
@@ -38,10 +71,18 @@ class NitfSegmentDataHandleSet(PriorityHandleSet):
         return (True, t)
 
 class NitfData(object, metaclass=abc.ABCMeta):
-    ''' Handle reading and writing the data in a segment (e.g, a image).'''
+    ''' Handle reading and writing the data in a segment (e.g, a image).
+
+    If passthrough_write is True, then for data read from a file, 
+    write_to_file writes exactly the data we read. NitfSegment can then
+    just copy the data from the file instead of calling write_to_file.
+    This should be False (the default) for data that can be changed
+    in place (e.g., the fields of a NitfDesFieldStruct), so we don't
+    lose the changes.'''
     seg_class = None
     sh_class = None
     uh_class = None
+    passthrough_write = False
     def __init__(self, seg = None):
         '''Initialize object. If the NitfSegment we are associated with
         gets passed in then we use the subheader and if available 
@@ -55,6 +96,30 @@ class NitfData(object, metaclass=abc.ABCMeta):
             self._shared_header = NitfSharedHeader(self.sh_class,
                                                    self.uh_class)
 
+    @classmethod
+    def handle_key(cls):
+        '''If read_from_file can only handle particular values of the
+        subheader field given by NitfSegmentDataHandleSet.dispatch_field
+        (e.g., the desid for a DES), return a tuple of those values. This
+        lets NitfSegmentDataHandleSet skip this class without needing to
+        try reading. The default is None, meaning we need to try reading
+        to know.
+
+        Note that a derived class that reads a different set of values
+        needs to override this also.'''
+        return None
+
+    @classmethod
+    def can_handle(cls, subheader, user_subheader):
+        '''Return True if we can read the data for a segment with the
+        given subheader and user_subheader (which may be None). 
+
+        This should only look at the already parsed subheader fields, it
+        shouldn't do any reading. NitfSegmentDataHandleSet calls this
+        before creating the object, so a handle that can't read the data
+        doesn't need to touch the file at all. The default is True.'''
+        return True
+
     def primary_key(self):
         '''NITF segments don't actually have a unique key. But in practice
         it sort of does. So for example iid1 for NitfImageSegment is often
@@ -102,7 +167,12 @@ class NitfData(object, metaclass=abc.ABCMeta):
         read this class, return False. Otherwise, return True. Note that
         True/False *isn't* from a read error, but rather because this
         is an unsupported type (e.g., a JPEG-2000 compressed image with
-        a reader that doesn't support that).'''
+        a reader that doesn't support that).
+
+        New classes should put the checks for an unsupported type in
+        can_handle, so we don't need to start reading to find out. 
+        Returning False here is still supported, but the file position
+        should then be left unchanged.'''
         raise NotImplementedError
 
     @abc.abstractmethod
@@ -164,6 +234,18 @@ class NitfDes(NitfData):
             if(self.des_tag):
                 self.subheader.desid = self.des_tag
 
+    @classmethod
+    def handle_key(cls):
+        '''We only read DESs with a desid of des_tag.'''
+        if(cls.des_tag is None):
+            return None
+        return (cls.des_tag,)
+
+    @classmethod
+    def can_handle(cls, subheader, user_subheader):
+        '''We only read DESs with a desid of des_tag.'''
+        return cls.des_tag is None or subheader.desid == cls.des_tag
+
     def primary_key(self):
         return (self.desid, None)
     
@@ -228,21 +310,27 @@ class NitfResRaw(NitfRes):
 class NitfDataPlaceHolder(NitfData):
     '''Implementation that doesn't actually read any data, useful as a
     final place holder if none of our other NitfData classes can handle
-    a particular segment. We just skip over the data when reading.'''
+    a particular segment. We just skip over the data when reading, and
+    copy it from the file we read when writing.'''
+    passthrough_write = True
     def __str__(self):
         return ("NitfDataPlaceHolder for %s with %d bytes of data" %
                 (self._seg().short_desc(), self._seg().data_size))
         
     def read_from_file(self, fh, seg_index=None):
-        fh.seek(self._seg().data_size, 1)
+        self.data_start = fh.tell()
+        self.fh_in_name = fh.name
+        self.data_size = self._seg().data_size
+        fh.seek(self.data_size, 1)
         return True
 
     def write_to_file(self, fh):
-        raise NotImplementedError("Can't write a NitfDataPlaceHolder")
+        copy_file_data(fh, self.fh_in_name, self.data_start, self.data_size)
 
 logger = logging.getLogger('nitf_diff')
 class DataPlaceHolderDiff(NitfDiffHandle):
     '''Compare two NitfDataPlaceHolder'''
+    diff_type = NitfDataPlaceHolder
     def handle_diff(self, g1, g2, nitf_diff):
         if(not isinstance(g1, NitfDataPlaceHolder) or
            not isinstance(g2, NitfDataPlaceHolder)):
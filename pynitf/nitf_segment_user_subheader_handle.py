@@ -1,11 +1,18 @@
 from .nitf_segment import NitfDesSegment, NitfResSegment
 from .priority_handle_set import PriorityHandleSet
+from .lazy_module_registry import load_des_module
 import abc
 import copy
 
 class NitfSegmentUserSubheaderHandleSet(PriorityHandleSet):
     '''This holds the user subheader handlers for each of the NitfSegment
     types that support these.'''
+    def dispatch_key(self, seg):
+        return type(seg)
+
+    def handle_applies(self, obj, key):
+        return obj.seg_class is None or issubclass(key, obj.seg_class)
+    
     def handle_h(self, obj, seg):
         if obj.seg_class is not None and not isinstance(seg, obj.seg_class):
             return (False, None)
@@ -30,7 +37,11 @@ class DesIdToUSHHandle(UserSubheaderHandle):
         self.des_id_to_cls = {}
         
     def user_subheader_cls(self, seg):
-        return(True, self.des_id_to_cls.get(seg.subheader.desid, None))
+        desid = seg.subheader.desid
+        # Import the module for the DES the first time we see it.
+        if(desid not in self.des_id_to_cls):
+            load_des_module(desid)
+        return(True, self.des_id_to_cls.get(desid, None))
 
     def add_des_user_subheader(self, desid, cls):
         self.des_id_to_cls[desid] = cls
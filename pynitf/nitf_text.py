@@ -48,6 +48,7 @@ class NitfTextStr(NitfText):
 
 class TextStrDiff(NitfDiffHandle):
     '''Compare two NitfTextStr'''
+    diff_type = NitfTextStr
     def configuration(self, nitf_diff):
         return nitf_diff.config.get("TextStr", {})
     
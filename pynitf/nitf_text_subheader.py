@@ -64,6 +64,7 @@ class NitfTextSubheader(FieldStruct):
 
 class TextSubheaderDiff(FieldStructDiff):
     '''Compare two text subheaders.'''
+    diff_type = NitfTextSubheader
     def configuration(self, nitf_diff):
         return nitf_diff.config.get("Text Subheader", {})
 
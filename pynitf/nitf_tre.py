@@ -6,6 +6,7 @@
 
 from .nitf_field import FieldStruct, FieldStructDiff
 from .nitf_diff_handle import NitfDiffHandle, NitfDiffHandleSet
+from .lazy_module_registry import load_tre_module
 import copy
 import io
 import logging
@@ -35,6 +36,11 @@ class Tre(FieldStruct):
         return len(self.tre_bytes())
     def tre_bytes(self):
         '''All of the TRE expect for the front two cetag and cel fields'''
+        # If we haven't parsed the TRE yet, it can't have changed so
+        # just return what we read.
+        bt = self._unparsed_tre_bytes()
+        if(bt is not None):
+            return bt
         if(self.tre_implementation_field):
             t = getattr(self, self.tre_implementation_field).tre_string()
             if(isinstance(t, bytes)):
@@ -56,20 +62,59 @@ class Tre(FieldStruct):
             super().read_from_file(fh, nitf_literal=nitf_literal)
 
     def read_from_file(self, fh, delayed_read=False):
+        '''Read the TRE from a file. If delayed_read is True we just note
+        where the TRE data is, and don't parse it until it is used.'''
         tag = fh.read(6).rstrip().decode("utf-8")
         if(tag != self.tre_tag):
             raise RuntimeError("Expected TRE %s but got %s" % (self.tre_tag, tag))
         cel = int(fh.read(5))
-        if(self.tre_implementation_field):
+        self._tre_data_loc = None
+        if(delayed_read):
+            self._tre_data_loc = (fh, fh.tell(), cel)
+            fh.seek(cel, 1)
+        elif(self.tre_implementation_field):
             self.read_from_tre_bytes(fh.read(cel))
         else:
-            st = fh.tell()
-            super().read_from_file(fh, delayed_read=delayed_read)
-            if(delayed_read):
-                fh.seek(cel, 1)
-            sz = fh.tell() - st
-            if(sz != cel):
-                raise RuntimeError("TRE length was expected to be %d but was actually %d" % (cel, sz))
+            self._read_fields(fh, cel)
+
+    def _read_fields(self, fh, cel):
+        '''Read the fields of the TRE, checking that we used exactly
+        cel bytes.'''
+        st = fh.tell()
+        super().read_from_file(fh)
+        sz = fh.tell() - st
+        if(sz != cel):
+            raise RuntimeError("TRE length was expected to be %d but was actually %d" % (cel, sz))
+        
+    def _unparsed_tre_bytes(self):
+        '''If we did a delayed read and haven't parsed the TRE yet, return
+        the TRE data. Otherwise return None.'''
+        loc = self.__dict__.get("_tre_data_loc")
+        if(loc is None):
+            return None
+        fh, pos, cel = loc
+        last_pos = fh.tell()
+        fh.seek(pos)
+        bt = fh.read(cel)
+        fh.seek(last_pos)
+        return bt
+
+    def __setattr__(self, nm, value):
+        if(self.tre_implementation_field and
+           nm == self.tre_implementation_field):
+            # This replaces the TRE data we haven't parsed yet
+            self.__dict__["_tre_data_loc"] = None
+        super().__setattr__(nm, value)
+
+    def _finish_delayed_read(self):
+        bt = self._unparsed_tre_bytes()
+        if(bt is not None):
+            self._tre_data_loc = None
+            if(self.tre_implementation_field):
+                self.read_from_tre_bytes(bt)
+            else:
+                self._read_fields(io.BytesIO(bt), len(bt))
+        super()._finish_delayed_read()
     def write_to_file(self, fh):
         fh.write("{:6s}".format(self.cetag_value()).encode("utf-8"))
         t = self.tre_bytes()
@@ -148,6 +193,9 @@ class TreTagToCls(object):
     def tre_object(self, tre_name):
         '''Return a TRE object that can be used to read or write the given tre
         name, or a TreUnknown if we don't have that registered.'''
+        # Import the module for the TRE the first time we see it.
+        if(tre_name not in self.tre_to_cls):
+            load_tre_module(tre_name)
         if(tre_name in self.tre_to_cls):
             return self.tre_to_cls[tre_name]()
         return TreUnknown(tre_name)
@@ -160,7 +208,7 @@ class TreTagToCls(object):
 
 tre_tag_to_cls = TreTagToCls()        
 
-def read_tre(header, des_list, field_list = []):
+def read_tre(header, des_list, field_list = [], delayed_read=False):
     '''This reads a TRE for a particular type of header (e.g., NitfFileHeader,
     NitfImageSubheader). The reading is complicated. There are one or
     more base field names to check, each has three fields,
@@ -168,18 +216,27 @@ def read_tre(header, des_list, field_list = []):
     Each of these fields may or may not have TRE data. In addition, there
     is an "overflow" indicator which points to a TRE_OVERFLOW DES to read 
     additional TREs. This function processes through this logic and 
-    reads all the TREs, returning a (possibly empty) list of TREs.'''
+    reads all the TREs, returning a (possibly empty) list of TREs.
+
+    If delayed_read is True, we don't parse the TREs until they are
+    used (see read_tre_data).'''
     tre_list = []
+    for h_len, h_ofl, h_data in field_list:
+        if(getattr(header, h_len) > 0):
+            t = read_tre_data(getattr(header, h_data),
+                              delayed_read=delayed_read)
+            tre_list.extend(t)
+    # The overflow TREs go at the end. This is the order that
+    # prepare_tre_write fills things in, so writing the TREs back out
+    # puts each one back where we found it.
     for h_len, h_ofl, h_data in field_list:
         if(getattr(header, h_len) > 0):
             des_index = getattr(header, h_ofl)
             if(des_index > 0):
                 # des_index is 1 based, so subtract 1 to get the des
                 desseg = des_list[getattr(header, h_ofl)-1]
-                t = read_tre_data(desseg.des.data)
+                t = read_tre_data(desseg.des.data, delayed_read=delayed_read)
                 tre_list.extend(t)
-            t = read_tre_data(getattr(header, h_data))
-            tre_list.extend(t)
     return tre_list
 
 def prepare_tre_write(tre_list, header, des_list, field_list = [],
@@ -230,8 +287,14 @@ def prepare_tre_write(tre_list, header, des_list, field_list = [],
         des_list.append(desseg)
         setattr(header, h_offl, len(des_list))
     
-def read_tre_data(data):
-    '''Read a blob of data, and translate into a series of TREs'''
+def read_tre_data(data, delayed_read=False):
+    '''Read a blob of data, and translate into a series of TREs.
+
+    If delayed_read is True, we only read the CETAG and CEL at the
+    front of each TRE and skip over the rest. The TRE then gets parsed
+    the first time it is used. Note that this means an error in the TRE
+    gets reported when it is used, rather than being turned into a
+    TreUnknown with a TreWarning.'''
     fh = io.BytesIO(data)
     res = []
     while True:
@@ -244,7 +307,10 @@ def read_tre_data(data):
         try:
             fh.seek(st)
             t = tre_tag_to_cls.tre_object(tre_name)
-            t.read_from_file(fh)
+            if(delayed_read and not isinstance(t, TreUnknown)):
+                t.read_from_file(fh, delayed_read=True)
+            else:
+                t.read_from_file(fh)
             res.append(t)
         except Exception as e:
             warnings.warn("Trouble reading TRE " + tre_name.decode("utf-8") +
@@ -285,6 +351,7 @@ def add_find_tre_function(cls):
 logger = logging.getLogger('nitf_diff')
 class TreDiff(FieldStructDiff):
     '''Compare two TREs.'''
+    diff_type = Tre
     def configuration(self, nitf_diff):
         return self._config
     def handle_diff(self, h1, h2, nitf_diff):
@@ -304,6 +371,7 @@ NitfDiffHandleSet.default_config["TRE"] = {}
         
 class TreUnknownDiff(FieldStructDiff):
     '''Compare two unknown TREs.'''
+    diff_type = TreUnknown
     def handle_diff(self, h1, h2, nitf_diff):
         if(not isinstance(h1, TreUnknown) or
            not isinstance(h2, TreUnknown)):
@@ -49,28 +49,32 @@ desc = [["iid", "Image Identifier", 80, str, {'optional':True}],
         ["rnpwrz", "Row Numerator Poly Max Power of Z", 1, int],
         ["rntrms", "Row Numerator Poly Number of Poly Terms", 3, int],
         [["loop", "f.rntrms"],
-        ["rnpcf", "Poly Coeff", 21, float, {'frmt' : _rfep_format}],
+        ["rnpcf", "Poly Coeff", 21, float, {'frmt' : _rfep_format,
+                                          'array_storage' : True}],
         ],
         ["rdpwrx", "Row Denominator Poly Max Power of X", 1, int],
         ["rdpwry", "Row Denominator Poly Max Power of Y", 1, int],
         ["rdpwrz", "Row Denominator Poly Max Power of Z", 1, int],
         ["rdtrms", "Row Denominator Poly Number of Poly Terms", 3, int],
         [["loop", "f.rdtrms"],
-        ["rdpcf", "Poly Coeff", 21, float, {'frmt' : _rfep_format}],
+        ["rdpcf", "Poly Coeff", 21, float, {'frmt' : _rfep_format,
+                                          'array_storage' : True}],
         ],
         ["cnpwrx", "Row Numerator Poly Max Power of X", 1, int],
         ["cnpwry", "Row Numerator Poly Max Power of Y", 1, int],
         ["cnpwrz", "Row Numerator Poly Max Power of Z", 1, int],
         ["cntrms", "Row Numerator Poly Number of Poly Terms", 3, int],
         [["loop", "f.cntrms"],
-        ["cnpcf", "Poly Coeff", 21, float, {'frmt' : _rfep_format}],
+        ["cnpcf", "Poly Coeff", 21, float, {'frmt' : _rfep_format,
+                                          'array_storage' : True}],
         ],
         ["cdpwrx", "Row Denominator Poly Max Power of X", 1, int],
         ["cdpwry", "Row Denominator Poly Max Power of Y", 1, int],
         ["cdpwrz", "Row Denominator Poly Max Power of Z", 1, int],
         ["cdtrms", "Row Denominator Poly Number of Poly Terms", 3, int],
         [["loop", "f.cdtrms"],
-        ["cdpcf", "Poly Coeff", 21, float, {'frmt' : _rfep_format}],
+        ["cdpcf", "Poly Coeff", 21, float, {'frmt' : _rfep_format,
+                                          'array_storage' : True}],
         ],
 ]
 
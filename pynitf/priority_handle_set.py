@@ -1,9 +1,26 @@
+from .lazy_module_registry import loaded_lazy_modules
 import collections
 import collections.abc
+import copy
 
 class PriorityHandleSet(collections.abc.Set):
+    # Incremented each time a handle is added to any default handle set.
+    _default_generation = 0
+    
     def __init__(self):
         self.handle_set = collections.defaultdict(lambda : set())
+        # For a copy of the default handle set, this is the set of lazily
+        # loaded modules (see lazy_module_registry.py) that had already
+        # been imported when we made the copy, or that we have since
+        # added the handles from. None for other handle sets.
+        self._lazy_module_seen = None
+        self._lazy_generation = None
+        # Cache of the handles to try for a given dispatch_key, see
+        # _dispatch_list, and of the handle that we found for a
+        # dispatch_key (see handle_type_only). These get cleared when the
+        # handles change.
+        self._dispatch = {}
+        self._resolved = {}
 
     def __contains__(self, itm):
         return itm[0] in self.handle_set[itm[1]]
@@ -30,22 +47,64 @@ class PriorityHandleSet(collections.abc.Set):
         '''Copy the PrioritySet. This is a shallow copy, we have our our
         handle set but all the objects in it are the same as the original
         set.'''
-        return self.__class__._from_iterable(iter(self))
+        res = self.__class__._from_iterable(iter(self))
+        res._copy_lazy_module_seen(self)
+        return res
+
+    def __deepcopy__(self, memo):
+        '''Deep copy the PrioritySet, including the handles in it.'''
+        res = self.__class__()
+        memo[id(self)] = res
+        for (h, p) in self:
+            res.add_handle(copy.deepcopy(h, memo), priority_order=p)
+        res._copy_lazy_module_seen(self)
+        return res
+
+    def _copy_lazy_module_seen(self, other):
+        '''When we copy the default handle set, we want the copy to also
+        get the handles added when a lazy module is later imported (e.g.,
+        NitfFile copies the default set before it reads a file, but the
+        DES modules only get imported once we see the DES in the file).'''
+        if(other._lazy_module_seen is not None):
+            self._lazy_module_seen = set(other._lazy_module_seen)
+        elif(other is self.default_handle_set()):
+            self._lazy_module_seen = loaded_lazy_modules()
+        self._lazy_generation = PriorityHandleSet._default_generation
+
+    def _add_lazy_module_handles(self):
+        '''Add the default handles from any lazy modules that have been
+        imported since we were copied from the default handle set.'''
+        self._lazy_generation = PriorityHandleSet._default_generation
+        mset = loaded_lazy_modules() - self._lazy_module_seen
+        if(len(mset) == 0):
+            return
+        self._lazy_module_seen |= mset
+        mset = {"pynitf." + m for m in mset}
+        for (h, p) in self.default_handle_set():
+            if(getattr(h, "__module__", None) in mset):
+                self.add_handle(h, priority_order=p)
     
     def add_handle(self, h, priority_order=0):
         '''Add a handler. The higher priority_order (larger number) items are
         tried first.'''
         self.handle_set[priority_order].add(h)
+        self._clear_dispatch()
 
     def discard_handle(self, h):
         '''Discard the handle h. It is ok if h isn't actually in the set 
         of handles.'''
         for k in sorted(self.handle_set.keys()):
             self.handle_set[k].discard(h)
+        self._clear_dispatch()
 
     def clear(self):
         '''Remove all handles in the set.'''
         self.handle_set.clear()
+        self._clear_dispatch()
+
+    def _clear_dispatch(self):
+        self._dispatch = {}
+        self._resolved = {}
 
     @classmethod
     def default_handle_set(cls):
@@ -59,6 +118,7 @@ class PriorityHandleSet(collections.abc.Set):
         '''Add the given handle to the default set of handlers.  The 
         higher priority_order (larger number) items are tried first.'''
         cls.default_handle_set().add_handle(h, priority_order)
+        PriorityHandleSet._default_generation += 1
 
     @classmethod            
     def discard_default_handle(cls, h):
@@ -69,11 +129,22 @@ class PriorityHandleSet(collections.abc.Set):
     def handle(self, *args, **keywords):
         '''Find the first handle that says it can process the given arguments,
         and return the results from that handle.'''
+        if(self._lazy_module_seen is not None and
+           self._lazy_generation != PriorityHandleSet._default_generation):
+            self._add_lazy_module_handles()
+        key = self.dispatch_key(*args, **keywords)
+        h = self._resolved.get(key)
+        if(h is not None):
+            c, r = self.handle_h(h, *args, **keywords)
+            if(c):
+                return r
         could_handle = False
         res = None
         h_handle = None
-        for p in sorted(self.handle_set.keys(), reverse=True):
-            for h in self.handle_set[p]:
+        type_only = key is not None
+        for p, hlist in self._dispatch_list(key):
+            for h in hlist:
+                type_only = type_only and self.handle_type_only(h)
                 c, r = self.handle_h(h, *args, **keywords)
                 if(c and could_handle):
                     raise RuntimeError(f"Multiple handles of the same priority level {p} wanted to process the data. Handle {h_handle} and {h} both wanted to process the data. args={args}, keywords={keywords}.")
@@ -82,9 +153,55 @@ class PriorityHandleSet(collections.abc.Set):
                     h_handle = h
                     res = r
             if(could_handle):
+                # If all the handles we tried only looked at the types,
+                # then we know we'll get the same handle the next time
+                # we see this key.
+                if(type_only):
+                    self._resolved[key] = h_handle
                 return res
         raise RuntimeError("No handle was found. args=%s, keywords=%s" % (args, keywords))
 
+    def _dispatch_list(self, key):
+        '''Return a list of (priority, handle list) pairs, in the order
+        we should try them, for the given dispatch_key. This only
+        includes the handles where handle_applies is True.
+
+        This is calculated the first time we see a key, and then cached
+        until the handles change.'''
+        res = self._dispatch.get(key)
+        if(res is None):
+            res = []
+            for p in sorted(self.handle_set.keys(), reverse=True):
+                hlist = [h for h in self.handle_set[p]
+                         if self.handle_applies(h, key)]
+                if(len(hlist) > 0):
+                    res.append((p, hlist))
+            self._dispatch[key] = res
+        return res
+
+    def dispatch_key(self, *args, **keywords):
+        '''Derived classes can override this to return a (hashable) key
+        describing the arguments to handle. This is used with
+        handle_applies to skip handles that we know can't process the
+        arguments, without needing to call handle_h. The default is
+        None, which tries all the handles.'''
+        return None
+
+    def handle_applies(self, h, key):
+        '''Return False if we know that the handle h can't process
+        arguments with the given dispatch_key. Note the results of this
+        are cached, so this should only depend on h and key.'''
+        return True
+
+    def handle_type_only(self, h):
+        '''Return True if whether h processes the arguments depends only
+        on the dispatch_key. If the handle we find for a dispatch_key and
+        all the handles we tried first have this property, we remember
+        the handle and go directly to it the next time. We still check 
+        for multiple handles at the same priority level the first time.
+        The default is False.'''
+        return False
+
     def handle_h(self, h, *args, **keywords):
         raise NotImplementedError
         
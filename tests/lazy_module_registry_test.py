@@ -0,0 +1,106 @@
+from pynitf.lazy_module_registry import *
+from pynitf.lazy_module_registry import (lazy_module_exports,
+                                         tre_tag_to_module, desid_to_module)
+from pynitf.nitf_file import NitfFile
+import pynitf
+from pynitf_test_support import *
+import glob
+import importlib
+import os
+import subprocess
+import sys
+
+def run_python(code):
+    '''Run python code in a new process, and return stdout.'''
+    env = dict(os.environ)
+    env.pop("PYNITF_CACHE_DIR", None)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(pynitf.__file__)),
+         env.get("PYTHONPATH", "")])
+    r = subprocess.run([sys.executable, "-c", code], env=env,
+                       capture_output=True, check=True)
+    return r.stdout.decode("utf-8")
+
+def test_registry_in_sync():
+    '''Check that the static registry matches what the modules actually
+    contain.'''
+    mlist = [os.path.basename(f)[:-3] for f in
+             glob.glob(os.path.dirname(pynitf.__file__) + "/*.py")]
+    for m in mlist:
+        if(m in ("__init__", "ipython", "version") or
+           m in pynitf._core_module):
+            continue
+        assert m in lazy_module_exports
+        mod = importlib.import_module("pynitf." + m)
+        if(hasattr(mod, "__all__")):
+            assert sorted(mod.__all__) == sorted(lazy_module_exports[m])
+    from pynitf.nitf_tre import tre_tag_to_cls
+    for tag, cls in tre_tag_to_cls.tre_to_cls.items():
+        m = cls.__module__.split(".")[-1]
+        if(m not in pynitf._core_module):
+            assert tre_tag_to_module[tag.decode("utf-8")] == m
+    from pynitf.nitf_segment_data_handle import NitfSegmentDataHandleSet
+    for h, p in NitfSegmentDataHandleSet.default_handle_set():
+        m = h.__module__.split(".")[-1]
+        if(getattr(h, "des_tag", None) and m not in pynitf._core_module):
+            assert desid_to_module[h.des_tag] == m
+
+def test_bare_import():
+    '''Check the number of modules a bare "import pynitf" loads.'''
+    res = run_python('''
+import sys
+from pynitf.nitf_file import NitfFile
+import pynitf
+print(len([m for m in sys.modules if m.split(".")[0] == "pynitf"]))
+print("pynitf.nitf_tre_rsmpca" in sys.modules)
+print("h5py" in sys.modules)
+pynitf.TreRSMPCA
+print("pynitf.nitf_tre_rsmpca" in sys.modules)
+''').split()
+    # pynitf, version, and the core modules
+    assert int(res[0]) == len(pynitf._core_module) + 2
+    assert res[1:] == ["False", "False", "True"]
+
+def test_lazy_read(isolated_dir):
+    '''Read a file with a TRE and DES in a new process, where the modules
+    for these haven't been imported yet.'''
+    f = NitfFile()
+    create_image_seg(f)
+    create_tre(f.image_segment[0])
+    des = DesCSATTB()
+    ds = des.user_subheader
+    ds.id = '4385ab47-f3ba-40b7-9520-13d6b7a7f311'
+    ds.numais = '010'
+    for i in range(int(ds.numais)):
+        ds.aisdlvl[i] = 5 + i
+    ds.reservedsubh_len = 0
+    des.qual_flag_att = 1
+    des.interp_type_att = 1
+    des.att_type = 1
+    des.eci_ecf_att = 0
+    des.dt_att = 900.5
+    des.date_att = 20170501
+    des.t0_att = 235959.100001000
+    des.num_att = 2
+    for n in range(des.num_att):
+        des.q1[n] = 0.1
+        des.q2[n] = 0.2
+        des.q3[n] = 0.3
+        des.q4[n] = 0.4
+    des.reserved_len = 0
+    f.des_segment.append(NitfDesSegment(des))
+    f.write("z.ntf")
+    res = run_python('''
+from pynitf.nitf_file import NitfFile
+import pynitf
+f = pynitf.NitfFile("z.ntf")
+print(type(f.image_segment[0].tre_list[0]).__name__)
+print(type(f.des_segment[0].data).__name__)
+print(type(f.des_segment[0].user_subheader).__name__)
+d = pynitf.NitfDiff()
+print(d.compare("z.ntf", "z.ntf"))
+print(any(type(h).__name__ == "CsattbDiff" for h, p in d.handle_set))
+print("DesAssociatedUserSubheader" in d.config)
+''').split()
+    assert res == ["TreUSE00A", "DesCSATTB", "DesAssociatedUserSubheader",
+                   "True", "True", "True"]
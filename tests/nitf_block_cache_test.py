@@ -0,0 +1,77 @@
+from pynitf.nitf_block_cache import *
+from pynitf.nitf_file import NitfFile
+from pynitf.nitf_segment import NitfImageSegment
+from pynitf.nitf_image import NitfImageReadBlocked
+from pynitf_test_support import *
+import numpy as np
+import threading
+
+def test_block_cache():
+    c = NitfBlockCache(max_bytes=250)
+    ncreate = [0]
+    def create(v):
+        def f():
+            ncreate[0] += 1
+            return np.full((100,), v, dtype=np.uint8)
+        return f
+    assert c.get("a", create(1))[0] == 1
+    assert c.get("a", create(2))[0] == 1
+    assert ncreate[0] == 1
+    assert c.hits == 1 and c.misses == 1
+    c.get("b", create(2))
+    # Use "a", so "b" is now the least recently used
+    c.get("a", create(1))
+    c.get("c", create(3))
+    assert c.evictions == 1
+    assert "a" in c and "b" not in c and "c" in c
+    assert c.nbytes == 200
+    # Blocks are shared, so we can't write to them
+    with pytest.raises(ValueError):
+        c.get("a", create(1))[0] = 10
+    # Too big to keep at all
+    assert len(c.get("d", lambda : np.zeros((300,), np.uint8))) == 300
+    assert "d" not in c
+    c.max_bytes = 100
+    assert len(c) == 1
+    assert c.stats()["nbytes"] == 100
+    c.clear()
+    assert len(c) == 0 and c.nbytes == 0
+
+def test_block_cache_thread():
+    c = NitfBlockCache(max_bytes=1000)
+    def f():
+        for i in range(1000):
+            assert c.get(i % 20, lambda : np.full((100,), i % 20,
+                                                  dtype=np.uint8))[0] == i % 20
+    tlist = [threading.Thread(target=f) for i in range(4)]
+    for t in tlist:
+        t.start()
+    for t in tlist:
+        t.join()
+    assert c.hits + c.misses == 4000
+    assert c.nbytes <= 1000
+    assert c.nbytes == 100 * len(c)
+
+class ImageReadBlockedCache(NitfImageReadBlocked):
+    use_block_cache = True
+    
+def test_image_block_cache(isolated_dir):
+    img = ImageWriteBlocked(10, 13, np.int16, 4, 5, "B", numbands=2)
+    data = np.arange(2 * 10 * 13, dtype=np.int16).reshape(img.shape)
+    img[:, :, :] = data
+    f = NitfFile()
+    f.image_segment.append(NitfImageSegment(img))
+    f.write("test.ntf")
+    f2 = NitfFile()
+    f2.data_handle_set.add_handle(ImageReadBlockedCache, priority_order=10)
+    f2.read("test.ntf")
+    img2 = f2.image_segment[0].data
+    assert isinstance(img2, ImageReadBlockedCache)
+    block_cache.clear()
+    block_cache.reset_stats()
+    assert np.array_equal(img2[:, 2:7, 3:12], data[:, 2:7, 3:12])
+    # 2 x 3 blocks
+    assert block_cache.misses == 6 and block_cache.hits == 0
+    assert np.array_equal(img2[:, 0:4, 0:10], data[:, 0:4, 0:10])
+    assert block_cache.misses == 6 and block_cache.hits == 2
+    block_cache.clear()
@@ -0,0 +1,36 @@
+from pynitf.nitf_copy_data import *
+from pynitf_test_support import *
+import io
+import os
+import pytest
+
+@pytest.mark.parametrize("methods", [None, ("copy_file_range",),
+                                     ("sendfile",), ("buffered",)])
+def test_copy_file_data(isolated_dir, methods):
+    if(methods is not None and methods[0] != "buffered" and
+       not hasattr(os, methods[0])):
+        pytest.skip("os.%s not available" % methods[0])
+    data = os.urandom(3 * 1024 * 1024 + 17)
+    with open("in.dat", "wb") as fh:
+        fh.write(data)
+    with open("out.dat", "wb") as fh:
+        fh.write(b"header")
+        assert copy_file_data(fh, "in.dat", 10, 2 * 1024 * 1024 + 5,
+                              methods=methods) == 2 * 1024 * 1024 + 5
+        # Make sure we are at the right place in fh
+        fh.write(b"trailer")
+        copy_file_data(fh, "in.dat", methods=methods)
+    with open("out.dat", "rb") as fh:
+        assert fh.read() == (b"header" + data[10:(10 + 2 * 1024 * 1024 + 5)] +
+                             b"trailer" + data)
+
+def test_copy_file_data_bytesio(isolated_dir):
+    '''A file handle without a fileno falls back to a buffered copy'''
+    with open("in.dat", "wb") as fh:
+        fh.write(b"abcdefghij")
+    fh = io.BytesIO()
+    fh.write(b"1")
+    copy_file_data(fh, "in.dat", 2, 5)
+    assert fh.getvalue() == b"1cdefg"
+    with pytest.raises(RuntimeError):
+        copy_file_data(fh, "in.dat", 2, 20)
@@ -70,6 +70,7 @@ def test_des_csattb_basic():
         assert d2.q2[n] == -0.11111
         assert d2.q3[n] == 0.11111
         assert d2.q4[n] == 0.11111
+    assert_almost_equal(d2.q1.to_numpy(), [-0.11111] * 5)
     assert d2.reserved_len == 0
 
     print (d2.summary())
@@ -792,3 +792,201 @@ def test_loop_conditional(nitf_diff_field_struct):
     
 # TODO Add a test like Walt had where we override the equality function
 # for a field to match ignoring case
+
+def test_compile_expr():
+    '''Expressions in a description are compiled once and then reused.'''
+    from pynitf.nitf_field import _compile_expr
+    class TestFieldStruct(FieldStruct):
+        desc = [["numi", "", 3, int],
+                [["loop", "f.numi"],
+                 ["numj", "", 3, int],
+                 ['li', "", 10, int, {"condition" : "f.numj[i1] > 1"}]]
+        ]
+    t = TestFieldStruct()
+    t.numi = 2
+    t.numj[0] = 1
+    t.numj[1] = 2
+    assert _compile_expr("f.numi") is _compile_expr("f.numi")
+    assert _compile_expr("f.numi")(t) == 2
+    assert _compile_expr("f.numj[i1] > 1")(t, 1) == True
+    _compile_expr("f.numj[i1]", "set")(t, 5, 0)
+    assert t.numj[0] == 5
+    assert t.li[0] == 0
+    assert t.li[1] == 0
+
+def test_shared_schema():
+    '''The parsed description is shared between instances of a class, but
+    the values are not.'''
+    class TestFieldStruct(FieldStruct):
+        desc = [["numi", "", 3, int],
+                [["loop", "f.numi"],
+                 ["li", "", 10, int],
+                 ["ld", "", 4, None, {'field_value_class' : BytesFieldData,
+                                      'size_not_updated' : True}]]
+        ]
+    t1 = TestFieldStruct()
+    t2 = TestFieldStruct()
+    assert t1._schema is t2._schema
+    assert t1.field["li"]._schema is t2.field["li"]._schema
+    assert t1.field["li"] is not t2.field["li"]
+    assert t1.field["ld"].ty == bytes
+    t1.numi = 2
+    t1.li[1] = 10
+    t2.numi = 1
+    assert list(t1.li) == [0, 10]
+    assert list(t2.li) == [0]
+    t3 = TestFieldStruct(TestFieldStruct.desc)
+    assert t3._schema is not t1._schema
+
+def test_array_storage():
+    '''Test fields stored in a numpy array'''
+    class TestFieldStruct(FieldStruct):
+        desc = [["numi", "", 3, int],
+                [["loop", "f.numi"],
+                 ["lf", "", 10, float, {"frmt" : "%10.4f",
+                                        "array_storage" : True}],
+                 ["li", "", 4, int, {"array_storage" : True}]]
+        ]
+    t = TestFieldStruct()
+    assert isinstance(t.field["lf"], NitfArrayField)
+    t.numi = 3
+    t.lf[0] = 1.5
+    t.lf[2] = -2.25
+    t.li[1] = 10
+    assert list(t.lf) == [1.5, 0.0, -2.25]
+    assert list(t.li) == [0, 10, 0]
+    with pytest.raises(IndexError):
+        t.lf[3]
+    fh = io.BytesIO()
+    t.write_to_file(fh)
+    assert fh.getvalue() == b'003    1.50000000    0.00000010   -2.25000000'
+    t2 = TestFieldStruct()
+    t2.read_from_file(io.BytesIO(fh.getvalue()))
+    assert list(t2.lf) == [1.5, 0.0, -2.25]
+    assert t2.get_raw_bytes("lf", (2,)) == b'   -2.2500'
+    v = t2.lf.to_numpy()
+    assert v.dtype == np.float64
+    assert_almost_equal(v, [1.5, 0.0, -2.25])
+    # to_numpy is a view of the data
+    v[1] = 3.0
+    assert t2.lf[1] == 3.0
+    t2.li[0] = 5
+    assert_almost_equal(t2.li.to_numpy(), [5, 10, 0])
+    # Literal values are still supported
+    t2.lf[0] = NitfLiteral(b'1.5E+00')
+    fh = io.BytesIO()
+    t2.write_to_file(fh)
+    assert fh.getvalue() == b'0031.5E+00   0005    3.00000010   -2.25000000'
+    
+def test_array_storage_bad_desc():
+    '''array_storage is only supported for simple fields'''
+    class TestFieldStruct(FieldStruct):
+        desc = [["numi", "", 3, int, {"array_storage" : True}]]
+    with pytest.raises(RuntimeError):
+        TestFieldStruct()
+
+def test_regular_loop_read():
+    '''Test reading a loop where all the fields have a fixed size, which
+    is read all at once.'''
+    class TestFieldStruct(FieldStruct):
+        desc = [["numi", "", 3, int],
+                [["loop", "f.numi"],
+                 ["li", "", 4, int],
+                 [None, "", 2, str],
+                 ["lf", "", 8, float],
+                 ["la", "", 6, float, {"array_storage" : True}]]
+        ]
+    class TestFieldStruct2(FieldStruct):
+        desc = [["numi", "", 3, int],
+                [["loop", "f.numi"],
+                 ["li", "", 4, int],
+                 ["ls", "", 2, str],
+                 ["lf", "", 8, float],
+                 ["la", "", 6, float, {"array_storage" : True}]]
+        ]
+    t = TestFieldStruct()
+    assert t.pseudo_outer_loop.field_list[1]._schema.record_dtype is not None
+    t2 = TestFieldStruct2()
+    assert t2.pseudo_outer_loop.field_list[1]._schema.record_dtype is None
+    data = b'002  12ab    1.25 -2.50  -3xy-4.5e-01  1.50'
+    t.read_from_file(io.BytesIO(data))
+    t2.read_from_file(io.BytesIO(data))
+    for f in (t, t2):
+        assert list(f.li) == [12, -3]
+        assert list(f.lf) == [1.25, -0.45]
+        assert list(f.la) == [-2.5, 1.5]
+        assert f.get_raw_bytes("lf", (1,)) == b'-4.5e-01'
+        assert f.get_raw_bytes("la", (0,)) == b' -2.50'
+    assert list(t2.ls) == ["ab", "xy"]
+    with pytest.raises(RuntimeError):
+        t.read_from_file(io.BytesIO(data[:-1]))
+
+def test_regular_loop_write():
+    '''Test writing a loop where all the fields have a fixed size, which
+    formats a column at a time. This should give the same results as
+    writing each value separately.'''
+    class TestFieldStruct(FieldStruct):
+        desc = [["numi", "", 3, int],
+                [["loop", "f.numi"],
+                 ["li", "", 4, int],
+                 [None, "", 2, str],
+                 ["lf", "", 8, float],
+                 ["le", "", 10, float, {"frmt" : "%+.3e"}],
+                 ["la", "", 6, float, {"array_storage" : True}]]
+        ]
+    t = TestFieldStruct()
+    t.numi = 6
+    vals = [0.0, -1.5, 9.96, 12345.678, 1e-10, -99999.99]
+    for i, v in enumerate(vals):
+        t.li[i] = i * 10
+        t.lf[i] = v
+        t.le[i] = v
+        t.la[i] = v / 10
+    fh = io.BytesIO()
+    t.write_to_file(fh)
+    expect = b'006' + b''.join(
+        t.field[f].bytes((i,)) if f else b'  '
+        for i in range(6) for f in ("li", None, "lf", "le", "la"))
+    assert fh.getvalue() == expect
+    # Check that we can still update a field
+    t.update_field(fh, "lf", 2.5, (3,))
+    t2 = TestFieldStruct()
+    t2.read_from_file(io.BytesIO(fh.getvalue()))
+    assert list(t2.lf)[:4] == [0.0, -1.5, 9.96, 2.5]
+    # Literal values fall back to writing each value
+    t2.lf[0] = NitfLiteral(b'0.0')
+    fh = io.BytesIO()
+    t2.write_to_file(fh)
+    assert fh.getvalue()[3:17] == b'0000  0.0     '
+
+def test_lazy_decode():
+    '''Test reading with lazy_decode, where we only convert fields when
+    they are used.'''
+    class TestFieldStruct(FieldStruct):
+        desc = [["fhdr", "", 4, str],
+                ["numi", "", 3, int],
+                [["loop", "f.numi"],
+                 ["ls", "", 2, str],
+                 ["lf", "", 5, float]],
+                ["fo", "", 4, float, {"optional" : True}],
+        ]
+    data = b'NITF002ab01.50cd-2.0     '
+    t = TestFieldStruct()
+    t.read_from_file(io.BytesIO(data), lazy_decode=True)
+    # numi was needed to read the loop, but nothing else has been decoded
+    assert list(t.field["numi"].value_dict.keys()) == [()]
+    assert len(t.field["lf"].value_dict) == 0
+    assert len(t.field["fhdr"].value_dict) == 0
+    assert t.fhdr == "NITF"
+    assert list(t.ls) == ["ab", "cd"]
+    assert t.lf[0] == 1.5
+    assert t.fo is None
+    assert t.get_raw_bytes("lf", (0,)) == b'01.50'
+    # Unchanged fields are written as they were read
+    fh = io.BytesIO()
+    t.write_to_file(fh)
+    assert fh.getvalue() == data
+    t.lf[0] = 1.5
+    fh = io.BytesIO()
+    t.write_to_file(fh)
+    assert fh.getvalue() == b'NITF002ab1.500cd-2.0     '
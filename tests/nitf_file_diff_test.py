@@ -14,3 +14,26 @@ def test_always_true_handle(print_logging):
     f.write("basic2_nitf.ntf")
     assert diff.compare("basic_nitf.ntf", "basic2_nitf.ntf") == True
 
+
+class IntDiff(NitfDiffHandle):
+    '''Handle any two ints.'''
+    diff_type = int
+    def handle_diff(self, obj1, obj2, nitf_diff):
+        return (True, "IntDiff")
+
+class NegativeIntDiff(IntDiff):
+    '''Inherits diff_type, but only handles negative ints.'''
+    def handle_diff(self, obj1, obj2, nitf_diff):
+        if(obj1 >= 0):
+            return (False, None)
+        return (True, "NegativeIntDiff")
+
+def test_inherited_diff_type():
+    '''A handle that inherits diff_type may decline some objects, so we
+    can't remember the handle for a pair of types.'''
+    hset = NitfDiffHandleSet()
+    hset.add_handle(IntDiff())
+    hset.add_handle(NegativeIntDiff(), priority_order=10)
+    assert hset.handle(1, 1, None) == "IntDiff"
+    assert hset.handle(-1, -1, None) == "NegativeIntDiff"
+    assert hset.handle(1, 1, None) == "IntDiff"
@@ -2,6 +2,7 @@ import cProfile
 from pynitf.nitf_file import NitfFile
 from pynitf.nitf_tre import Tre, tre_tag_to_cls
 from pynitf.nitf_security import security_unclassified
+from pynitf.nitf_segment_data_handle import NitfDataPlaceHolder
 from pynitf_test_support import *
 import pynitf.nitf_field
 import pynitf.nitf_des
@@ -94,6 +95,75 @@ def test_basic_write(isolated_dir):
     check_tre(f2.image_segment[0].tre_list[0], 290)
     print_diag(f2)
 
+def test_lazy_tre(isolated_dir):
+    f = NitfFile()
+    create_image_seg(f)
+    create_tre(f)
+    create_tre(f.image_segment[0], 290)
+    f.write("z.ntf")
+    f2 = NitfFile("z.ntf", lazy_tre=True)
+    assert len(f2.tre_list) == 1
+    assert len(f2.image_segment[0].tre_list) == 1
+    t = f2.find_one_tre("USE00A")
+    # Not parsed until we use it
+    assert t._tre_data_loc is not None
+    assert "field" not in t.__dict__
+    check_tre(t)
+    assert t._tre_data_loc is None
+    check_tre(f2.image_segment[0].find_one_tre("USE00A"), 290)
+    # Writing without parsing the TREs should give the same file
+    f3 = NitfFile("z.ntf", lazy_tre=True)
+    f3.write("z2.ntf")
+    assert f3.tre_list[0]._tre_data_loc is not None
+    assert filecmp.cmp("z.ntf", "z2.ntf", shallow=False)
+    # Changing a value through the field objects gets written out
+    f4 = NitfFile("z.ntf", lazy_tre=True)
+    t = f4.image_segment[0].tre_list[0]
+    t.field["angle_to_north"][()] = 123
+    assert t.angle_to_north == 123
+    f4.write("z3.ntf")
+    check_tre(NitfFile("z3.ntf").image_segment[0].tre_list[0], 123)
+    
+def test_lazy_tre_implementation_field(isolated_dir):
+    '''A TRE that uses tre_implementation_field, read with lazy_tre.'''
+    class TreImplObject(object):
+        def __init__(self, v):
+            self.v = v
+        @classmethod
+        def read_tre_string(cls, s):
+            return cls(s.strip())
+        def tre_string(self):
+            return "{:10s}".format(self.v)
+    class TreImpl(Tre):
+        desc = [["value", "", 10, str]]
+        tre_tag = "TSTIMP"
+        tre_implementation_field = "impl"
+        tre_implementation_class = TreImplObject
+    tre_tag_to_cls.add_cls(TreImpl)
+    f = NitfFile()
+    create_image_seg(f)
+    t = TreImpl()
+    t.impl = TreImplObject("hi there")
+    t.update_raw_field()
+    f.tre_list.append(t)
+    f.write("z.ntf")
+    f2 = NitfFile("z.ntf", lazy_tre=True)
+    t = f2.find_exactly_one_tre("TSTIMP")
+    assert t._tre_data_loc is not None
+    assert t.impl.v == "hi there"
+    assert t._tre_data_loc is None
+    assert t.value == "hi there"
+    f3 = NitfFile("z.ntf")
+    assert f3.find_exactly_one_tre("TSTIMP").impl.v == "hi there"
+    # Replacing the object before the TRE is parsed
+    f4 = NitfFile("z.ntf", lazy_tre=True)
+    t = f4.find_exactly_one_tre("TSTIMP")
+    t.impl = TreImplObject("new value")
+    assert t.impl.v == "new value"
+    f4.write("z2.ntf")
+    assert (NitfFile("z2.ntf").find_exactly_one_tre("TSTIMP").impl.v ==
+            "new value")
+
 def test_large_tre_write(isolated_dir):
     '''Repeat of test_basic_write, but also include a really big TRE that
     forces the use of the second place in the header for TREs'''
@@ -546,3 +616,116 @@ def test_tre_overflow_write_security(isolated_dir):
     assert f3.des_segment[0].security == security_unclassified
     assert f3.des_segment[1].security == security_fake
     
+
+def test_passthrough_write(isolated_dir):
+    '''Check that we copy the data for segments that haven't changed,
+    including ones we don't know how to read.'''
+    f = NitfFile()
+    create_image_seg(f)
+    create_text_segment(f)
+    create_des(f)
+    create_graphic_segment(f)
+    create_res_segment(f)
+    f.write("basic_nitf.ntf")
+    f2 = NitfFile("basic_nitf.ntf")
+    assert isinstance(f2.graphic_segment[0].data, NitfDataPlaceHolder)
+    assert isinstance(f2.res_segment[0].data, NitfDataPlaceHolder)
+    for seg in f2.segments():
+        assert seg.data_source[0] == "basic_nitf.ntf"
+        assert seg.data_source[2] == seg.data_size
+        assert not seg.data_dirty
+    assert f2.image_segment[0].can_passthrough_write
+    assert f2.graphic_segment[0].can_passthrough_write
+    # The DES fields can be changed in place, so we need to write these
+    assert not f2.des_segment[0].can_passthrough_write
+    f2.image_segment[0].subheader.iid2 = "New iid2"
+    f2.des_segment[0].data.q1[0] = 0.5
+    f2.write("copy.ntf")
+    f3 = NitfFile()
+    f3.data_handle_set.add_handle(NitfGraphicRaw)
+    f3.data_handle_set.add_handle(NitfResRaw)
+    f3.read("copy.ntf")
+    assert f3.image_segment[0].subheader.iid2 == "New iid2"
+    assert np.array_equal(f3.image_segment[0].data[:, :, :],
+                          f2.image_segment[0].data[:, :, :])
+    assert f3.des_segment[0].data.q1[0] == 0.5
+    assert f3.graphic_segment[0].data.graphic_data == b'fake graph data'
+    assert f3.res_segment[0].data.res_data == b'fake res data'
+    # Replacing the data marks it as dirty
+    f3.graphic_segment[0].data = f3.graphic_segment[0].data
+    assert f3.graphic_segment[0].data_dirty
+    assert not f3.graphic_segment[0].can_passthrough_write
+    # Can't copy the data to the file we are reading from
+    with pytest.raises(RuntimeError):
+        f3.write("copy.ntf")
+
+def test_update_in_place(isolated_dir):
+    '''Change metadata in an existing file, without rewriting the data.'''
+    f = NitfFile()
+    create_image_seg(f)
+    create_text_segment(f)
+    create_des(f)
+    create_tre(f)
+    create_tre(f.image_segment[0], 290)
+    f.write("z.ntf")
+    f2 = NitfFile.open_for_update("z.ntf")
+    # Nothing changed, so nothing to write
+    assert f2.update() == []
+    iseg = f2.image_segment[0]
+    iseg.subheader.iid2 = "New iid2"
+    iseg.find_exactly_one_tre("USE00A").angle_to_north = 280
+    f2.des_segment[0].data.q1[0] = 0.5
+    written = f2.update()
+    # The image subheader and the DES data. We don't touch the image data
+    assert len(written) == 2
+    _, dstart, dsize = iseg.data_source
+    for pos, sz in written:
+        assert pos + sz <= dstart or pos >= dstart + dsize
+    # Should be the same as writing the file out
+    f2.write("z2.ntf")
+    assert filecmp.cmp("z.ntf", "z2.ntf", shallow=False)
+    f3 = NitfFile("z.ntf")
+    assert f3.image_segment[0].subheader.iid2 == "New iid2"
+    check_tre(f3.image_segment[0].find_exactly_one_tre("USE00A"), 280)
+    check_tre(f3.find_exactly_one_tre("USE00A"))
+    assert f3.des_segment[0].data.q1[0] == 0.5
+    assert np.array_equal(f3.image_segment[0].data[:, :, :],
+                          f.image_segment[0].data[:, :, :])
+    # Changing the size isn't allowed, unless we allow a rewrite
+    f3 = NitfFile.open_for_update("z.ntf")
+    create_tre(f3.image_segment[0], 290)
+    with pytest.raises(RuntimeError):
+        f3.update()
+    f3 = NitfFile.open_for_update("z.ntf")
+    create_tre(f3.image_segment[0], 290)
+    assert f3.update(allow_rewrite=True) == [(0, os.path.getsize("z.ntf"))]
+    assert len(f3.image_segment[0].tre_list) == 2
+    f4 = NitfFile("z.ntf")
+    assert len(f4.image_segment[0].tre_list) == 2
+    assert f4.image_segment[0].subheader.iid2 == "New iid2"
+    assert np.array_equal(f4.image_segment[0].data[:, :, :],
+                          f.image_segment[0].data[:, :, :])
+
+def test_update_tre_overflow(isolated_dir):
+    '''Update a file that has TREs in a TRE_OVERFLOW DES.'''
+    class TreBig(Tre):
+        desc = [["big_field", "", 99999-20, str]]
+        tre_tag = "BIGTRE"
+    tre_tag_to_cls.add_cls(TreBig)    
+    f = NitfFile()
+    create_image_seg(f)
+    f.image_segment[0].tre_list.append(TreBig())
+    f.image_segment[0].tre_list.append(TreBig())
+    create_tre(f.image_segment[0], 290)
+    f.write("z.ntf")
+    f2 = NitfFile.open_for_update("z.ntf")
+    assert len(f2.des_segment) == 1
+    assert f2.update() == []
+    t = [t for t in f2.image_segment[0].tre_list if t.tre_tag == "BIGTRE"][1]
+    t.big_field = "hi there"
+    assert len(f2.update()) == 1
+    f2.write("z2.ntf")
+    assert filecmp.cmp("z.ntf", "z2.ntf", shallow=False)
+    f3 = NitfFile("z.ntf")
+    assert [t.big_field for t in f3.image_segment[0].tre_list
+            if t.tre_tag == "BIGTRE"] == ["", "hi there"]
@@ -0,0 +1,188 @@
+from pynitf.nitf_file import *
+from pynitf.nitf_image import *
+from pynitf.nitf_image_codec import *
+from pynitf.nitf_image_mask import NitfImageMask, BLOCK_NOT_RECORDED
+from pynitf.nitf_block_cache import block_cache
+import pynitf.nitf_image_codec
+from pynitf_test_support import *
+import struct
+import zlib
+import io
+import pytest
+
+class ZlibCodec(NitfImageCodec):
+    '''Simple codec, just for testing. Each record is zlib compressed,
+    with a 4 byte length in front of it.'''
+    ic_list = ("C4", "M4")
+    def record_offsets(self, mm, start, end, nrecord):
+        res = []
+        off = 0
+        for i in range(nrecord):
+            res.append(off)
+            off += 4 + struct.unpack(">I", mm[(start+off):(start+off+4)])[0]
+        return res
+
+    def decode(self, buf, ih, shape):
+        return np.frombuffer(zlib.decompress(buf[4:]),
+                             dtype=ih.dtype).reshape(shape)
+
+def zlib_record(d):
+    t = zlib.compress(np.ascontiguousarray(d).tobytes())
+    return struct.pack(">I", len(t)) + t
+
+def jpeg_record(d):
+    # Turn off chroma subsampling, the bands of our test data don't
+    # have much to do with each other.
+    fh = io.BytesIO()
+    PILImage.fromarray(np.ascontiguousarray(d)).save(fh, format="JPEG",
+                                                     quality=100,
+                                                     subsampling=0)
+    return fh.getvalue()
+
+class ImageWriteCompressed(ImageWriteBlocked):
+    '''Write a blocked image, compressing each record with the given
+    function. If the ic is a masked one, we write a mask table and skip
+    blocks that are all 0.'''
+    def __init__(self, nrow, ncol, data_type, nppbv, nppbh, imode, ic,
+                 compress, **keywords):
+        super().__init__(nrow, ncol, data_type, nppbv, nppbh, imode,
+                         **keywords)
+        self.subheader.ic = ic
+        self.subheader.comrat = "00.0"
+        self.compress = compress
+
+    def write_to_file(self, fh):
+        ih = self.subheader
+        d = np.zeros((ih.number_band, ih.nbpc * ih.nppbv, ih.nbpr * ih.nppbh),
+                     dtype=ih.dtype)
+        d[:, :ih.nrows, :ih.ncols] = self._data
+        # The records for each block. For IMODE B this is each band of
+        # the block, one after the other
+        rec = []
+        for br in range(ih.nbpc):
+            for bc in range(ih.nbpr):
+                blk = d[:, br*ih.nppbv:(br+1)*ih.nppbv,
+                        bc*ih.nppbh:(bc+1)*ih.nppbh]
+                rec.append(list(blk) if ih.imode == "B" else
+                           [blk.transpose(1, 2, 0)])
+        if(not NitfImageMask.has_mask(ih)):
+            for r in rec:
+                for t in r:
+                    fh.write(self.compress(t))
+            return
+        # One mask entry for each block
+        bmr = []
+        data = b""
+        for r in rec:
+            if(all(np.all(t == 0) for t in r)):
+                bmr.append(BLOCK_NOT_RECORDED)
+            else:
+                bmr.append(len(data))
+                for t in r:
+                    data += self.compress(t)
+        NitfImageMask(bmr=np.array(bmr)).write_to_file(fh)
+        fh.write(data)
+
+@pytest.fixture(scope="function")
+def zlib_codec():
+    c = ZlibCodec()
+    NitfImageCodecSet.add_default_handle(c)
+    yield c
+    NitfImageCodecSet.discard_default_handle(c)
+
+def write_compressed(fname, ic, imode, compress, dtype=np.int16, nband=2):
+    nrow, ncol = 20, 23
+    img = ImageWriteCompressed(nrow, ncol, dtype, 8, 8, imode, ic,
+                               compress, numbands=nband)
+    data = np.zeros(img.shape, dtype=dtype)
+    data[:, 2:18, 3:20] = (np.arange(nband * 16 * 17).reshape((nband, 16, 17))
+                           % 200 + 20)
+    img[:, :, :] = data
+    f = NitfFile()
+    f.image_segment.append(NitfImageSegment(img))
+    f.write(fname)
+    return data
+
+def test_no_codec(isolated_dir):
+    '''Without a codec, we fall back to NitfImagePlaceHolder'''
+    data = write_compressed("zlib.ntf", "C4", "B", zlib_record)
+    f = NitfFile("zlib.ntf")
+    assert isinstance(f.image_segment[0].data, NitfImagePlaceHolder)
+
+@pytest.mark.parametrize("ic,imode", [("C4", "B"), ("C4", "P"),
+                                      ("M4", "B"), ("M4", "P")])
+def test_codec(isolated_dir, zlib_codec, ic, imode):
+    data = write_compressed("zlib.ntf", ic, imode, zlib_record)
+    f = NitfFile("zlib.ntf")
+    img = f.image_segment[0].data
+    assert isinstance(img, NitfImageReadBlocked)
+    assert img.codec is zlib_codec
+    block_cache.clear()
+    block_cache.reset_stats()
+    assert np.array_equal(img[:, :, :], data)
+    assert block_cache.misses == 9
+    assert np.array_equal(img[1, 5:15, 2:12], data[1, 5:15, 2:12])
+    assert block_cache.misses == 9
+    assert block_cache.hits == 4
+    # Same results if we don't decode in parallel
+    block_cache.clear()
+    old = pynitf.nitf_image_codec.decode_threads
+    try:
+        pynitf.nitf_image_codec.decode_threads = 1
+        assert np.array_equal(img[:, :, :], data)
+    finally:
+        pynitf.nitf_image_codec.decode_threads = old
+    # And copying the compressed data
+    f.write("zlib2.ntf")
+    assert np.array_equal(NitfFile("zlib2.ntf").image_segment[0].data[:, :, :],
+                          data)
+
+@pytest.mark.parametrize("ic", ["C4", "M4"])
+def test_codec_record_order(isolated_dir, zlib_codec, ic):
+    '''Check the record order against a file laid out by hand. For
+    IMODE B the records are block by block, with the bands of each block
+    one after the other. With a mask there is one entry per block.'''
+    nband, nbpc, nbpr, nppbv, nppbh = 3, 2, 3, 4, 5
+    img = ImageWriteRaw(nbpc * nppbv, nbpr * nppbh, np.int16, nppbv, nppbh,
+                        "B", numbands=nband)
+    img.subheader.ic = ic
+    img.subheader.comrat = "00.0"
+    data = np.zeros(img.shape, dtype=np.int16)
+    blocked = b""
+    bmr = []
+    for n in range(nbpc * nbpr):
+        br, bc = divmod(n, nbpr)
+        bmr.append(len(blocked))
+        for b in range(nband):
+            v = 100 * n + 10 * b + 1
+            data[b, br*nppbv:(br+1)*nppbv, bc*nppbh:(bc+1)*nppbh] = v
+            blocked += zlib_record(np.full((nppbv, nppbh), v,
+                                           dtype=">i2"))
+    if(ic == "M4"):
+        fh = io.BytesIO()
+        NitfImageMask(bmr=np.array(bmr)).write_to_file(fh)
+        blocked = fh.getvalue() + blocked
+    img.raw = blocked
+    f = NitfFile()
+    f.image_segment.append(NitfImageSegment(img))
+    f.write("zlib.ntf")
+    img2 = NitfFile("zlib.ntf").image_segment[0].data
+    assert isinstance(img2, NitfImageReadBlocked)
+    assert np.array_equal(img2[:, :, :], data)
+
+def test_decode_map():
+    assert decode_map(lambda a, b: a + b, [(i, 1) for i in range(20)]) == \
+        list(range(1, 21))
+
+@require_pillow
+@pytest.mark.parametrize("ic,imode,nband", [("C3", "B", 1), ("C3", "P", 3),
+                                            ("M3", "B", 2)])
+def test_jpeg(isolated_dir, ic, imode, nband):
+    data = write_compressed("jpeg.ntf", ic, imode, jpeg_record,
+                            dtype=np.uint8, nband=nband)
+    f = NitfFile("jpeg.ntf")
+    img = f.image_segment[0].data
+    assert isinstance(img, NitfImageReadBlocked)
+    assert isinstance(img.codec, NitfImageCodecJpeg)
+    # JPEG is lossy, so just check that we are close
+    assert np.abs(img[:, :, :].astype(int) - data).max() < 10
@@ -2,9 +2,13 @@ from pynitf.nitf_file import *
 from pynitf.nitf_file_header import *
 from pynitf.nitf_image_subheader import *
 from pynitf.nitf_image import *
+from pynitf.nitf_image_mask import NitfImageMask, BLOCK_NOT_RECORDED
 from pynitf.nitf_file_diff import NitfDiff
 from pynitf_test_support import *
 import io
+import threading
+import time
+import pytest
 
 def test_basic_read():
     t = NitfFileHeader()
@@ -217,6 +221,75 @@ def test_write_on_demand_blocking(isolated_dir):
             for j in range(ncol):
                 assert img3[b, i,j] == data[i,j,b]
     
+@pytest.mark.parametrize("mode,imode",
+     [(NitfImageWriteDataOnDemand.IMAGE_GEN_MODE_BAND, "B"),
+      (NitfImageWriteDataOnDemand.IMAGE_GEN_MODE_ROW_B, "R"),
+      (NitfImageWriteDataOnDemand.IMAGE_GEN_MODE_ROW_P, "P"),
+      (NitfImageWriteDataOnDemand.IMAGE_GEN_MODE_COL_B, "B"),
+      (NitfImageWriteDataOnDemand.IMAGE_GEN_MODE_COL_P, "P")])
+def test_write_gen_mode(isolated_dir, mode, imode):
+    nrow, ncol, nband = 6, 7, 3
+    img = NitfImageWriteNumpy(nrow, ncol, np.int32, numbands=nband,
+                              image_gen_mode=mode)
+    data = np.arange(nband * nrow * ncol, dtype=np.int32).reshape(img.shape)
+    img[:, :, :] = data
+    assert img.subheader.imode == imode
+    f = NitfFile()
+    f.image_segment.append(NitfImageSegment(img))
+    f.write("test.ntf")
+    assert np.array_equal(img.data_written, data)
+    iseg = NitfFile("test.ntf").image_segment[0]
+    img2 = iseg.data
+    assert img2.shape == img.shape
+    assert np.array_equal(img2[:, :, :], data)
+    # Check the layout against the spec
+    ih = iseg.subheader
+    raw = np.zeros((nband * nrow * ncol,), dtype=">i4")
+    for b in range(nband):
+        for i in range(nrow):
+            for j in range(ncol):
+                raw[spec_pixel_offset(ih.imode, b, i, j, nband, ih.nbpr,
+                                      ih.nbpc, ih.nppbv or nrow,
+                                      ih.nppbh or ncol)] = data[b, i, j]
+    _, start, size = iseg.data_source
+    with open("test.ntf", "rb") as fh:
+        fh.seek(start)
+        assert fh.read(size) == raw.tobytes()
+    if(cmd_exists("gdallocationinfo")):
+        for b, i, j in [(0, 0, 0), (1, 4, 5), (2, 5, 6)]:
+            assert int(gdal_value("test.ntf", i, j, b)) == data[b, i, j]
+
+@pytest.mark.parametrize("mode,nbpp",
+     [(NitfImageWriteDataOnDemand.IMAGE_GEN_MODE_BAND, 16),
+      (NitfImageWriteDataOnDemand.IMAGE_GEN_MODE_ROW_B, 16),
+      (NitfImageWriteDataOnDemand.IMAGE_GEN_MODE_COL_P, 16),
+      (NitfImageWriteDataOnDemand.IMAGE_GEN_MODE_BLOCK, 16),
+      (NitfImageWriteDataOnDemand.IMAGE_GEN_MODE_BLOCK, 12)])
+def test_write_parallel(isolated_dir, mode, nbpp):
+    nrow, ncol, nband = 30, 27, 3
+    data = (np.arange(nband * nrow * ncol, dtype=np.uint16) % 4096).reshape((nband, nrow, ncol))
+    threads = set()
+    def write_data(d, bstart, lstart, sstart):
+        threads.add(threading.get_ident())
+        time.sleep(0.001)
+        img.__class__.data_to_write(img, d, bstart, lstart, sstart)
+    for workers in (1, 4):
+        img = NitfImageWriteNumpy(nrow, ncol, np.uint16, numbands=nband,
+                                  image_gen_mode=mode, nppbv=8, nppbh=8,
+                                  imode="P", workers=workers, max_in_flight=3)
+        img.subheader.nbpp = nbpp
+        img[:, :, :] = data
+        img.data_to_write = write_data
+        f = NitfFile()
+        f.image_segment.append(NitfImageSegment(img))
+        create_text_segment(f)
+        f.write("test_%d.ntf" % workers)
+    assert len(threads) > 1
+    assert (open("test_1.ntf", "rb").read() ==
+            open("test_4.ntf", "rb").read())
+    assert np.array_equal(NitfFile("test_4.ntf").image_segment[0].data[:, :, :],
+                          data)
+
 def test_diff(print_logging):
     nband = 1
     nrow = 10
@@ -252,3 +325,288 @@ def test_diff(print_logging):
     assert d.compare("file1.ntf", "file4.ntf") == False
     
     
+
+class ImageNeverRead(NitfImagePlaceHolder):
+    '''Handle that says it can't handle anything, used to check that
+    can_handle is checked before we create the object.'''
+    ncreate = 0
+    def __init__(self, *args, **kwargs):
+        ImageNeverRead.ncreate += 1
+        super().__init__(*args, **kwargs)
+
+    @classmethod
+    def can_handle(cls, subheader, user_subheader):
+        return False
+    
+def test_can_handle():
+    f = NitfFile()
+    f.data_handle_set.add_handle(ImageNeverRead, priority_order=1000)
+    f.read(unit_test_data + "sample.ntf")
+    assert ImageNeverRead.ncreate == 0
+    assert isinstance(f.image_segment[0].data, NitfImageReadNumpy)
+    ih = f.image_segment[0].subheader
+    assert NitfImageReadNumpy.can_handle(ih, None)
+    ih.ic = "C8"
+    assert not NitfImageReadNumpy.can_handle(ih, None)
+    ih.ic = "NC"
+    ih.nbpp = 1
+    assert not NitfImageReadNumpy.can_handle(ih, None)
+
+@pytest.mark.parametrize("imode", ["B", "P", "R", "S"])
+def test_read_blocked(isolated_dir, imode):
+    nrow, ncol, nband = 10, 13, 3
+    img = ImageWriteBlocked(nrow, ncol, np.int16, 4, 5, imode,
+                            numbands=nband)
+    data = np.arange(nband * nrow * ncol, dtype=np.int16).reshape(img.shape)
+    img[:, :, :] = data
+    f = NitfFile()
+    f.image_segment.append(NitfImageSegment(img))
+    f.write("test.ntf")
+    f2 = NitfFile("test.ntf")
+    img2 = f2.image_segment[0].data
+    assert isinstance(img2, NitfImageReadBlocked)
+    assert img2.shape == img.shape
+    assert np.array_equal(img2[:, :, :], data)
+    for ind in [(1, slice(2, 7), slice(3, 12)), (0, 5, 6), 
+                (slice(2, 7), slice(3, 12)), (slice(None), slice(None, None, -2),
+                                              slice(1, None, 3)),
+                (2, slice(1, 3), slice(0, 4)), (1, 9, slice(None)),
+                (slice(-2, None), -1, slice(4, 4))]:
+        assert np.array_equal(img2[ind], data[ind] if len(ind) == 3 else
+                              data[(0,) + ind])
+    assert img2[2, 9, 12] == data[2, 9, 12]
+    with pytest.raises(IndexError):
+        img2[3, 0, 0]
+    # Check that copying the file works
+    f2.write("test2.ntf")
+    f3 = NitfFile("test2.ntf")
+    assert np.array_equal(f3.image_segment[0].data[:, :, :], data)
+
+def spec_pixel_offset(imode, b, i, j, nband, nbpr, nbpc, nppbv, nppbh):
+    '''Offset in pixels of band b, line i, sample j in blocked image
+    data, straight from the IMODE descriptions in MIL-STD-2500C.'''
+    n = (i // nppbv) * nbpr + j // nppbh
+    npix = nppbv * nppbh
+    pix = (i % nppbv) * nppbh + j % nppbh
+    if(imode == "B"):
+        # Each block has all its bands, one after the other
+        return n * npix * nband + b * npix + pix
+    if(imode == "S"):
+        # All the blocks of band 1, then all the blocks of band 2, ...
+        return b * nbpr * nbpc * npix + n * npix + pix
+    if(imode == "P"):
+        return n * npix * nband + pix * nband + b
+    # IMODE R, the bands are interleaved by row within each block
+    return (n * npix * nband + (i % nppbv) * nppbh * nband + b * nppbh +
+            j % nppbh)
+
+@pytest.mark.parametrize("imode", ["B", "P", "R", "S"])
+def test_read_blocked_spec_layout(isolated_dir, imode):
+    '''Check the layout against a file laid out by hand, rather than
+    by our own writer.'''
+    nrow, ncol, nband, nppbv, nppbh = 10, 13, 3, 4, 5
+    img = ImageWriteRaw(nrow, ncol, np.int16, nppbv, nppbh, imode,
+                        numbands=nband)
+    nbpc, nbpr = 3, 3
+    raw = np.zeros((nband * nbpc * nppbv * nbpr * nppbh,), dtype=">i2")
+    for b in range(nband):
+        for i in range(nrow):
+            for j in range(ncol):
+                raw[spec_pixel_offset(imode, b, i, j, nband, nbpr, nbpc,
+                                      nppbv, nppbh)] = b * 1000 + i * 20 + j
+    img.raw = raw.tobytes()
+    f = NitfFile()
+    f.image_segment.append(NitfImageSegment(img))
+    f.write("test.ntf")
+    img2 = NitfFile("test.ntf").image_segment[0].data
+    assert isinstance(img2, NitfImageReadBlocked)
+    for b in range(nband):
+        for i in range(nrow):
+            for j in range(ncol):
+                assert img2[b, i, j] == b * 1000 + i * 20 + j
+
+@pytest.mark.parametrize("imode", ["B", "P", "R", "S"])
+def test_write_blocks(isolated_dir, imode):
+    nrow, ncol, nband = 10, 13, 3
+    data = np.arange(nband * nrow * ncol, dtype=np.int16).reshape((nband, nrow, ncol))
+    max_size = 0
+    def write_block(d, bstart, lstart, sstart):
+        nonlocal max_size
+        max_size = max(max_size, d.size)
+        d[:, :, :] = data[bstart:(bstart+d.shape[0]), lstart:(lstart+d.shape[1]),
+                          sstart:(sstart+d.shape[2])]
+    img = NitfImageWriteDataOnDemand(nrow, ncol, np.int16, numbands=nband,
+               data_callback=write_block, nppbv=4, nppbh=5, imode=imode,
+               image_gen_mode=NitfImageWriteDataOnDemand.IMAGE_GEN_MODE_BLOCK)
+    img2 = ImageWriteBlocked(nrow, ncol, np.int16, 4, 5, imode,
+                             numbands=nband)
+    img2[:, :, :] = data
+    f = NitfFile()
+    f.image_segment.append(NitfImageSegment(img))
+    f.image_segment.append(NitfImageSegment(img2))
+    f.write("test.ntf")
+    assert max_size == (4 * 5 if imode == "S" else 4 * 5 * nband)
+    f2 = NitfFile("test.ntf")
+    d1, d2 = [iseg.data for iseg in f2.image_segment]
+    assert isinstance(d1, NitfImageReadBlocked)
+    assert np.array_equal(d1[:, :, :], data)
+    # Should be exactly the same layout as ImageWriteBlocked
+    assert d1.data_size == d2.data_size
+    assert (d1.mm[d1.data_start:(d1.data_start + d1.data_size)] ==
+            d2.mm[d2.data_start:(d2.data_start + d2.data_size)])
+    # And the layout given in the spec
+    raw = np.zeros((nband * 3 * 4 * 3 * 5,), dtype=">i2")
+    for b in range(nband):
+        for i in range(nrow):
+            for j in range(ncol):
+                raw[spec_pixel_offset(imode, b, i, j, nband, 3, 3, 4,
+                                      5)] = data[b, i, j]
+    assert (d1.mm[d1.data_start:(d1.data_start + d1.data_size)] ==
+            raw.tobytes())
+
+@require_gdal_value
+@pytest.mark.parametrize("imode", ["B", "S"])
+def test_read_blocked_gdal(isolated_dir, imode):
+    '''Check that we agree with GDAL on the layout.'''
+    img = ImageWriteBlocked(10, 13, np.int16, 4, 5, imode, numbands=3)
+    img[:, :, :] = np.arange(3 * 10 * 13, dtype=np.int16).reshape(img.shape)
+    f = NitfFile()
+    f.image_segment.append(NitfImageSegment(img))
+    f.write("test.ntf")
+    img2 = NitfFile("test.ntf").image_segment[0].data
+    for b, i, j in [(0, 0, 0), (1, 5, 7), (2, 9, 12)]:
+        assert int(gdal_value("test.ntf", i, j, b)) == img2[b, i, j]
+
+@pytest.mark.parametrize("imode", ["B", "P", "R", "S"])
+def test_masked_image(isolated_dir, imode):
+    nrow, ncol, nband = 20, 23, 2
+    img = NitfImageWriteMaskedNumpy(nrow, ncol, np.int16, 4, 5, imode=imode,
+                                    pad_value=-1, numbands=nband)
+    data = np.full(img.shape, -1, dtype=np.int16)
+    # Only a few blocks have data. For band 1, the first block only has
+    # data in the second band.
+    data[1, 0:3, 0:4] = 1
+    data[:, 9:13, 12:14] = np.arange(2 * 4 * 2).reshape((2, 4, 2))
+    data[0, 19, 22] = 10
+    img[:, :, :] = data
+    f = NitfFile()
+    f.image_segment.append(NitfImageSegment(img))
+    f.write("masked.ntf")
+    f2 = NitfFile("masked.ntf")
+    img2 = f2.image_segment[0].data
+    assert isinstance(img2, NitfImageReadBlocked)
+    assert f2.image_segment[0].subheader.ic == "NM"
+    assert np.array_equal(img2[:, :, :], data)
+    assert np.array_equal(img2[1, 2:15, 3:20], data[1, 2:15, 3:20])
+    assert img2[1, 19, 22] == -1
+    # All pad blocks should have been skipped
+    nrec = np.count_nonzero(img2.mask.bmr != BLOCK_NOT_RECORDED)
+    if(imode == "S"):
+        # Separate record for each band of a block
+        assert len(img2.mask.bmr) == 5 * 5 * nband
+        assert nrec == 6
+    else:
+        assert len(img2.mask.bmr) == 5 * 5
+        assert nrec == 4
+    assert f2.image_segment[0].data_size < nrow * ncol * nband * 2
+    # And check copying
+    f2.write("masked2.ntf")
+    img3 = NitfFile("masked2.ntf").image_segment[0].data
+    assert np.array_equal(img3[:, :, :], data)
+
+@pytest.mark.parametrize("imode", ["B", "P", "R", "S"])
+def test_masked_spec_layout(isolated_dir, imode):
+    '''Read a masked image laid out by hand. We write the records in
+    reverse order, and leave one out.'''
+    nrow, ncol, nband, nppbv, nppbh = 10, 13, 3, 4, 5
+    img = ImageWriteRaw(nrow, ncol, np.int16, nppbv, nppbh, imode,
+                        numbands=nband)
+    img.subheader.ic = "NM"
+    nbpc, nbpr = 3, 3
+    data = np.zeros(img.shape, dtype=np.int16)
+    full = np.zeros((nband * nbpc * nppbv * nbpr * nppbh,), dtype=">i2")
+    for b in range(nband):
+        for i in range(nrow):
+            for j in range(ncol):
+                data[b, i, j] = b * 1000 + i * 20 + j
+                full[spec_pixel_offset(imode, b, i, j, nband, nbpr, nbpc,
+                                       nppbv, nppbh)] = data[b, i, j]
+    # One record per block, except IMODE S which has one per band and
+    # block.
+    nrec = nbpc * nbpr * (nband if imode == "S" else 1)
+    rec = full.reshape((nrec, -1))
+    bmr = [BLOCK_NOT_RECORDED] * nrec
+    blocked = b""
+    for r in reversed(range(nrec)):
+        if(r != 1):
+            bmr[r] = len(blocked)
+            blocked += rec[r].tobytes()
+    # Record 1 is block 1 (band 0 for IMODE S), which is then all pad
+    if(imode == "S"):
+        data[0, 0:4, 5:10] = 0
+    else:
+        data[:, 0:4, 5:10] = 0
+    fh = io.BytesIO()
+    NitfImageMask(bmr=np.array(bmr)).write_to_file(fh)
+    img.raw = fh.getvalue() + blocked
+    f = NitfFile()
+    f.image_segment.append(NitfImageSegment(img))
+    f.write("test.ntf")
+    img2 = NitfFile("test.ntf").image_segment[0].data
+    assert isinstance(img2, NitfImageReadBlocked)
+    assert np.array_equal(img2[:, :, :], data)
+
+@pytest.mark.parametrize("imode", ["B", "P", "R", "S"])
+def test_packed_masked(isolated_dir, imode):
+    nrow, ncol = 9, 11
+    img = NitfImageWriteMaskedNumpy(nrow, ncol, np.uint16, 4, 4, imode=imode,
+                                    numbands=3)
+    img.subheader.nbpp = 12
+    img.subheader.abpp = 12
+    data = np.zeros(img.shape, dtype=np.uint16)
+    data[:, 5:7, 3:10] = np.arange(3 * 2 * 7).reshape((3, 2, 7)) * 97 % 4096
+    data[1, 0, 0] = 5
+    img[:, :, :] = data
+    f = NitfFile()
+    f.image_segment.append(NitfImageSegment(img))
+    f.write("packed.ntf")
+    img2 = NitfFile("packed.ntf").image_segment[0].data
+    assert isinstance(img2, NitfImageReadBlocked)
+    assert np.array_equal(img2[:, :, :], data)
+
+def test_packed_image(isolated_dir):
+    nrow, ncol = 9, 11
+    bimg = NitfImageWriteNumpy(nrow, ncol, np.bool_)
+    bdata = (np.arange(nrow * ncol).reshape((1, nrow, ncol)) % 3) == 0
+    bimg[:, :, :] = bdata
+    img12 = NitfImageWriteNumpy(nrow, ncol, np.uint16, numbands=3)
+    img12.subheader.nbpp = 12
+    img12.subheader.abpp = 12
+    data12 = np.arange(3 * nrow * ncol).reshape(img12.shape) * 13 % 4096
+    img12[:, :, :] = data12
+    mimg = NitfImageWriteMaskedNumpy(nrow, ncol, np.uint16, 4, 4, imode="P",
+                                     numbands=2)
+    mimg.subheader.nbpp = 12
+    mimg.subheader.abpp = 12
+    mdata = np.zeros(mimg.shape, dtype=np.uint16)
+    mdata[:, 5:7, 3:10] = 4095
+    mimg[:, :, :] = mdata
+    f = NitfFile()
+    f.image_segment.append(NitfImageSegment(bimg))
+    f.image_segment.append(NitfImageSegment(img12))
+    timg = NitfImageWriteNumpy(nrow, ncol, np.uint16, numbands=3, nppbv=4,
+             nppbh=4, imode="P",
+             image_gen_mode=NitfImageWriteDataOnDemand.IMAGE_GEN_MODE_BLOCK)
+    timg.subheader.nbpp = 12
+    timg.subheader.abpp = 12
+    timg[:, :, :] = data12
+    f.image_segment.append(NitfImageSegment(mimg))
+    f.image_segment.append(NitfImageSegment(timg))
+    f.write("packed.ntf")
+    f2 = NitfFile("packed.ntf")
+    assert f2.image_segment[0].data_size == (nrow * ncol + 7) // 8
+    assert f2.image_segment[1].data_size == 3 * ((nrow * ncol * 12 + 7) // 8)
+    for iseg, d in zip(f2.image_segment, (bdata, data12, mdata, data12)):
+        assert isinstance(iseg.data, NitfImageReadBlocked)
+        assert np.array_equal(iseg.data[:, :, :], d)
+        assert np.array_equal(iseg.data[:, 2:6, 4:9], d[:, 2:6, 4:9])
@@ -0,0 +1,76 @@
+from pynitf.nitf_layout_cache import *
+from pynitf.nitf_field import _compiled_code, _compiled_expr, _compile_expr
+from pynitf_test_support import *
+import pynitf
+import os
+import subprocess
+import sys
+
+def test_layout_cache(isolated_dir):
+    fname = save_layout_cache("cache")
+    assert os.path.exists(fname)
+    assert fname == layout_cache_file("cache")
+    assert layout_cache_key() in fname
+    assert load_layout_cache("cache")
+    assert not load_layout_cache("no_cache")
+    # We don't trust a cache file that others can write to
+    os.chmod(fname, 0o666)
+    assert not load_layout_cache("cache")
+    os.chmod(fname, 0o644)
+    assert load_layout_cache("cache")
+    # A corrupt cache file should just be ignored
+    with open(fname, "wb") as fh:
+        fh.write(b"bad data")
+    assert not load_layout_cache("cache")
+
+def test_layout_cache_compile(isolated_dir):
+    # Check that we use a compiled expression from the cache
+    k = ("f.foo_for_layout_cache_test + 1", "eval")
+    save_layout_cache("cache")
+    assert k not in _compiled_code
+    _compile_expr(*k)
+    save_layout_cache("cache")
+    del _compiled_code[k]
+    del _compiled_expr[k]
+    assert load_layout_cache("cache")
+    assert k in _compiled_code
+
+def test_layout_cache_env(isolated_dir):
+    # Check the handling of PYNITF_CACHE_DIR in a new process
+    env = dict(os.environ, PYNITF_CACHE_DIR=os.path.abspath("cache"))
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(pynitf.__file__)),
+         env.get("PYTHONPATH", "")])
+    cmd = [sys.executable, "-c",
+           "import pynitf; print(pynitf.load_layout_cache())"]
+    r = subprocess.run(cmd, env=env, capture_output=True, check=True)
+    assert r.stdout.strip() == b"False"
+    assert os.path.exists(layout_cache_file("cache"))
+    r = subprocess.run(cmd, env=env, capture_output=True, check=True)
+    assert r.stdout.strip() == b"True"
+    # Using a module that a bare import doesn't load compiles new layouts,
+    # which then get added to the cache
+    cmd = [sys.executable, "-c",
+           "import pynitf; from pynitf.nitf_field import _compiled_code; "
+           "n = len(_compiled_code); pynitf.TreBANDSB(); "
+           "print(n == len(_compiled_code))"]
+    r = subprocess.run(cmd, env=env, capture_output=True, check=True)
+    assert r.stdout.strip() == b"False"
+    r = subprocess.run(cmd, env=env, capture_output=True, check=True)
+    assert r.stdout.strip() == b"True"
+
+def test_layout_cache_load_all(isolated_dir):
+    # Saving the cache directly includes the modules we haven't loaded yet
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(pynitf.__file__)),
+         env.get("PYTHONPATH", "")])
+    env.pop("PYNITF_CACHE_DIR", None)
+    cmd = [sys.executable, "-c",
+           "import pynitf; pynitf.save_layout_cache('cache'); "
+           "from pynitf.nitf_field import _compiled_code; "
+           "import pynitf.nitf_tre_bandsb; "
+           "n = len(_compiled_code); pynitf.TreBANDSB(); "
+           "print(n == len(_compiled_code))"]
+    r = subprocess.run(cmd, env=env, capture_output=True, check=True)
+    assert r.stdout.strip() == b"True"
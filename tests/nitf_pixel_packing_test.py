@@ -0,0 +1,30 @@
+from pynitf.nitf_pixel_packing import *
+from pynitf_test_support import *
+import mmap
+
+def test_pack_1bit():
+    d = np.array([1, 0, 1, 1, 0, 0, 0, 1, 1, 1], dtype=np.uint8)
+    t = pack_pixels(d, 1)
+    assert t == b'\xb1\xc0'
+    assert np.array_equal(unpack_pixels(t, 1, len(d)), d)
+
+def test_pack_12bit():
+    d = np.array([0xABC, 0x123, 0xFFF], dtype=np.uint16)
+    t = pack_pixels(d, 12)
+    assert t == b'\xab\xc1\x23\xff\xf0'
+    assert np.array_equal(unpack_pixels(t, 12, 3), d)
+    assert np.array_equal(unpack_pixels(t, 12, 2), d[0:2])
+    d = np.random.randint(0, 4096, size=(17, 13)).astype(np.uint16)
+    t = pack_pixels(d, 12)
+    assert len(t) == packed_size(17 * 13, 12)
+    assert np.array_equal(unpack_pixels(t, 12, 17 * 13).reshape(d.shape), d)
+
+def test_unpack_mmap(isolated_dir):
+    '''Check that we can unpack directly from a mmap'''
+    d = np.random.randint(0, 4096, size=(101,)).astype(np.uint16)
+    with open("test.dat", "wb") as fh:
+        fh.write(b"abc")
+        fh.write(pack_pixels(d, 12))
+    with open("test.dat", "rb") as fh:
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        assert np.array_equal(unpack_pixels(memoryview(mm)[3:], 12, 101), d)
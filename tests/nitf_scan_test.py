@@ -0,0 +1,81 @@
+from pynitf.nitf_scan import *
+from pynitf.nitf_file import NitfFile
+from pynitf_test_support import *
+
+def test_scan_headers(isolated_dir):
+    f = NitfFile()
+    f.file_header.ftitle = "Scan test"
+    create_image_seg(f, iid1 = "img1")
+    create_text_segment(f)
+    create_image_seg(f, iid1 = "img2")
+    f.image_segment[1].subheader.icords = "G"
+    f.image_segment[1].subheader.igeolo = "1" * 60
+    create_tre(f.image_segment[0])
+    f.write("z.ntf")
+    r = scan_headers("z.ntf")
+    assert r["file_name"] == "z.ntf"
+    assert r["ftitle"] == "Scan test"
+    assert len(r["image_segment"]) == 2
+    assert r["image_segment"][0] == {'iid1': 'img1',
+                                     'idatim': '20160101120000',
+                                     'nrows': 9, 'ncols': 10,
+                                     'igeolo': None, 'ic': 'NC'}
+    assert r["image_segment"][1]["iid1"] == "img2"
+    assert r["image_segment"][1]["igeolo"] == "1" * 60
+    r = scan_headers("z.ntf", fields=["iid1", "nbands", "irepband"],
+                     file_fields=["numi", "lish"])
+    assert r["numi"] == 2
+    assert len(r["lish"]) == 2
+    assert r["image_segment"][0] == {"iid1" : "img1", "nbands" : 1,
+                                     "irepband" : ["R"]}
+    with pytest.raises(RuntimeError):
+        scan_headers("z.ntf", fields=["not_a_field"])
+
+def test_read_many(isolated_dir):
+    flist = []
+    for i in range(4):
+        f = NitfFile()
+        create_image_seg(f, iid1 = "img%d" % i)
+        create_tre(f.image_segment[0])
+        f.write("z%d.ntf" % i)
+        flist.append("z%d.ntf" % i)
+    with open("bad.ntf", "wb") as fh:
+        fh.write(b"not a nitf file")
+    flist.append("bad.ntf")
+    for workers in (0, 2):
+        res = {r.path : r for r in read_many(flist, workers=workers)}
+        assert len(res) == 5
+        assert not res["bad.ntf"].ok
+        assert res["bad.ntf"].value is None
+        for i in range(4):
+            r = res["z%d.ntf" % i]
+            assert r.ok
+            assert r.value["image_segment"][0]["iid1"] == "img%d" % i
+    res = {r.path : r for r in read_many(flist, workers=2, mode="headers",
+                                         lazy_tre=True)}
+    assert res["z1.ntf"].value["image_segment"][0].iid1 == "img1"
+    assert res["z1.ntf"].value["file_header"].numi == 1
+    res = {r.path : r for r in read_many(flist[:1], workers=1,
+                                         mode="summary")}
+    assert "NITF File Summary" in res["z0.ntf"].value
+    with pytest.raises(RuntimeError):
+        list(read_many(flist, mode="bad_mode"))
+
+def test_read_many_tre_warning(isolated_dir):
+    f = NitfFile()
+    create_image_seg(f)
+    create_tre(f.image_segment[0])
+    f.write("z.ntf")
+    # Corrupt the TRE so we get a TreWarning when reading
+    with open("z.ntf", "rb") as fh:
+        d = fh.read()
+    d = d.replace(b"USE00A00107270", b"USE00A00107abc")
+    with open("z.ntf", "wb") as fh:
+        fh.write(d)
+    with pytest.warns(TreWarning):
+        r = list(read_many(["z.ntf"], workers=0, mode="summary"))
+    assert r[0].ok
+    r = list(read_many(["z.ntf"], workers=0, mode="summary",
+                       tre_warning_as_error=True))
+    assert not r[0].ok
+    assert "TreWarning" in r[0].error
@@ -1,5 +1,6 @@
 from pynitf.priority_handle_set import *
 import copy
+import pytest
 
 class PriorityHandleSet1(PriorityHandleSet):
     '''Test class 1'''
@@ -41,3 +42,62 @@ def test_priority_set():
     assert(next(i3)[0] in ("p2h1", "p2h2"))
     assert(len(p2) == 5)
     
+class PriorityHandleSet3(PriorityHandleSet):
+    '''Test class 3, handles are (name, set of keys handled). The
+    handle_applies prefilters on the key.'''
+    def __init__(self):
+        super().__init__()
+        self.ncall = 0
+
+    def dispatch_key(self, key):
+        return key
+
+    def handle_applies(self, h, key):
+        return key in h[1]
+
+    def handle_h(self, h, key):
+        self.ncall += 1
+        return (True, h[0])
+
+def test_dispatch_key():
+    p = PriorityHandleSet3()
+    p.add_handle(("h1", frozenset(["a"])))
+    p.add_handle(("h2", frozenset(["b"])))
+    p.add_handle(("h3", frozenset(["a", "b"])), priority_order=-1)
+    assert p.handle("a") == "h1"
+    assert p.handle("b") == "h2"
+    # We shouldn't have tried the handle for the other key
+    assert p.ncall == 2
+    # Changing the handles should update the cached dispatch list
+    p.add_handle(("h4", frozenset(["a"])), priority_order=10)
+    assert p.handle("a") == "h4"
+    p.discard_handle(("h1", frozenset(["a"])))
+    p.discard_handle(("h4", frozenset(["a"])))
+    assert p.handle("a") == "h3"
+    with pytest.raises(RuntimeError):
+        p.handle("c")
+
+class PriorityHandleSet4(PriorityHandleSet3):
+    '''Test class 4, like PriorityHandleSet3 but handles only look at the
+    key so we can remember the handle found.'''
+    def handle_type_only(self, h):
+        return True
+    
+def test_handle_type_only():
+    p = PriorityHandleSet4()
+    p.add_handle(("h1", frozenset(["a"])), priority_order=10)
+    p.add_handle(("h2", frozenset(["a", "b"])))
+    p.add_handle(("h3", frozenset(["b"])))
+    assert p.handle("a") == "h1"
+    assert p.ncall == 1
+    assert p.handle("a") == "h1"
+    assert p.ncall == 2
+    # Still check for multiple handles at the same level
+    with pytest.raises(RuntimeError):
+        p.handle("b")
+    with pytest.raises(RuntimeError):
+        p.handle("b")
+    p.discard_handle(("h3", frozenset(["b"])))
+    assert p.handle("b") == "h2"
+    p.discard_handle(("h1", frozenset(["a"])))
+    assert p.handle("a") == "h2"
@@ -36,6 +36,13 @@ except ImportError:
     # Ok if we don't have h5py, we just can't execute this code
     have_h5py = False
 
+# Same thing for Pillow, which is only needed for JPEG compressed images.
+try:
+    from PIL import Image as PILImage
+    have_pillow = True
+except ImportError:
+    have_pillow = False
+
 # All warnings about TREs are treated as errors.
 #
 # With the exception:
@@ -109,6 +116,50 @@ def create_image_seg(f, security = None, iid1 = '', row_offset = 10, bias = 0,
     f.image_segment.append(iseg)
     return iseg
 
+class ImageWriteBlocked(NitfImageWriteNumpy):
+    '''Write a blocked image with the given imode. This is just for
+    testing NitfImageReadBlocked.'''
+    def __init__(self, nrow, ncol, data_type, nppbv, nppbh, imode,
+                 **keywords):
+        super().__init__(nrow, ncol, data_type, **keywords)
+        ih = self.subheader
+        ih.imode = imode
+        ih.nppbv = nppbv
+        ih.nppbh = nppbh
+        ih.nbpc = (nrow + nppbv - 1) // nppbv
+        ih.nbpr = (ncol + nppbh - 1) // nppbh
+
+    def write_to_file(self, fh):
+        ih = self.subheader
+        d = np.zeros((ih.number_band, ih.nbpc * ih.nppbv, ih.nbpr * ih.nppbh),
+                     dtype=ih.dtype)
+        d[:, :ih.nrows, :ih.ncols] = self._data
+        def blk(br, bc):
+            return d[:, br*ih.nppbv:(br+1)*ih.nppbv,
+                     bc*ih.nppbh:(bc+1)*ih.nppbh]
+        if(ih.imode == "S"):
+            for b in range(ih.number_band):
+                for br in range(ih.nbpc):
+                    for bc in range(ih.nbpr):
+                        fh.write(blk(br, bc)[b].tobytes())
+        else:
+            for br in range(ih.nbpc):
+                for bc in range(ih.nbpr):
+                    if(ih.imode == "P"):
+                        fh.write(blk(br, bc).transpose(1, 2, 0).tobytes())
+                    elif(ih.imode == "R"):
+                        fh.write(blk(br, bc).transpose(1, 0, 2).tobytes())
+                    else:
+                        # IMODE B, all the bands of the block one after
+                        # the other
+                        fh.write(blk(br, bc).tobytes())
+
+class ImageWriteRaw(ImageWriteBlocked):
+    '''Write the bytes in raw as the image data, for testing reading
+    data laid out by hand.'''
+    def write_to_file(self, fh):
+        fh.write(self.raw)
+
 def create_tre(f, angle_to_north = 270):
     '''Create a sample TRE. We use TreUSE00A because it is a simple TRE. You
     can pass in different values to angle_to_north to get "different" TREs.
@@ -356,3 +407,6 @@ def nitf_sample_rip(nitf_sample_files):
     
 require_h5py = pytest.mark.skipif(not have_h5py,
       reason="need to have h5py available to run.")
+
+require_pillow = pytest.mark.skipif(not have_pillow,
+      reason="need to have Pillow available to run.")